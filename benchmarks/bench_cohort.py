@@ -0,0 +1,113 @@
+"""bench_cohort.py
+
+Benchmark of cohort selection on the indexed metadata store (metadata.py).
+
+Writes synthetic metadata (see synthetic.py) for `--households` households,
+standardizes it with `preprocessing.normalize_metadata` and selects cohorts
+for several cutoffs, end date windows, cnae ranges and minimum coverages, both
+with the original Polars filter chain of `select_cohort` (kept below as the
+reference, re-reading the standardized file each time) and with
+`MetadataStore.cohort`. Checks that both give the same rows and reports the
+time per cohort of each and the time to open the store.
+
+Usage:
+    python benchmarks/bench_cohort.py --households 100000
+"""
+
+import argparse
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+import polars as pl
+
+import paths  # noqa: F401  (puts the repository root on sys.path, before the imports below)
+import synthetic
+from metadata import COHORT_COLUMNS, MetadataStore
+from preprocessing import _datetime, normalize_metadata
+
+# (cutoff, end_date_range, cnae_range, min_days)
+QUERIES = [
+    (date(2021, 6, 1), (date(2021, 6, 1), date(3020, 3, 1)), ('9699', '9900'), 365),
+    (date(2020, 3, 14), (date(2020, 3, 14), date(3020, 3, 1)), ('9699', '9900'), 365),
+    (date(2021, 6, 1), (date(2021, 6, 1), date(2022, 12, 31)), ('9699', '9900'), 180),
+    (date(2019, 1, 1), (date(2019, 1, 1), date(3020, 3, 1)), ('0', '9999'), 730),
+    (date(2022, 1, 1), (date(2022, 1, 1), date(2023, 6, 30)), ('4711', '5611'), 0),
+]
+
+
+def select_cohort_polars(metadata_standardized, cutoff, end_date_range, cnae_range, min_days):
+    """Original implementation: filter and deduplicate the whole standardized metadata."""
+    metadata_standardized = pl.read_parquet(metadata_standardized)
+    metadata_post_covid = metadata_standardized.filter([
+        pl.col("end_date").is_between(_datetime(end_date_range[0], time_zone="UTC"), _datetime(end_date_range[1], time_zone="UTC"))
+    ])
+    metadata_post_covid_households = metadata_post_covid.filter(
+        (pl.col('cnae') > cnae_range[0]),
+        (pl.col('cnae') < cnae_range[1])
+    )
+    cutoff = _datetime(cutoff)
+    metadata_post_covid_households = (
+        metadata_post_covid_households
+        .with_columns(pl.max_horizontal(pl.col("start_date"), cutoff).alias("ref"))
+        .with_columns((pl.col("end_date") - pl.col("ref")).dt.total_days().alias("days_from_ref_to_end"))
+    )
+    metadata_post_covid_households_year = metadata_post_covid_households.filter(pl.col('days_from_ref_to_end') >= min_days)
+    group_cols = [c for c in metadata_post_covid_households_year.columns
+                  if c not in ["start_date", "end_date", "ref", "days_from_ref_to_end"]]
+    metadata_post_covid_households_year = (
+        metadata_post_covid_households_year
+        .with_columns(
+            pl.when(pl.col("start_date") < cutoff)
+              .then(cutoff)
+              .otherwise(pl.col("start_date"))
+              .cast(pl.Date)
+              .alias("start_date")
+        )
+        .with_columns(pl.max_horizontal(pl.col("start_date"), cutoff).alias("ref"))
+        .with_columns((pl.col("end_date") - pl.col("ref")).dt.total_days().alias("days_from_ref_to_end"))
+        .sort(group_cols + ["days_from_ref_to_end"], descending=[False]*len(group_cols) + [True])
+        .group_by(group_cols, maintain_order=True)
+        .head(1)
+    )
+    return metadata_post_covid_households_year.select(COHORT_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cohort selection on the metadata store')
+    parser.add_argument('--households', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        metadata_csv, standardized = Path(tmp) / 'metadata.csv', Path(tmp) / 'metadata_standardized.parquet'
+        synthetic.write_metadata(metadata_csv, synthetic.household_ids(args.households))
+        normalize_metadata(metadata_csv, standardized)
+
+        start = time.perf_counter()
+        store = MetadataStore(standardized)
+        open_seconds = time.perf_counter() - start
+
+        polars_seconds = store_seconds = 0.0
+        for query in QUERIES:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                expected = select_cohort_polars(standardized, *query)
+                polars_seconds += time.perf_counter() - start
+                start = time.perf_counter()
+                cohort = store.cohort(*query)
+                store_seconds += time.perf_counter() - start
+            if not cohort.equals(expected):
+                raise AssertionError(f"Cohorts differ for {query}:\n{cohort}\n{expected}")
+            print(f"{query[0]} {query[2]} min_days={query[3]}: {cohort.height} rows")
+
+    runs = len(QUERIES) * args.repeat
+    print(f"{len(store)} metadata rows, store opened in {open_seconds * 1000:.1f}ms")
+    print(f"Polars filter chain: {polars_seconds / runs * 1000:.1f}ms per cohort")
+    print(f"Metadata store: {store_seconds / runs * 1000:.1f}ms per cohort")
+    print(f"Speedup {polars_seconds / store_seconds:.1f}x, all cohorts identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""bench_dst_flag.py
+
+Benchmark of the summer-time flag in simel/4_goi2imp.py.
+
+Times the vectorized `dst_flags` and the per-timestamp `check_dst` on every
+hour of a range of years and checks that both give the same flags.
+tests/test_goi2imp.py compares them on the DST transition days.
+
+Usage:
+    python benchmarks/bench_dst_flag.py --start 2015 --end 2030
+"""
+
+import argparse
+import importlib.util
+import time
+
+import numpy as np
+import pandas as pd
+
+from paths import SIMEL_DIR
+
+_spec = importlib.util.spec_from_file_location('goi2imp', SIMEL_DIR / '4_goi2imp.py')
+goi2imp = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(goi2imp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the DST flag')
+    parser.add_argument('--start', type=int, default=2015)
+    parser.add_argument('--end', type=int, default=2030)
+    args = parser.parse_args()
+
+    index = pd.date_range(f'{args.start}-01-01', f'{args.end}-12-31 23:00', freq='h')
+
+    start = time.perf_counter()
+    expected = index.map(goi2imp.check_dst)
+    per_row = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = goi2imp.dst_flags(index)
+    vectorized = time.perf_counter() - start
+
+    if not np.array_equal(np.asarray(result), np.asarray(expected)):
+        raise AssertionError("DST flag differs from check_dst")
+    print(f"{len(index)} hours: check_dst {per_row:.3f}s, dst_flags {vectorized * 1000:.1f}ms "
+          f"({per_row / vectorized:,.0f}x), results identical")
+
+
+if __name__ == "__main__":
+    main()
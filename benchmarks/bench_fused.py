@@ -0,0 +1,110 @@
+"""bench_fused.py
+
+Benchmark of the fused SIMEL runner (simel/run_fused.py) against the separate
+stage scripts.
+
+Writes synthetic per-user files (the generator of bench_user2raw.py) and takes
+each one to an imputed series twice: through the stage functions of
+2_user2raw.py, 3_raw2goi.py and 4_goi2imp.py, which write and read back the raw
+and consumption CSVs in between, and through `process_user`, which keeps them in
+memory. The imputed files, the goi7_log rows and the imputation statistics
+(except their timestamp) must be identical. Reports files/s of each run.
+
+Usage:
+    python benchmarks/bench_fused.py --users 40 --days 365
+"""
+
+import argparse
+import filecmp
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import paths  # noqa: F401  (puts simel/ on sys.path)
+
+# Imported by name (not from a file spec) so that the stage modules resolve each other
+user2raw = importlib.import_module('2_user2raw')
+raw2goi = importlib.import_module('3_raw2goi')
+goi2imp = importlib.import_module('4_goi2imp')
+run_fused = importlib.import_module('run_fused')
+bench_user2raw = importlib.import_module('bench_user2raw')
+
+
+def run_stages(id_files, root):
+    """Stages 2-4 with the intermediate CSVs on disk, as the separate scripts run them."""
+    raw_dir, goi_dir, imp_dir = (root / name for name in ('raw', 'goi', 'imp'))
+    goi7_rows, stats = [], []
+    for file_path in id_files:
+        user2raw.process_file(file_path, raw_dir)
+        goi7_rows.append(raw2goi.process_file(raw_dir / os.path.basename(file_path), goi_dir))
+        stats.append(goi2imp.impute_file(goi_dir / os.path.basename(file_path), imp_dir))
+    return goi7_rows, stats
+
+
+def run_in_memory(id_files, root):
+    """Stages 2-4 of each user file in one call, without intermediate files."""
+    goi7_rows, stats = [], []
+    for file_path in id_files:
+        _, goi7_row, stats_df = run_fused.process_user(file_path, root / 'raw', root / 'goi', root / 'imp', False)
+        goi7_rows.append(goi7_row)
+        stats.append(stats_df)
+    return goi7_rows, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the fused SIMEL runner')
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--days', type=int, default=365)
+    args = parser.parse_args()
+
+    # Stage messages are not part of the comparison; keep them off the console
+    logging.disable(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / 'id').mkdir()
+        for seed in range(args.users):
+            (tmp / 'id' / f'ES{seed:016d}XX0F.csv').write_text('\n'.join(bench_user2raw.user_lines(args.days, seed)) + '\n')
+        id_files = sorted(str(path) for path in (tmp / 'id').iterdir())
+        for run in ('stages', 'fused'):
+            for name in ('raw', 'goi', 'imp'):
+                (tmp / run / name).mkdir(parents=True)
+
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            start = time.perf_counter()
+            expected = run_stages(id_files, tmp / 'stages')
+            stages = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = run_in_memory(id_files, tmp / 'fused')
+            fused = time.perf_counter() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = sys.__stdout__
+
+        if result[0] != expected[0]:
+            raise AssertionError("goi7_log rows differ")
+        drop_time = lambda frames: pd.concat(frames, ignore_index=True).drop(columns='dt')
+        if not drop_time(result[1]).equals(drop_time(expected[1])):
+            raise AssertionError("Imputation statistics differ")
+        match, mismatch, errors = filecmp.cmpfiles(tmp / 'stages' / 'imp', tmp / 'fused' / 'imp',
+                                                   sorted(os.listdir(tmp / 'stages' / 'imp')), shallow=False)
+        if mismatch or errors or len(match) != len(id_files):
+            raise AssertionError(f"Imputed files differ: {mismatch + errors}")
+        if os.listdir(tmp / 'fused' / 'raw') or os.listdir(tmp / 'fused' / 'goi'):
+            raise AssertionError("Fused run wrote intermediate files")
+
+    for label, seconds in (('separate stages', stages), ('fused', fused)):
+        print(f"{label}: {seconds:.2f}s, {len(id_files) / seconds:.1f} files/s")
+    print(f"Speedup {stages / fused:.2f}x, {len(match)} imputed files identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""bench_imputation.py
+
+Benchmark of the week-lag imputation in simel/4_goi2imp.py.
+
+Builds long hourly series with scattered missing hours and multi-week outages,
+imputes them with the original row-by-row implementation (kept below as the
+reference) and with `impute_kwh`, checks that both give identical values and
+reports the per-series time of each.
+
+Usage:
+    python benchmarks/bench_imputation.py --years 3 --gap-fraction 0.1
+"""
+
+import argparse
+import importlib.util
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from paths import SIMEL_DIR
+
+_spec = importlib.util.spec_from_file_location('goi2imp', SIMEL_DIR / '4_goi2imp.py')
+goi2imp = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(goi2imp)
+
+
+def impute_rowwise(df):
+    """Original implementation: `df.apply` with a week-by-week search per missing hour."""
+    def impute_kwh(row):
+        if pd.notna(row['kWh']):
+            return row['kWh']
+
+        target_dt = row.name
+        day_of_week = target_dt.weekday()
+        hour_of_day = target_dt.hour
+
+        past_values = []
+        future_values = []
+
+        past_dt = target_dt - timedelta(weeks=1)
+        future_dt = target_dt + timedelta(weeks=1)
+
+        while past_dt >= df.index.min() or future_dt <= df.index.max():
+            if past_dt >= df.index.min() and past_dt.weekday() == day_of_week and past_dt.hour == hour_of_day and pd.notna(df.loc[past_dt, 'kWh']):
+                past_values.append(df.loc[past_dt, 'kWh'])
+
+            if future_dt <= df.index.max() and future_dt.weekday() == day_of_week and future_dt.hour == hour_of_day and pd.notna(df.loc[future_dt, 'kWh']):
+                future_values.append(df.loc[future_dt, 'kWh'])
+
+            if len(past_values) >= 1 and len(future_values) >= 1:
+                break
+
+            past_dt -= timedelta(weeks=1)
+            future_dt += timedelta(weeks=1)
+
+        if len(past_values) > 0 and len(future_values) > 0:
+            return round((past_values[0] + future_values[0]) / 2, 3)
+        elif len(past_values) > 0:
+            return past_values[0]
+        elif len(future_values) > 0:
+            return future_values[0]
+        else:
+            return round(df['kWh'].mean(), 3)
+
+    return df.apply(impute_kwh, axis=1)
+
+
+def gappy_series(hours, gap_fraction, outages, seed):
+    """Hourly frame (kWh, fl, imp) with random missing hours and week-long outages."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2021-01-01', periods=hours, freq='h')
+    kwh = rng.gamma(2.0, 0.2, hours).round(3)
+    kwh[rng.random(hours) < gap_fraction] = np.nan
+    for start in rng.integers(0, hours, outages):
+        kwh[start:start + int(rng.integers(24, 24 * 7 * 6))] = np.nan
+    # Hours of the week that are never observed fall back to the series mean
+    kwh[rng.integers(0, 168)::168] = np.nan
+    return pd.DataFrame({'kWh': kwh, 'fl': 0, 'imp': np.isnan(kwh).astype(int)}, index=index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark week-lag imputation')
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--gap-fraction', type=float, default=0.1)
+    parser.add_argument('--outages', type=int, default=4)
+    parser.add_argument('--series', type=int, default=3)
+    args = parser.parse_args()
+
+    hours = int(args.years * 365 * 24)
+    rowwise_total = vectorized_total = 0.0
+    for seed in range(args.series):
+        df = gappy_series(hours, args.gap_fraction, args.outages, seed)
+
+        start = time.perf_counter()
+        expected = impute_rowwise(df)
+        rowwise = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = goi2imp.impute_kwh(df['kWh'])
+        vectorized = time.perf_counter() - start
+
+        if not (result.equals(expected) and result.dtype == expected.dtype):
+            raise AssertionError(f"Series {seed}: vectorized imputation differs from the row-wise reference")
+
+        rowwise_total += rowwise
+        vectorized_total += vectorized
+        print(f"Series {seed}: {hours} hours, {int(df['kWh'].isna().sum())} missing - "
+              f"row-wise {rowwise:.3f}s, vectorized {vectorized * 1000:.1f}ms ({rowwise / vectorized:,.0f}x)")
+
+    print(f"Total: row-wise {rowwise_total:.3f}s, vectorized {vectorized_total:.3f}s "
+          f"({rowwise_total / vectorized_total:,.0f}x), results identical")
+
+
+if __name__ == "__main__":
+    main()
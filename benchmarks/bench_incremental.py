@@ -0,0 +1,131 @@
+"""bench_incremental.py
+
+Benchmark of the incremental mode of simel/run_fused.py.
+
+Writes synthetic daily SIMEL files (one file per type and day, hourly rows of
+a random subset of a pool of supply points, with the date, flag, in, out and
+DCM columns where 2_user2raw.py expects them). The first `--days` days are
+processed with a full run, then one more day of files is delivered (and, with
+`--redeliver`, one of the earlier files is delivered again with other values)
+and processed with `--incremental`. A full rebuild over all the files in a
+separate directory tree must give the same imputed files. Reports the time of
+the delta run and of the full rebuild.
+
+Usage:
+    python benchmarks/bench_incremental.py --days 30 --ids 100 --pool 1000 --redeliver
+"""
+
+import argparse
+import filecmp
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+RUN_FUSED = Path(__file__).resolve().parents[1] / 'simel' / 'run_fused.py'
+
+# Columns of each SIMEL type (before the original_file and file_prefix columns added by step 1)
+LAYOUT = {
+    'F5D': {'width': 11, 'dt': 1, 'fl': 2, 'in': 3, 'out': 4, 'dcm': 9, 'seconds': False},
+    'P5D': {'width': 7, 'dt': 1, 'fl': 2, 'in': 3, 'out': 4, 'dcm': None, 'seconds': False},
+    'A5D': {'width': 11, 'dt': 1, 'fl': 2, 'in': 3, 'out': 4, 'dcm': 9, 'seconds': False},
+    'P1D': {'width': 22, 'dt': 2, 'fl': 3, 'in': 4, 'out': 6, 'dcm': 20, 'seconds': True},
+}
+
+
+def write_simel_file(simel_dir, file_type, day, ids, pool, rng):
+    """One daily SIMEL file of `file_type` with `ids` supply points drawn from a pool of `pool`."""
+    layout = LAYOUT[file_type]
+    cups = rng.choice([f'ES{i:016d}XX0F' for i in range(pool)], size=ids, replace=False)
+    hours = pd.date_range(day, periods=24, freq='h').strftime('%Y/%m/%d %H:%M' + (':00' if layout['seconds'] else ''))
+    n = ids * 24
+    columns = {j: 0 for j in range(layout['width'])}
+    columns[0] = np.repeat(cups, 24)
+    columns[layout['dt']] = np.tile(hours, ids)
+    columns[layout['fl']] = 0
+    columns[layout['in']] = rng.integers(0, 3000, n)
+    columns[layout['out']] = 0
+    if layout['dcm'] is not None:
+        columns[layout['dcm']] = rng.integers(0, 4, n)
+    if layout['dt'] == 2:
+        columns[1] = 'R'
+    path = simel_dir / f'{file_type}_0021_{pd.Timestamp(day):%Y%m%d}.0'
+    pd.DataFrame(columns).to_csv(path, sep=';', header=False, index=False)
+
+
+def write_day(simel_dir, day, ids, pool, seed):
+    rng = np.random.default_rng(seed)
+    for file_type in LAYOUT:
+        write_simel_file(simel_dir, file_type, day, ids, pool, rng)
+
+
+def write_config(root):
+    config = {
+        'simel_dir': str(root / 'simel'), 'id_dir': str(root / 'id'), 'raw_dir': str(root / 'raw'),
+        'goiener_dir': str(root / 'goi'), 'imputation_dir': str(root / 'imp'),
+        'simel2id_log': str(root / 'logs' / 'simel2id.log'), 'id2raw_log': str(root / 'logs' / 'id2raw.log'),
+        'raw2goiener_log': str(root / 'logs' / 'raw2goi.log'), 'goi7_log': str(root / 'logs' / 'goi7.csv'),
+        'goi72imp_log': str(root / 'logs' / 'goi72imp.csv'), 'imputed_log': str(root / 'logs' / 'imputed.csv'),
+        'telemetry_log': str(root / 'logs' / 'telemetry.jsonl'),
+    }
+    (root / 'logs').mkdir(parents=True)
+    (root / 'config.json').write_text(json.dumps(config))
+    return root / 'config.json'
+
+
+def run_fused(config_path, *flags):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(RUN_FUSED), '--config', str(config_path), *flags],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the incremental SIMEL run')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--ids', type=int, default=100)
+    parser.add_argument('--pool', type=int, default=1000)
+    parser.add_argument('--redeliver', action='store_true', help='Deliver one earlier file again with other values')
+    args = parser.parse_args()
+
+    days = pd.date_range('2022-01-01', periods=args.days + 1, freq='D')
+    with tempfile.TemporaryDirectory() as tmp:
+        delta_root, full_root = Path(tmp) / 'delta', Path(tmp) / 'full'
+        delta_config, full_config = write_config(delta_root), write_config(full_root)
+        for root in (delta_root, full_root):
+            (root / 'simel').mkdir()
+
+        # Full run over the first days, then a new day (and optionally a redelivery)
+        for seed, day in enumerate(days[:-1]):
+            write_day(delta_root / 'simel', day, args.ids, args.pool, seed)
+        initial = run_fused(delta_config, '--keep-intermediates')
+        write_day(delta_root / 'simel', days[-1], args.ids, args.pool, args.days)
+        if args.redeliver:
+            rng = np.random.default_rng(args.days + 1)
+            write_simel_file(delta_root / 'simel', 'F5D', days[args.days // 2], args.ids, args.pool, rng)
+        delta = run_fused(delta_config, '--incremental')
+
+        # Full rebuild over the same files
+        for path in (delta_root / 'simel').iterdir():
+            (full_root / 'simel' / path.name).write_bytes(path.read_bytes())
+        full = run_fused(full_config)
+
+        names = sorted(os.listdir(full_root / 'imp'))
+        match, mismatch, errors = filecmp.cmpfiles(full_root / 'imp', delta_root / 'imp', names, shallow=False)
+        if mismatch or errors or sorted(os.listdir(delta_root / 'imp')) != names:
+            raise AssertionError(f"Imputed files differ from the full rebuild: {mismatch + errors}")
+
+    print(f"Initial full run ({args.days} days): {initial:.2f}s")
+    print(f"Incremental run (1 new day{', 1 redelivered file' if args.redeliver else ''}): {delta:.2f}s")
+    print(f"Full rebuild ({args.days + 1} days): {full:.2f}s")
+    print(f"Speedup {full / delta:.1f}x, {len(match)} imputed files identical")
+
+
+if __name__ == "__main__":
+    main()
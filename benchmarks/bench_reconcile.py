@@ -0,0 +1,210 @@
+"""bench_reconcile.py
+
+Benchmark of the source-priority reconciliation in simel/3_raw2goi.py.
+
+Writes synthetic raw files in the layout produced by 2_user2raw.py
+(`dt;fl;n;[type;in;out;dcm]*n`, padded to 50 fields) with a mix of single and
+competing entries, ties on the minimum DCM, missing DCMs, identical and
+conflicting values of other types, and a few malformed rows. Each file is read
+as `process_file` reads it and reconciled with the original row-by-row loop
+(kept below as the reference) and with `reconcile_rows`; the resulting CSV
+text, the goi7_log counters and `max_entries` must be identical.
+
+Usage:
+    python benchmarks/bench_reconcile.py --rows 200000 --files 3
+"""
+
+import argparse
+import importlib.util
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from paths import SIMEL_DIR
+
+_spec = importlib.util.spec_from_file_location('raw2goi', SIMEL_DIR / '3_raw2goi.py')
+raw2goi = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(raw2goi)
+
+TYPES = ['P5D', 'F5D', 'P1D', 'A5D', 'B5D', 'RF5D', 'F1', 'P1']
+
+
+def reconcile_rowwise(df, file_name):
+    """Original implementation: a row-by-row loop that logs and skips the rows it cannot process."""
+    processed_data = []
+    index = []
+    counts = dict.fromkeys(raw2goi.COUNTERS, 0)
+    max_entries = 0
+
+    for idx, row in df.iterrows():
+        try:
+            dt = row[0]
+            fl = row[1]
+            entries = row[2]
+            max_entries = max(max_entries, entries)
+
+            for i in range(entries):
+                entry_type = row[3 + i * 4]
+                if entry_type in ['A5D', 'B5D', 'F5D', 'P5D', 'RF5D']:
+                    row[4 + i * 4] /= 1000
+
+            kWh = None
+            
+            if entries == 1:
+                kWh = row[4]
+                counts['unique_count'] += 1
+            else:
+                p5d_ins = []
+                f5d_ins = []
+                f5d_dcmin = float('inf')
+                f5d_in_min = None
+                p1d_ins = []
+                p1d_dcmin = float('inf')
+                p1d_in_min = None
+                a5d_ins = []
+                all_ins = []
+
+                for i in range(entries):
+                    entry_type = row[3 + i * 4]
+                    entry_in = row[4 + i * 4]
+                    entry_dcm = row[6 + i * 4]
+                    all_ins.append(entry_in)
+
+                    if entry_type == 'P5D':
+                        p5d_ins.append(entry_in)
+                    elif entry_type == 'F5D':
+                        f5d_ins.append(entry_in)
+                        if entry_dcm < f5d_dcmin:
+                            f5d_dcmin = entry_dcm
+                            f5d_in_min = entry_in
+                    elif entry_type == 'P1D':
+                        p1d_ins.append(entry_in)
+                        if entry_dcm < p1d_dcmin:
+                            p1d_dcmin = entry_dcm
+                            p1d_in_min = entry_in
+                    elif entry_type == 'A5D':
+                        a5d_ins.append(entry_in)
+                
+                if p5d_ins:
+                    if len(p5d_ins) == 1:
+                        kWh = p5d_ins[0]
+                        counts['p5d_wins'] += 1
+                    else:
+                        kWh = sum(p5d_ins) / len(p5d_ins)
+                        counts['p5d_mean'] += 1
+                elif f5d_ins:
+                    if len(f5d_ins) == 1:
+                        kWh = f5d_ins[0]
+                        counts['f5d_wins'] += 1
+                    else:
+                        min_f5d_ins = [entry_in for entry_in in f5d_ins if entry_in == f5d_in_min]
+                        if len(min_f5d_ins) == 1:
+                            kWh = f5d_in_min
+                            counts['f5d_min'] += 1
+                        else:
+                            kWh = sum(min_f5d_ins) / len(min_f5d_ins)
+                            counts['f5d_mean'] += 1
+                elif p1d_ins:
+                    if len(p1d_ins) == 1:
+                        kWh = p1d_ins[0]
+                        counts['p1d_wins'] += 1
+                    else:
+                        min_p1d_ins = [entry_in for entry_in in p1d_ins if entry_in == p1d_in_min]
+                        if len(min_p1d_ins) == 1:
+                            kWh = p1d_in_min
+                            counts['p1d_min'] += 1
+                        else:
+                            kWh = sum(min_p1d_ins) / len(min_p1d_ins)
+                            counts['p1d_mean'] += 1
+                elif a5d_ins:
+                    if len(a5d_ins) == 1:
+                        kWh = a5d_ins[0]
+                        counts['a5d_wins'] += 1
+                    else:
+                        kWh = sum(a5d_ins) / len(a5d_ins)
+                        counts['a5d_mean'] += 1
+                else:
+                    if all(x == all_ins[0] for x in all_ins):
+                        kWh = all_ins[0]
+                        counts['equal_in'] += 1
+                    else:
+                        counts['skipped'] += 1
+                        continue
+
+            if kWh is not None:
+                processed_data.append([dt, fl, kWh])
+                index.append(idx)
+        except Exception as row_error:
+            logging.error(f"Error processing row {idx} in {file_name}: {row_error}")
+
+    output_df = pd.DataFrame(processed_data, columns=['dt', 'fl', 'kWh'], index=index)
+    return output_df, counts, max_entries
+
+
+def raw_lines(rows, seed, float_values=False):
+    """Lines of a synthetic raw file with `rows` (dt, fl) groups."""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2021-01-01T00:00')
+    entries = rng.choice([1, 2, 3, 4, 6], size=rows, p=[0.5, 0.25, 0.15, 0.07, 0.03])
+    lines = []
+    for r in range(rows):
+        dt = str(start + np.timedelta64(r, 'h')).replace('-', '/').replace('T', ' ')
+        n = int(entries[r])
+        # Most groups share one source type, as the real files do
+        types = rng.choice(TYPES, size=n) if rng.random() < 0.4 else [rng.choice(TYPES)] * n
+        base = int(rng.integers(0, 3000))
+        fields = [dt, str(int(rng.random() < 0.01)), str(n)]
+        for i in range(n):
+            value = base if rng.random() < 0.6 else int(rng.integers(0, 3000))
+            value = f'{value / 7:.3f}' if float_values and rng.random() < 0.1 else str(value)
+            dcm = '' if types[i] == 'P5D' or rng.random() < 0.05 else str(int(rng.integers(0, 4)))
+            fields += [types[i], value, '0', dcm]
+        if rng.random() < 0.001:
+            # Malformed row: entry count out of range
+            fields[2] = str(rng.choice([0, 12]))
+        lines.append(';'.join(fields + [''] * (50 - len(fields))))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark source-priority reconciliation')
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--files', type=int, default=3)
+    args = parser.parse_args()
+
+    # Row errors of malformed rows are expected; keep them off the console
+    logging.disable(logging.ERROR)
+
+    rowwise_total = vectorized_total = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in range(args.files):
+            path = Path(tmp) / f'{seed}.csv'
+            path.write_text('\n'.join(raw_lines(args.rows, seed, float_values=seed % 2 == 1)) + '\n')
+            df = pd.read_csv(path, header=None, delimiter=';', low_memory=False)
+
+            start = time.perf_counter()
+            expected = reconcile_rowwise(df, path.name)
+            rowwise = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = raw2goi.reconcile_rows(df, path.name)
+            vectorized = time.perf_counter() - start
+
+            if result[1:] != expected[1:] or result[0].to_csv(sep=',') != expected[0].to_csv(sep=','):
+                raise AssertionError(f"File {seed}: vectorized reconciliation differs from the row-wise reference")
+
+            rowwise_total += rowwise
+            vectorized_total += vectorized
+            print(f"File {seed}: {len(df)} rows, {len(result[0])} reconciled - "
+                  f"row-wise {rowwise:.3f}s, vectorized {vectorized * 1000:.1f}ms ({rowwise / vectorized:,.0f}x)")
+
+    print(f"Total: row-wise {rowwise_total:.3f}s, vectorized {vectorized_total:.3f}s "
+          f"({rowwise_total / vectorized_total:,.0f}x), results identical")
+
+
+if __name__ == "__main__":
+    main()
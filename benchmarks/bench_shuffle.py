@@ -0,0 +1,130 @@
+"""bench_shuffle.py
+
+Benchmark of the SIMEL to per-id split in simel/1_simel2user.py.
+
+Writes synthetic daily SIMEL files (24 hourly rows per supply point, several
+types, a pool of supply point ids shared across files) and splits them into
+per-id files twice: with the original per-id `FileLock` appends (kept below as
+the reference) and with the two-phase shuffle (`split_by_id`). Every id file
+must hold the same lines in both runs; the order of the chunks coming from
+different SIMEL files is not compared, since the original writes them in
+completion order. Reports files/s and MB/s of each run.
+
+Usage:
+    python benchmarks/bench_shuffle.py --files 200 --ids 2000 --pool 20000
+"""
+
+import argparse
+import importlib
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from filelock import FileLock
+
+import paths  # noqa: F401  (puts simel/ on sys.path)
+
+# Imported by name (not from a file spec) so that worker processes can unpickle its functions
+simel2user = importlib.import_module('1_simel2user')
+
+TYPES = ['F5D', 'P5D', 'A5D', 'P1D']
+
+
+def process_file_locked(file_path, id_dir):
+    """Original implementation: append every id group to `<id>.csv` under a file lock."""
+    try:
+        file_name = os.path.basename(file_path)
+        file_prefix = file_name.split('_')[0]
+        df = pd.read_csv(file_path, sep=';', header=None)
+        df.insert(0, 'original_file', file_name)
+        df.insert(1, 'file_prefix', file_prefix)
+        grouped = df.groupby(df.columns[2])
+        for id_value, group in grouped:
+            id_file_path = os.path.join(id_dir, f"{id_value}.csv")
+            lock_file_path = f"{id_file_path}.lock"
+            with FileLock(lock_file_path):
+                if os.path.exists(id_file_path):
+                    group.to_csv(id_file_path, sep=';', mode='a', header=False, index=False)
+                else:
+                    group.to_csv(id_file_path, sep=';', mode='w', header=False, index=False)
+        return f"Processed {file_name}"
+    except Exception as e:
+        return f"Failed to process {file_name}: {e}"
+
+
+def write_simel_files(simel_dir, files, ids, pool, seed):
+    """Daily SIMEL files with `ids` supply points each, drawn from `pool` ids."""
+    rng = np.random.default_rng(seed)
+    cups = np.array([f'ES{i:016d}XX0F' for i in range(pool)])
+    hours = [f'2021/01/01 {h:02d}:00' for h in range(24)]
+    for f in range(files):
+        file_type = TYPES[f % len(TYPES)]
+        day = pd.Timestamp('2021-01-01') + pd.Timedelta(days=f // len(TYPES))
+        chosen = rng.choice(cups, size=ids, replace=False)
+        n = ids * 24
+        df = pd.DataFrame({
+            0: np.repeat(chosen, 24),
+            1: [h.replace('2021/01/01', day.strftime('%Y/%m/%d')) for h in hours] * ids,
+            2: 0,
+            3: rng.integers(0, 3000, n),
+            4: 0,
+            5: rng.integers(0, 100, n),
+            # A column with gaps is read back as float (e.g. '12.0')
+            6: np.where(rng.random(n) < 0.1, np.nan, rng.integers(0, 100, n)),
+            7: 'R',
+            8: rng.integers(0, 4, n),
+        })
+        df.to_csv(simel_dir / f'{file_type}_0021_{day:%Y%m%d}_{f:05d}.0', sep=';', header=False, index=False)
+
+
+def read_id_files(id_dir):
+    """Map id file name -> multiset of its lines."""
+    return {os.path.basename(path): Counter(Path(path).read_bytes().splitlines())
+            for path in glob(os.path.join(id_dir, '*.csv'))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SIMEL to per-id split')
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--ids', type=int, default=2000)
+    parser.add_argument('--pool', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=max(1, os.cpu_count() - 1))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        simel_dir, locked_dir, shuffle_dir = (Path(tmp) / name for name in ('simel', 'locked', 'shuffle'))
+        for directory in (simel_dir, locked_dir, shuffle_dir):
+            directory.mkdir()
+        write_simel_files(simel_dir, args.files, args.ids, args.pool, seed=0)
+        simel_files = sorted(glob(str(simel_dir / '*')))
+        mb = sum(os.path.getsize(path) for path in simel_files) / 1e6
+        print(f"{len(simel_files)} SIMEL files, {mb:.1f} MB, {args.workers} workers")
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(process_file_locked, simel_files, [str(locked_dir)] * len(simel_files)))
+        locked = time.perf_counter() - start
+
+        start = time.perf_counter()
+        simel2user.split_by_id(simel_files, str(shuffle_dir), args.workers)
+        shuffle = time.perf_counter() - start
+
+        expected, result = read_id_files(locked_dir), read_id_files(shuffle_dir)
+        if result != expected:
+            raise AssertionError("Two-phase shuffle output differs from the locked appends")
+        if any(name.startswith('.spill-') for name in os.listdir(shuffle_dir)):
+            raise AssertionError("Spill directory was not removed")
+
+    for label, seconds in (('locked appends', locked), ('two-phase shuffle', shuffle)):
+        print(f"{label}: {seconds:.2f}s, {len(simel_files) / seconds:.1f} files/s, {mb / seconds:.1f} MB/s")
+    print(f"Speedup {locked / shuffle:.1f}x, {len(result)} id files identical")
+
+
+if __name__ == "__main__":
+    main()
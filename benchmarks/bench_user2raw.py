@@ -0,0 +1,97 @@
+"""bench_user2raw.py
+
+Benchmark of the raw-file builder in simel/2_user2raw.py.
+
+Writes synthetic per-user files in the layout produced by 1_simel2user.py
+(`original_file;type;...`, with the date, flag, in, out and DCM columns of
+each SIMEL type where `file_type_map` expects them). The files overlap in
+time across types, repeat lines (as when a SIMEL file is delivered twice),
+flag the repeated DST hour with fl = 1 and include lines of unknown types and
+lines too short to hold a reading. Each file is converted with the original
+line-by-line code (`build_rows`) and with `build_rows_vectorized`, and the
+output lines must be identical.
+
+Usage:
+    python benchmarks/bench_user2raw.py --days 365 --files 3
+"""
+
+import argparse
+import importlib.util
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from paths import SIMEL_DIR
+
+_spec = importlib.util.spec_from_file_location('user2raw', SIMEL_DIR / '2_user2raw.py')
+user2raw = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(user2raw)
+
+FILE_TYPE_MAP = user2raw.FILE_TYPE_MAP
+
+
+def user_lines(days, seed):
+    """Lines of a synthetic user file covering `days` days."""
+    rng = np.random.default_rng(seed)
+    hours = np.datetime64('2021-01-01T01:00') + np.arange(days * 24) * np.timedelta64(1, 'h')
+    lines = []
+    for file_type in rng.choice(list(FILE_TYPE_MAP), size=4, replace=False):
+        dt_col, fl_col, in_col, out_col, dcm_col = FILE_TYPE_MAP[file_type]
+        width = max(col for col in FILE_TYPE_MAP[file_type] if col is not None) + 2
+        # Each source covers a random stretch of the period
+        start = int(rng.integers(0, len(hours) // 2))
+        for hour in hours[start:start + int(rng.integers(len(hours) // 4, len(hours)))]:
+            fields = [f'{file_type}_0001_20210101.0', file_type] + ['x'] * (width - 2)
+            dt = str(hour).replace('-', '/').replace('T', ' ')
+            fields[dt_col] = dt + (':00' if file_type in user2raw.DT_SECONDS_TYPES else '')
+            # Hours of the last Sunday of October are delivered twice, the second with fl = 1
+            fields[fl_col] = '1' if rng.random() < 0.002 else '0'
+            fields[in_col] = str(int(rng.integers(0, 3000)))
+            fields[out_col] = '0'
+            if dcm_col is not None:
+                fields[dcm_col] = '' if rng.random() < 0.05 else str(int(rng.integers(0, 4)))
+            lines.append(';'.join(fields))
+            if rng.random() < 0.05:
+                lines.append(lines[-1])
+        lines.append(f'{file_type}_0001_20210101.0;{file_type};x;2021/01/01 00:00')
+    lines.append('X5D_0001_20210101.0;X5D;x;2021/01/01 00:00;0;1;0')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the raw-file builder')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--files', type=int, default=3)
+    args = parser.parse_args()
+
+    rowwise_total = vectorized_total = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in range(args.files):
+            path = Path(tmp) / f'{seed}.csv'
+            path.write_text('\n'.join(user_lines(args.days, seed)) + '\n')
+            lines = path.read_text().split('\n')[:-1]
+
+            start = time.perf_counter()
+            expected = user2raw.build_rows(lines, FILE_TYPE_MAP)
+            rowwise = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = user2raw.build_rows_vectorized(lines, FILE_TYPE_MAP)
+            vectorized = time.perf_counter() - start
+
+            if result != expected:
+                raise AssertionError(f"File {seed}: vectorized raw rows differ from the line-by-line reference")
+
+            rowwise_total += rowwise
+            vectorized_total += vectorized
+            print(f"File {seed}: {len(lines)} lines, {len(result)} raw rows - "
+                  f"line-by-line {rowwise:.3f}s, vectorized {vectorized * 1000:.1f}ms ({rowwise / vectorized:,.0f}x)")
+
+    print(f"Total: line-by-line {rowwise_total:.3f}s, vectorized {vectorized_total:.3f}s "
+          f"({rowwise_total / vectorized_total:,.0f}x), results identical")
+
+
+if __name__ == "__main__":
+    main()
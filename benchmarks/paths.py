@@ -0,0 +1,16 @@
+"""paths.py
+
+Import paths shared by the benchmarks.
+
+Importing this module puts simel/ (the SIMEL stage modules, imported by name
+with importlib since their names start with a digit) and the repository root
+(the pipeline modules and telemetry.py) at the front of sys.path.
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SIMEL_DIR = ROOT / 'simel'
+
+sys.path[:0] = [str(path) for path in (SIMEL_DIR, ROOT) if str(path) not in sys.path]
@@ -0,0 +1,238 @@
+"""suite.py
+
+End-to-end benchmark suite on synthetic data (see synthetic.py).
+
+For every size (number of households; the SIMEL files cover as many supply
+points) the suite writes a synthetic input tree and times:
+- `extractor.build_index`, `extractor.extract` (every other household) and
+  `extractor.decompress_stream`: `Extractor` on the archive;
+- `csvmerger.rows`, `csvmerger.fast` and `csvmerger.parquet`: `CSVMerger`
+  over every household CSV of the archive;
+- `pipeline.<stage>`: each stage of pipeline.py (preprocessing.py and
+  processing.py) in a fresh working directory, plus `pipeline.total`;
+- `simel.<stage>`: each phase of the SIMEL scripts 1-4 run one after the
+  other, plus `simel.total`, and `simel.fused` for run_fused.py on the same
+  files.
+
+The in-process cases take the best of `--repeat` runs. The pipeline and the
+SIMEL scripts run once, in child processes, and their per-stage figures come
+from the telemetry log they write (see telemetry.py). Every result holds wall
+and CPU seconds, peak RSS and, where known, files/s and rows. The results are
+saved as JSON with the commit, the Python version and the CPU count.
+`--baseline` compares them with a previous results file and lists the cases
+more than `--tolerance` slower or faster.
+
+Usage:
+    python benchmarks/suite.py --sizes 50,200,1000 --output before.json
+    python benchmarks/suite.py --sizes 50,200,1000 --baseline before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+import polars as pl
+
+# First: puts the repository root and simel/ on sys.path for the imports below
+from paths import ROOT, SIMEL_DIR
+import synthetic
+from csvmerger import CSVMerger
+from extractors import Extractor
+from telemetry import measure
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+# Module and entry point of each SIMEL script, in pipeline order
+SIMEL_SCRIPTS = [('1_simel2user', 'main'), ('2_user2raw', 'main'), ('3_raw2goi', 'main'), ('4_goi2imp', 'process_files')]
+
+
+def result(case, size, record, **extra):
+    """One result row from a `measure` or telemetry record."""
+    return {'case': case, 'size': size, 'seconds': record['wall_s'], 'cpu_s': record.get('cpu_s'),
+            'peak_rss_mb': record.get('peak_rss_mb'), **extra}
+
+
+def best_of(repeat, func, setup=None):
+    """Measure record of the fastest of `repeat` calls of `func`; `setup` runs untimed before each."""
+    records = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()), measure() as record:
+            func()
+        records.append(record)
+    return min(records, key=lambda r: r['wall_s'])
+
+
+def telemetry_stages(path):
+    """Stage records of a telemetry log, in order."""
+    with open(path) as infile:
+        records = [json.loads(line) for line in infile]
+    return [r for r in records if r['event'] == 'stage' and not r.get('skipped')]
+
+
+def bench_extractor(data_dir, work, size, repeat):
+    archive = str(data_dir / synthetic.ARCHIVE_NAME)
+    index = work / 'index.csv'
+    record = best_of(repeat, lambda: Extractor(archive, str(work)).build_index(index))
+    households = [entry['id'] for entry in Extractor(archive, str(work)).load_index(index)]
+    results = [result('extractor.build_index', size, record, files=len(households))]
+
+    wanted = households[::2]
+    record = best_of(repeat, lambda: Extractor(archive, str(work / 'extract')).extract_households(wanted, index_path=index),
+                     setup=lambda: shutil.rmtree(work / 'extract', ignore_errors=True))
+    results.append(result('extractor.extract', size, record, files=len(wanted)))
+
+    record = best_of(repeat, lambda: Extractor(archive, str(work / 'all')).decompress_tzst(stream=True),
+                     setup=lambda: shutil.rmtree(work / 'all', ignore_errors=True))
+    results.append(result('extractor.decompress_stream', size, record, files=len(households)))
+    return results, sorted(str(p) for p in (work / 'all' / synthetic.MEMBER_DIR).glob('*.csv'))
+
+
+def bench_csvmerger(csv_files, work, size, repeat):
+    work.mkdir(parents=True)
+    results = []
+    for case, output, fast in [('csvmerger.rows', 'merged.csv', False), ('csvmerger.fast', 'merged.csv', True),
+                               ('csvmerger.parquet', 'merged.parquet', False)]:
+        output = work / output
+        merged = {}
+        record = best_of(repeat, lambda: merged.update(CSVMerger(csv_files, None, str(output)).combine_csv_files(
+                             fast=fast, schema_overrides={'kWh': pl.Float64})),
+                         setup=lambda: output.unlink(missing_ok=True))
+        results.append(result(case, size, record, files=len(csv_files), rows=merged['rows'], bytes_out=merged['bytes']))
+    return results
+
+
+def bench_pipeline(data_dir, work, size):
+    """pipeline.py from scratch in `work`, with the synthetic inputs linked into work/data."""
+    (work / 'data').mkdir(parents=True)
+    for name in ('metadata.csv', synthetic.ARCHIVE_NAME):
+        (work / 'data' / name).symlink_to(data_dir / name)
+    telemetry_log = work / 'telemetry.jsonl'
+    with measure() as total:
+        subprocess.run([sys.executable, str(ROOT / 'pipeline.py'), '--telemetry', str(telemetry_log)],
+                       cwd=work, check=True, stdout=subprocess.DEVNULL)
+    results = [result(f"pipeline.{r['stage']}", size, r, rows=r.get('rows_out'), bytes_in=r.get('bytes_in'))
+               for r in telemetry_stages(telemetry_log)]
+    results.append(result('pipeline.total', size, total))
+    return results
+
+
+def run_simel(func_name, module, config_path):
+    code = (f"import importlib, sys; sys.path.insert(0, {str(SIMEL_DIR)!r}); "
+            f"importlib.import_module({module!r}).{func_name}({str(config_path)!r})")
+    subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def simel_results(telemetry_log, size):
+    return [result(f"simel.{r['stage']}", size, r, files=r.get('files'), files_per_s=r.get('files_per_s'),
+                   rows=r.get('tasks', {}).get('rows_in'))
+            for r in telemetry_stages(telemetry_log)]
+
+
+def bench_simel(simel_dir, work, size):
+    config_path = synthetic.write_simel_config(work / 'scripts', simel_dir)
+    with measure() as total:
+        for module, func_name in SIMEL_SCRIPTS:
+            run_simel(func_name, module, config_path)
+    results = simel_results(work / 'scripts' / 'logs' / 'telemetry.jsonl', size)
+    results.append(result('simel.total', size, total))
+
+    config_path = synthetic.write_simel_config(work / 'fused', simel_dir)
+    subprocess.run([sys.executable, str(SIMEL_DIR / 'run_fused.py'), '--config', str(config_path)],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results += [r for r in simel_results(work / 'fused' / 'logs' / 'telemetry.jsonl', size)
+                if r['case'] == 'simel.fused']
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print every case next to its baseline; returns the cases slower than the tolerance."""
+    base = {(r['case'], r['size']): r for r in baseline['results']}
+    slower = []
+    print(f"\n{'case':<34}{'size':>7}{'seconds':>10}{'baseline':>10}{'ratio':>8}")
+    for r in results:
+        b = base.get((r['case'], r['size']))
+        if b is None or not b['seconds']:
+            continue
+        ratio = r['seconds'] / b['seconds']
+        status = 'slower' if ratio > 1 + tolerance else 'faster' if ratio < 1 - tolerance else ''
+        if status == 'slower':
+            slower.append(r)
+        print(f"{r['case']:<34}{r['size']:>7}{r['seconds']:>10.3f}{b['seconds']:>10.3f}{ratio:>8.2f}  {status}")
+    return slower
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks on synthetic GoiEner data')
+    parser.add_argument('--sizes', default='50,200', help='comma-separated numbers of households')
+    parser.add_argument('--simel-days', type=int, default=7)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each in-process case (the best is kept)')
+    parser.add_argument('--only', action='append', choices=['extractor', 'csvmerger', 'pipeline', 'simel'],
+                        help='run only these groups (repeatable)')
+    parser.add_argument('--output', type=Path, help='results file (default: benchmarks/results/<UTC time>.json)')
+    parser.add_argument('--baseline', type=Path, help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change reported as slower/faster')
+    parser.add_argument('--fail-on-slower', action='store_true', help='exit with status 1 if any case is slower')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    groups = set(args.only or ['extractor', 'csvmerger', 'pipeline', 'simel'])
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (int(s) for s in args.sizes.split(',')):
+            root = Path(tmp) / str(size)
+            inputs = synthetic.write_dataset(root / 'inputs', households=size, extra=max(1, size // 20),
+                                             simel_days=args.simel_days, supply_points_=size, seed=args.seed)
+            print(f"size {size}: " + ', '.join(f'{name}={value}' for name, value in inputs.items()))
+            data_dir = root / 'inputs' / 'data'
+            if groups & {'extractor', 'csvmerger'}:
+                extractor_results, csv_files = bench_extractor(data_dir, root / 'extractor', size, args.repeat)
+                if 'extractor' in groups:
+                    results += extractor_results
+                if 'csvmerger' in groups:
+                    results += bench_csvmerger(csv_files, root / 'csvmerger', size, args.repeat)
+            if 'pipeline' in groups:
+                results += bench_pipeline(data_dir, root / 'pipeline', size)
+            if 'simel' in groups:
+                results += bench_simel(root / 'inputs' / 'simel', root / 'simel', size)
+            shutil.rmtree(root)
+
+    for r in results:
+        rate = f", {r['files_per_s']:.1f} files/s" if r.get('files_per_s') else ''
+        print(f"{r['case']:<34}{r['size']:>7}{r['seconds']:>10.3f}s{rate}")
+
+    output = args.output or RESULTS_DIR / f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as outfile:
+        json.dump({'created': datetime.now(timezone.utc).isoformat(), 'commit': git_commit(),
+                   'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                   'args': {k: str(v) for k, v in vars(args).items()}, 'results': results}, outfile, indent=1)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            slower = compare(results, json.load(infile), args.tolerance)
+        if slower and args.fail_on_slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""synthetic.py
+
+Synthetic GoiEner inputs at configurable scale, for benchmarking without the
+Zenodo archive.
+
+- `write_metadata`: ``metadata.csv`` with the original Spanish columns
+  (`cups`, `fecha_alta`, `fecha_baja`, `p1_kw` ... `p6_kw`, `cnae`,
+  `codigo_postal`, `tarifa_atr`), ISO and ``dd/mm/YYYY`` dates, "NA" values,
+  non-residential cnae codes, households listed twice (a tariff change on
+  2021-06-01) and exact duplicate rows.
+- `write_archive`: ``imputed_goiener_v7.tar.zst`` with one
+  ``imputed_goiener_v7/<id>.csv`` member (`index,fl,kWh,imp`, the output of
+  simel/4_goi2imp.py) per household: hourly readings with daily and seasonal
+  shape, imputed stretches (imp = 1), missing hours and runs of zero days.
+  Some members have no metadata row and some metadata rows have no member.
+- `write_simel_day`: one SIMEL file per supported type for one day, with
+  the date, flag, in, out and DCM columns where simel/2_user2raw.py expects
+  them. Supply points are delivered by several overlapping sources (type 5
+  points by P5D, F5D, A5D, B5D and RF5D in Wh; type 1 points by P1D, P1 and F1
+  in kWh), which sometimes disagree, and every hour carries its summer
+  (fl = 1) or winter (fl = 0) flag, so DST days have 23 or 25 rows.
+- `write_simel_config`: a ``config.json`` for the SIMEL scripts.
+
+Everything is derived from a seed, so a scale and seed always give the same
+files.
+
+Usage:
+    python benchmarks/synthetic.py /tmp/goiener --households 500 --simel-days 30 --supply-points 1000
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import tarfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import zstandard
+
+ARCHIVE_NAME = 'imputed_goiener_v7.tar.zst'
+MEMBER_DIR = 'imputed_goiener_v7'
+
+# Readings end here at the latest (contracts still active are "NA" in fecha_baja)
+LAST_READING = pd.Timestamp('2023-06-30 23:00')
+
+# Columns of each SIMEL type (before the original_file and file_prefix columns added by
+# step 1); dates with seconds in the type 1 files
+SIMEL_LAYOUT = {
+    'A5D': {'width': 11, 'dt': 1, 'fl': 2, 'in': 3, 'out': 4, 'dcm': 9, 'seconds': False},
+    'B5D': {'width': 11, 'dt': 1, 'fl': 2, 'in': 3, 'out': 4, 'dcm': 9, 'seconds': False},
+    'F5D': {'width': 11, 'dt': 1, 'fl': 2, 'in': 3, 'out': 4, 'dcm': 9, 'seconds': False},
+    'P5D': {'width': 7, 'dt': 1, 'fl': 2, 'in': 3, 'out': 4, 'dcm': None, 'seconds': False},
+    'RF5D': {'width': 11, 'dt': 1, 'fl': 2, 'in': 3, 'out': 4, 'dcm': 9, 'seconds': False},
+    'F1': {'width': 16, 'dt': 2, 'fl': 3, 'in': 4, 'out': 5, 'dcm': 12, 'seconds': True},
+    'P1': {'width': 22, 'dt': 2, 'fl': 3, 'in': 4, 'out': 6, 'dcm': 20, 'seconds': True},
+    'P1D': {'width': 22, 'dt': 2, 'fl': 3, 'in': 4, 'out': 6, 'dcm': 20, 'seconds': True},
+}
+
+# Share of the supply points of each meter class delivered by each type on a given day
+SIMEL_COVERAGE = {
+    'type5': {'P5D': 0.9, 'F5D': 0.6, 'A5D': 0.3, 'B5D': 0.1, 'RF5D': 0.05},
+    'type1': {'P1D': 0.9, 'P1': 0.3, 'F1': 0.2},
+}
+
+
+def household_ids(n, seed=0):
+    """`n` anonymized household ids (64 hex characters, like the archive's)."""
+    return [hashlib.sha256(f'{seed}-{i}'.encode()).hexdigest() for i in range(n)]
+
+
+def hourly_profile(hours, rng, scale=1.0):
+    """Hourly consumption for `hours` (DatetimeIndex): evening and morning peaks, winter high."""
+    hour = hours.hour.to_numpy()
+    day_of_year = hours.dayofyear.to_numpy()
+    shape = 0.6 + 0.5 * np.exp(-(hour - 21) ** 2 / 8) + 0.3 * np.exp(-(hour - 8) ** 2 / 4)
+    season = 1 + 0.25 * np.cos(2 * np.pi * (day_of_year - 15) / 365)
+    base = rng.lognormal(-1.5, 0.4) * scale
+    return base * shape * season * rng.lognormal(0, 0.3, len(hours))
+
+
+def summer_flags(utc_hours):
+    """1 where Europe/Madrid is on summer time at these naive UTC hours, else 0."""
+    local = utc_hours.tz_localize('UTC').tz_convert('Europe/Madrid')
+    return ((local.tz_localize(None) - utc_hours) == pd.Timedelta(hours=2)).astype(np.int8)
+
+
+def _contracts(n_households, rng):
+    """Start and end (NaT when still active) of each household's contract."""
+    starts = pd.Timestamp('2018-01-01') + pd.to_timedelta(rng.integers(0, 1340, n_households), unit='D')
+    ends = starts + pd.to_timedelta(rng.integers(400, 1800, n_households), unit='D')
+    ends = ends.where(ends <= LAST_READING.normalize(), pd.NaT)
+    return starts, ends
+
+
+def _date(day, rng):
+    if pd.isna(day):
+        return 'NA'
+    return day.strftime('%d/%m/%Y' if rng.random() < 0.3 else '%Y-%m-%d')
+
+
+def write_metadata(path, ids, seed=0):
+    """Write `metadata.csv` for `ids`; returns {id: (first, last reading)}."""
+    rng = np.random.default_rng(seed)
+    starts, ends = _contracts(len(ids), rng)
+    rows, spans = [], {}
+    for household, start, end in zip(ids, starts, ends):
+        spans[household] = (start, LAST_READING if pd.isna(end) else end + pd.Timedelta(hours=23))
+        roll = rng.random()
+        cnae = '9820' if roll < 0.85 else ('NA' if roll < 0.9 else str(rng.choice(['4711', '5610', '8510'])))
+        postal_code = 'NA' if rng.random() < 0.03 else f'{rng.choice([1, 20, 31, 48]):02d}{rng.integers(0, 1000):03d}'
+        p1_kw = 'NA' if rng.random() < 0.02 else str(rng.choice(['2.3', '3.45', '4.6', '5.75', '6.9']))
+        row = {'cups': household, 'fecha_alta': start, 'fecha_baja': end, 'p1_kw': p1_kw,
+               'p2_kw': p1_kw if rng.random() < 0.5 else 'NA', 'p3_kw': 'NA', 'cnae': cnae,
+               'codigo_postal': postal_code, 'tarifa_atr': 'NA', 'p4_kw': 'NA', 'p5_kw': 'NA', 'p6_kw': 'NA'}
+        switch = pd.Timestamp('2021-06-01')
+        if start < switch and (pd.isna(end) or end >= switch) and rng.random() < 0.2:
+            # Listed twice: old tariff until the 2.0TD switch, then 2.0TD
+            rows.append({**row, 'fecha_baja': switch - pd.Timedelta(days=1), 'tarifa_atr': '2.0A'})
+            row = {**row, 'fecha_alta': switch, 'tarifa_atr': '2.0TD'}
+        elif start >= switch:
+            row['tarifa_atr'] = '2.0TD'
+        rows.append(row)
+        if rng.random() < 0.05:
+            rows.append(dict(row))
+
+    for row in rows:
+        row['fecha_alta'], row['fecha_baja'] = _date(row['fecha_alta'], rng), _date(row['fecha_baja'], rng)
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return spans
+
+
+def household_csv(first, last, rng):
+    """CSV text (`index,fl,kWh,imp`) of one household's hourly readings from `first` to `last`."""
+    hours = pd.date_range(first, last, freq='h')
+    kwh = hourly_profile(hours, rng)
+    imp = np.zeros(len(hours), dtype=np.int8)
+    # Imputed stretches (meter outages) of up to two days
+    for start in rng.integers(0, len(hours), rng.poisson(3)):
+        imp[start:start + int(rng.integers(1, 48))] = 1
+    # Runs of zero days (empty home) in about one household in six
+    if rng.random() < 0.15:
+        for start in rng.integers(0, max(1, len(hours) - 24), rng.integers(1, 3)):
+            kwh[start - start % 24:start - start % 24 + 24 * int(rng.integers(2, 21))] = 0.0
+    frame = pl.DataFrame({'index': hours.to_numpy(), 'fl': summer_flags(hours),
+                          'kWh': np.round(kwh, 3), 'imp': imp})
+    # Hours missing from the series altogether
+    keep = rng.random(len(hours)) >= 0.001
+    return frame.filter(pl.Series(keep)).write_csv(datetime_format='%Y-%m-%d %H:%M:%S')
+
+
+def write_archive(path, spans, extra=0, missing=0.02, seed=0):
+    """Write the `.tar.zst` archive of per-household CSVs.
+
+    Parameters
+    ----------
+    path : Path
+        Archive to write.
+    spans : dict
+        Household id -> (first, last) reading, as returned by `write_metadata`.
+    extra : int
+        Households in the archive but not in the metadata.
+    missing : float
+        Share of the metadata households left out of the archive.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    int
+        Number of members written.
+    """
+    rng = np.random.default_rng(seed)
+    spans = {household: span for household, span in spans.items() if rng.random() >= missing}
+    starts, ends = _contracts(extra, rng)
+    for household, start, end in zip(household_ids(extra, seed=f'extra{seed}'), starts, ends):
+        spans[household] = (start, LAST_READING if pd.isna(end) else end)
+    order = rng.permutation(len(spans))
+    households = list(spans)
+    with open(path, 'wb') as outfile, \
+            zstandard.ZstdCompressor(level=3).stream_writer(outfile) as writer, \
+            tarfile.open(fileobj=writer, mode='w|') as tar:
+        for i in order:
+            household = households[i]
+            data = household_csv(*spans[household], rng).encode()
+            member = tarfile.TarInfo(f'{MEMBER_DIR}/{household}.csv')
+            member.size = len(data)
+            member.mtime = 1_700_000_000
+            tar.addfile(member, io.BytesIO(data))
+    return len(spans)
+
+
+def supply_points(n):
+    """CUPS codes of `n` supply points; one in four is a type 1 (hourly, kWh) meter."""
+    return [f'ES{i:016d}XX0F' for i in range(n)]
+
+
+def _meter_class(cups):
+    return 'type1' if int(cups[2:18]) % 4 == 0 else 'type5'
+
+
+def write_simel_file(simel_dir, file_type, day, cups, values, labels, flags, rng, revised=0.05):
+    """Write the `file_type` file of `day` for supply points `cups` (rows of `values`)."""
+    layout = SIMEL_LAYOUT[file_type]
+    n_hours = values.shape[1]
+    values = values.copy()
+    # Late corrections: some readings differ from the other sources
+    changed = rng.random(values.shape) < revised
+    values[changed] = np.maximum(0, values[changed] + rng.integers(-50, 50, changed.sum()))
+    columns = {j: 0 for j in range(layout['width'])}
+    columns[0] = np.repeat(cups, n_hours)
+    columns[layout['dt']] = np.tile(labels[layout['seconds']], len(cups))
+    columns[layout['fl']] = np.tile(flags, len(cups))
+    columns[layout['in']] = values.ravel()
+    columns[layout['out']] = 0
+    if layout['dcm'] is not None:
+        columns[layout['dcm']] = rng.integers(0, 4, values.size)
+    if layout['dt'] == 2:
+        columns[1] = 'R'
+    path = Path(simel_dir) / f'{file_type}_0021_{day:%Y%m%d}.0'
+    pd.DataFrame(columns).to_csv(path, sep=';', header=False, index=False)
+    return path
+
+
+def write_simel_day(simel_dir, day, cups, seed=0, types=tuple(SIMEL_LAYOUT)):
+    """Write one file per SIMEL type in `types` for local day `day`; returns their paths.
+
+    Each type delivers a random share (`SIMEL_COVERAGE`) of the supply points
+    of its meter class, so most points appear in several files of the day.
+    """
+    rng = np.random.default_rng(seed)
+    day = pd.Timestamp(day)
+    # Hours of the local day (23 or 25 on DST days), labelled by their end in local time
+    utc = pd.date_range(day.tz_localize('Europe/Madrid').tz_convert('UTC').tz_localize(None),
+                        (day + pd.Timedelta(days=1)).tz_localize('Europe/Madrid').tz_convert('UTC').tz_localize(None),
+                        freq='h', inclusive='left')
+    local_end = (utc + pd.Timedelta(hours=1)).tz_localize('UTC').tz_convert('Europe/Madrid').tz_localize(None)
+    labels = {False: np.asarray(local_end.strftime('%Y/%m/%d %H:%M')),
+              True: np.asarray(local_end.strftime('%Y/%m/%d %H:%M:%S'))}
+    flags = summer_flags(utc)
+
+    cups = np.asarray(cups)
+    meter_class = np.array([_meter_class(c) for c in cups])
+    # Readings of the day: Wh for type 5 points, kWh of much larger consumers for type 1
+    values = {
+        'type5': np.stack([np.round(hourly_profile(local_end, rng) * 1000) for _ in range(len(cups))]).astype(np.int64),
+        'type1': np.stack([np.round(hourly_profile(local_end, rng, scale=200)) for _ in range(len(cups))]).astype(np.int64),
+    }
+    paths = []
+    for file_type in types:
+        klass = 'type1' if file_type in SIMEL_COVERAGE['type1'] else 'type5'
+        chosen = np.flatnonzero((meter_class == klass) & (rng.random(len(cups)) < SIMEL_COVERAGE[klass][file_type]))
+        if len(chosen):
+            paths.append(write_simel_file(simel_dir, file_type, day, cups[chosen], values[klass][chosen],
+                                          labels, flags, rng))
+    return paths
+
+
+def write_simel_config(root, simel_dir):
+    """Write ``root/config.json`` for the SIMEL scripts reading `simel_dir`, with every output under `root`."""
+    root = Path(root)
+    config = {
+        'simel_dir': str(simel_dir), 'id_dir': str(root / 'id'), 'raw_dir': str(root / 'raw'),
+        'goiener_dir': str(root / 'goi'), 'imputation_dir': str(root / 'imp'),
+        'simel2id_log': str(root / 'logs' / 'simel2id.log'), 'id2raw_log': str(root / 'logs' / 'id2raw.log'),
+        'raw2goiener_log': str(root / 'logs' / 'raw2goi.log'), 'goi7_log': str(root / 'logs' / 'goi7.csv'),
+        'goi72imp_log': str(root / 'logs' / 'goi72imp.csv'), 'imputed_log': str(root / 'logs' / 'imputed.csv'),
+        'telemetry_log': str(root / 'logs' / 'telemetry.jsonl'),
+    }
+    (root / 'logs').mkdir(parents=True, exist_ok=True)
+    (root / 'config.json').write_text(json.dumps(config))
+    return root / 'config.json'
+
+
+def write_dataset(root, households=200, extra=10, simel_days=7, supply_points_=200, start_day='2022-10-25', seed=0):
+    """Write the whole synthetic input tree under `root`.
+
+    ``root/data`` holds `metadata.csv` and the archive (the layout
+    preprocessing.py expects, relative to its working directory) and
+    ``root/simel`` the SIMEL files of `simel_days` days from `start_day`
+    (the default range includes the October DST change). Returns the sizes
+    of what was written.
+    """
+    root = Path(root)
+    (root / 'data').mkdir(parents=True, exist_ok=True)
+    (root / 'simel').mkdir(parents=True, exist_ok=True)
+    spans = write_metadata(root / 'data' / 'metadata.csv', household_ids(households, seed), seed)
+    members = write_archive(root / 'data' / ARCHIVE_NAME, spans, extra=extra, seed=seed)
+    cups = supply_points(supply_points_)
+    simel_files = []
+    for i, day in enumerate(pd.date_range(start_day, periods=simel_days, freq='D')):
+        simel_files += write_simel_day(root / 'simel', day, cups, seed=seed * 10_000 + i)
+    return {
+        'households': households, 'members': members,
+        'archive_bytes': (root / 'data' / ARCHIVE_NAME).stat().st_size,
+        'simel_files': len(simel_files), 'simel_bytes': sum(p.stat().st_size for p in simel_files),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic GoiEner inputs')
+    parser.add_argument('root', type=Path, help='output directory (data/ and simel/ are created in it)')
+    parser.add_argument('--households', type=int, default=200)
+    parser.add_argument('--extra', type=int, default=10, help='archive households without metadata')
+    parser.add_argument('--simel-days', type=int, default=7)
+    parser.add_argument('--supply-points', type=int, default=200)
+    parser.add_argument('--start-day', default='2022-10-25')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    sizes = write_dataset(args.root, args.households, args.extra, args.simel_days, args.supply_points,
+                          args.start_day, args.seed)
+    print(', '.join(f'{name}={value}' for name, value in sizes.items()))
+
+
+if __name__ == "__main__":
+    main()
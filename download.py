@@ -1,46 +1,266 @@
 """download.py
 
-Small helper to download files with curl into a destination folder.
+Segmented, resumable downloader with streaming checksum verification.
 
-This script is intentionally minimal: it wraps a subprocess call to curl and is
-meant for one-off downloads used during data preparation.
+Large files are split into HTTP Range segments that are fetched concurrently
+over a small set of keep-alive connections (one per worker thread) and written
+into `<file>.part` at their offsets. Completed segments are recorded in
+`<file>.part.json`, so an interrupted download resumes by fetching only the
+missing segments. The checksum is computed while the download runs: segments
+are fed to the hash in file order as soon as every earlier segment is in, so
+the file is never read a second time. Segments completed by an earlier,
+interrupted run are the exception and are read back once from the `.part` file.
+Servers that ignore Range requests are downloaded over a single stream.
+
+The expected checksums of the Zenodo files are taken from the Zenodo record API
+when it is reachable.
 """
 
+import hashlib
+import http.client
+import json
 import os
-import subprocess
+import threading
+import urllib.request
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+ZENODO_RECORD = '14949245'
+ZENODO_FILES = ['metadata.csv', 'imputed_goiener_v7.tar.zst']
+
+
+class _ConnectionPool:
+    """One persistent HTTP(S) connection per worker thread."""
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self._cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self.path = parts.path + (f'?{parts.query}' if parts.query else '')
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = self._cls(self._netloc, timeout=self._timeout)
+        return self._local.conn
+
+    def reset(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+
+def _parse_checksum(checksum):
+    """Split an 'algorithm:hexdigest' checksum (Zenodo's format); sha256 when None."""
+    if checksum is None:
+        return 'sha256', None
+    algorithm, _, expected = checksum.partition(':')
+    return algorithm, expected.lower()
+
+
+def _file_hexdigest(path, algorithm):
+    """Hex digest of the file at `path`, read in 1 MiB blocks."""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _probe(url, timeout):
+    """Follow redirects and return (final_url, size, validator, supports_range)."""
+    request = urllib.request.Request(url, headers={'Range': 'bytes=0-0'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        if response.status == 206:
+            size = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+            return response.geturl(), size, validator, True
+        length = response.headers.get('Content-Length')
+        return response.geturl(), int(length) if length else None, validator, False
+
+
+def _fetch_segment(pool, start, end, retries):
+    """GET bytes [start, end] over the calling thread's connection."""
+    for attempt in range(retries + 1):
+        try:
+            conn = pool.get()
+            conn.request('GET', pool.path, headers={'Range': f'bytes={start}-{end}'})
+            response = conn.getresponse()
+            data = response.read()
+            if response.status != 206 or len(data) != end - start + 1:
+                raise IOError(f"Bad response for bytes {start}-{end}: HTTP {response.status}, {len(data)} bytes")
+            return data
+        except (OSError, http.client.HTTPException):
+            pool.reset()
+            if attempt == retries:
+                raise
+
+
+def _load_state(state_path, url, size, segment_size, validator):
+    """Completed segments of a previous run, if it was downloading the same file."""
+    if os.path.exists(state_path):
+        with open(state_path) as infile:
+            state = json.load(infile)
+        if (state['url'], state['size'], state['segment_size'], state['validator']) == (url, size, segment_size, validator):
+            return set(state['done'])
+    return set()
+
+
+def _save_state(state_path, url, size, segment_size, validator, done):
+    with open(state_path, 'w') as outfile:
+        json.dump({'url': url, 'size': size, 'segment_size': segment_size,
+                   'validator': validator, 'done': sorted(done)}, outfile)
 
-def download_with_curl(url: str, dest_folder: str):
-    """Download `url` into `dest_folder` using curl.
 
-    This function creates `dest_folder` if missing, constructs a filename from
-    the URL and invokes `curl -L -C - -o <file> <url>` to follow redirects and
-    resume partial downloads.
+def _download_segments(url, part_path, state_path, size, validator, digest,
+                       segment_size, max_workers, max_pending, retries, timeout):
+    n_segments = max(1, -(-size // segment_size))
+    done = _load_state(state_path, url, size, segment_size, validator)
+    if not done or not os.path.exists(part_path):
+        done = set()
+        with open(part_path, 'wb') as outfile:
+            outfile.truncate(size)
+    resumed = set(done)
+    if resumed:
+        print(f"Resuming: {len(resumed)}/{n_segments} segments already downloaded")
+
+    pool = _ConnectionPool(url, timeout)
+    todo = deque(i for i in range(n_segments) if i not in done)
+    futures = {}
+    # Segments that arrived before an earlier one; hashed once the gap closes.
+    # Submission is limited to `max_pending` segments past the hash frontier,
+    # which bounds this buffer to max_pending * segment_size bytes.
+    buffered = {}
+    frontier = 0
+
+    with open(part_path, 'r+b') as outfile, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while frontier < n_segments and (frontier in buffered or frontier in resumed):
+                if frontier in buffered:
+                    digest.update(buffered.pop(frontier))
+                else:
+                    outfile.seek(frontier * segment_size)
+                    digest.update(outfile.read(min(segment_size, size - frontier * segment_size)))
+                frontier += 1
+            if frontier == n_segments:
+                break
+
+            while todo and todo[0] < frontier + max_pending and len(futures) < max_pending:
+                index = todo.popleft()
+                start = index * segment_size
+                end = min(start + segment_size, size) - 1
+                futures[executor.submit(_fetch_segment, pool, start, end, retries)] = index
+
+            completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in completed:
+                index = futures.pop(future)
+                data = future.result()
+                outfile.seek(index * segment_size)
+                outfile.write(data)
+                outfile.flush()
+                done.add(index)
+                _save_state(state_path, url, size, segment_size, validator, done)
+                buffered[index] = data
+            print(f"\r{len(done)}/{n_segments} segments", end='', flush=True)
+    print()
+
+
+def _download_stream(url, part_path, digest, timeout):
+    """Single-connection fallback for servers without Range support."""
+    with urllib.request.urlopen(url, timeout=timeout) as response, open(part_path, 'wb') as outfile:
+        for block in iter(lambda: response.read(1 << 20), b''):
+            digest.update(block)
+            outfile.write(block)
+
+
+def download(url: str, dest_folder: str, checksum: str = None, segment_size: int = 16 << 20,
+             max_workers: int = 8, max_pending: int = 16, retries: int = 3, timeout: float = 60):
+    """Download `url` into `dest_folder` and verify its checksum.
+
+    A file already in `dest_folder` is kept if it matches `checksum` (or if
+    no checksum is given) and downloaded again otherwise.
 
     Parameters
     ----------
     url : str
-        HTTP/HTTPS URL to download.
+        HTTP/HTTPS URL to download. Redirects are followed.
     dest_folder : str
-        Directory to save the downloaded file into.
+        Directory to save the downloaded file into (created if missing).
+    checksum : str | None
+        Expected 'algorithm:hexdigest' (e.g. 'md5:...', as listed by Zenodo).
+        When None, the sha256 of the download is printed instead.
+    segment_size : int
+        Bytes per Range request.
+    max_workers : int
+        Concurrent connections.
+    max_pending : int
+        Maximum segments in flight past the first one not yet hashed.
+    retries : int
+        Retries per segment before giving up; the download can then be resumed.
+    timeout : float
+        Socket timeout in seconds.
+
+    Returns
+    -------
+    str
+        Path of the downloaded file.
     """
     os.makedirs(dest_folder, exist_ok=True)
 
     filename = url.split('/')[-1].replace(" ", "_")
     file_path = os.path.join(dest_folder, filename)
+    part_path = f'{file_path}.part'
+    state_path = f'{part_path}.json'
+
+    algorithm, expected = _parse_checksum(checksum)
+
+    if os.path.exists(file_path):
+        if expected is None or _file_hexdigest(file_path, algorithm) == expected:
+            print("Already downloaded", os.path.abspath(file_path))
+            return file_path
+        print("Checksum mismatch, downloading again", os.path.abspath(file_path))
+        os.remove(file_path)
 
     print("Saving to", os.path.abspath(file_path))
 
-    cmd = [
-        "curl",
-        "-L",        # follow redirects (Zenodo needs this)
-        "-C", "-",   # resume
-        "-o", os.path.join(dest_folder, url.split("/")[-1]),
-        url
-    ]
+    digest = hashlib.new(algorithm)
+
+    final_url, size, validator, supports_range = _probe(url, timeout)
+    if supports_range and size:
+        _download_segments(final_url, part_path, state_path, size, validator, digest,
+                           segment_size, max_workers, max_pending, retries, timeout)
+    else:
+        _download_stream(final_url, part_path, digest, timeout)
+
+    actual = digest.hexdigest()
+    if expected is not None and actual != expected:
+        os.remove(part_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        raise ValueError(f"Checksum mismatch for {filename}: expected {algorithm}:{expected}, got {algorithm}:{actual}")
+
+    os.replace(part_path, file_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    print(f"Download complete ({algorithm}:{actual}).")
+    return file_path
+
+
+def zenodo_checksums(record_id: str):
+    """Map file name -> 'algorithm:hexdigest' for the files of a Zenodo record."""
+    with urllib.request.urlopen(f'https://zenodo.org/api/records/{record_id}', timeout=60) as response:
+        record = json.load(response)
+    return {f['key']: f['checksum'] for f in record['files']}
+
 
-    subprocess.run(cmd, check=True)
-    print("\nDownload complete.")
+if __name__ == "__main__":
+    try:
+        checksums = zenodo_checksums(ZENODO_RECORD)
+    except OSError as e:
+        print(f"Could not fetch checksums from Zenodo ({e}); downloading without verification.")
+        checksums = {}
 
-# Example one-shot downloads used by the original project
-download_with_curl('https://zenodo.org/records/14949245/files/metadata.csv', 'data')
-download_with_curl('https://zenodo.org/records/14949245/files/imputed_goiener_v7.tar.zst', 'data')
\ No newline at end of file
+    for name in ZENODO_FILES:
+        download(f'https://zenodo.org/records/{ZENODO_RECORD}/files/{name}', 'data', checksum=checksums.get(name))
@@ -4,15 +4,22 @@ Safe extraction helpers for compressed Goiener archives.
 
 Provides an Extractor class that decompresses .tar.zst archives and extracts the
 contained tar safely to a destination directory while preventing path-traversal
-attacks.
+attacks. A persisted member index lets later runs extract only selected
+households in a single forward pass over the archive.
 """
 
+import csv
 import os
 import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import zstandard
 
+# Columns of the member index written by `Extractor.build_index`
+INDEX_COLUMNS = ['name', 'id', 'offset', 'size', 'mtime']
+
 
 class Extractor:
     """Utility for decompressing .tar.zst archives and extracting them safely.
@@ -32,19 +39,210 @@ class Extractor:
 
     @staticmethod
     def _safe_tar_filter(member, destination_dir):
-        """Ensures extracted files do not escape the destination directory."""
-        member_path = Path(destination_dir, member.name)
-        if not str(member_path).startswith(str(destination_dir)):
+        """Ensures extracted files do not escape the destination directory.
+
+        Absolute member names are rejected; otherwise tarfile's ``'data'``
+        filter is applied, which rejects paths and links that resolve outside
+        `destination_dir` and device and other special files.
+        """
+        if os.path.isabs(member.name) or member.name.startswith(('/', '\\')):
             raise ValueError(f"Unsafe path detected: {member.name}")
-        return member  # Allow extraction
+        try:
+            return tarfile.data_filter(member, str(destination_dir))
+        except tarfile.FilterError as e:
+            raise ValueError(f"Unsafe path detected: {member.name}") from e
+
+    def _target(self, member):
+        """Resolved path of `member` in the destination, refusing any path that leaves it."""
+        destination = Path(self._destination).resolve()
+        target = (destination / member.name).resolve()
+        if not target.is_relative_to(destination):
+            raise ValueError(f"Unsafe path detected: {member.name}")
+        return target
+
+    def iter_members(self):
+        """Yield ``(member, data)`` pairs straight from the compressed archive.
+
+        The zstd stream reader is piped into a streaming tar reader (``r|``),
+        so no intermediate tar is written to disk. Every member goes through
+        the path-traversal filter before it is yielded. ``data`` holds the
+        member bytes for regular files and is None for anything else.
+        """
+        with open(self._file_path, 'rb') as compressed:
+            decomp = zstandard.ZstdDecompressor()
+            reader = decomp.stream_reader(compressed, read_across_frames=True)
+            with tarfile.open(fileobj=reader, mode='r|') as tar:
+                for member in tar:
+                    member = self._safe_tar_filter(member, self._destination)
+                    data = tar.extractfile(member).read() if member.isfile() else None
+                    yield member, data
+
+    @staticmethod
+    def _write_member(target, data, mtime):
+        """Write one extracted member to disk, keeping its modification time."""
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, 'wb') as outfile:
+            outfile.write(data)
+        os.utime(target, (mtime, mtime))
+
+    def _extract_stream(self, max_workers, max_pending):
+        """Extract members while decompressing, writing files from a thread pool.
+
+        At most `max_pending` members are held in memory waiting to be written;
+        the reader blocks on the oldest write once that bound is reached.
+        """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for member, data in self.iter_members():
+                target = self._target(member)
+                if member.isdir():
+                    target.mkdir(parents=True, exist_ok=True)
+                    continue
+                if data is None:
+                    continue  # links and special files are not part of the dataset
+
+                pending.append(pool.submit(self._write_member, target, data, member.mtime))
+                if len(pending) >= max_pending:
+                    pending.popleft().result()
+
+            while pending:
+                pending.popleft().result()
+
+    def _index_path(self, index_path):
+        return Path(index_path) if index_path else Path(f"{self._file_path}.index.csv")
+
+    def build_index(self, index_path=None):
+        """Scan the archive once and persist its member index.
+
+        Each CSV row maps a member name to its household id, to the offset
+        and size of its data in the decompressed stream and to its
+        modification time. Member data is decompressed but never written.
+
+        Parameters
+        ----------
+        index_path : str | None
+            Where to write the index. Defaults to ``<archive>.index.csv``.
+
+        Returns
+        -------
+        list[dict]
+            Index rows with keys ``name``, ``id``, ``offset``, ``size`` and
+            ``mtime``.
+        """
+        index = []
+        with open(self._file_path, 'rb') as compressed:
+            reader = zstandard.ZstdDecompressor().stream_reader(compressed, read_across_frames=True)
+            with tarfile.open(fileobj=reader, mode='r|') as tar:
+                for member in tar:
+                    if member.isfile():
+                        index.append({'name': member.name, 'id': Path(member.name).stem,
+                                      'offset': member.offset_data, 'size': member.size,
+                                      'mtime': member.mtime})
 
-    def decompress_tzst(self):
+        with open(self._index_path(index_path), mode='w', newline='') as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=INDEX_COLUMNS)
+            writer.writeheader()
+            writer.writerows(index)
+        return index
+
+    def load_index(self, index_path=None):
+        """Read the member index, (re)building it if it is missing or stale.
+
+        An index is stale if it is older than the archive or lacks any of
+        `INDEX_COLUMNS` (e.g. written before member mtimes were recorded).
+        """
+        path = self._index_path(index_path)
+        if not path.exists() or path.stat().st_mtime < os.path.getmtime(self._file_path):
+            return self.build_index(path)
+
+        with open(path, mode='r', newline='') as infile:
+            reader = csv.DictReader(infile)
+            if reader.fieldnames != INDEX_COLUMNS:
+                return self.build_index(path)
+            return [{**row, 'offset': int(row['offset']), 'size': int(row['size']), 'mtime': float(row['mtime'])}
+                    for row in reader]
+
+    def extract_households(self, households, index_path=None, max_workers: int = 8, max_pending: int = 64):
+        """Extract only the given households in one forward pass.
+
+        Wanted members are located through the member index and read by
+        seeking forward in the decompressed stream, so unwanted members are
+        skipped without being written. Decompression stops after the last
+        wanted member.
+
+        Parameters
+        ----------
+        households : Iterable[str]
+            Household ids to extract.
+        index_path : str | None
+            Member index location. Defaults to ``<archive>.index.csv``.
+        max_workers : int
+            Number of writer threads.
+        max_pending : int
+            Maximum number of members buffered in memory awaiting a write.
+
+        Returns
+        -------
+        list[str]
+            Requested ids that have no member in the archive.
+        """
+        wanted = set(households)
+        entries = sorted((e for e in self.load_index(index_path) if e['id'] in wanted),
+                         key=lambda e: e['offset'])
+        found = {e['id'] for e in entries}
+
+        pending = deque()
+        with open(self._file_path, 'rb') as compressed, ThreadPoolExecutor(max_workers=max_workers) as pool:
+            reader = zstandard.ZstdDecompressor().stream_reader(compressed, read_across_frames=True)
+            for entry in entries:
+                info = tarfile.TarInfo(entry['name'])
+                info.mtime = entry['mtime']
+                member = self._safe_tar_filter(info, self._destination)
+                reader.seek(entry['offset'])
+                data = bytearray()
+                while len(data) < entry['size']:
+                    chunk = reader.read(entry['size'] - len(data))
+                    if not chunk:
+                        raise ValueError(f"Archive ended inside member: {member.name}")
+                    data += chunk
+
+                target = self._target(member)
+                pending.append(pool.submit(self._write_member, target, bytes(data), member.mtime))
+                if len(pending) >= max_pending:
+                    pending.popleft().result()
+
+            while pending:
+                pending.popleft().result()
+
+        print(f"Extracted {len(entries)} households")
+        return sorted(wanted - found)
+
+    def decompress_tzst(self, stream: bool = False, max_workers: int = 8, max_pending: int = 64):
         """Decompress the .tar.zst archive and extract its content.
 
-        The method creates a temporary tar file adjacent to the destination and
-        uses zstandard to decompress into it. The resulting tar is opened and
-        extracted with a safety filter to avoid path traversal.
+        By default the method creates a temporary tar file adjacent to the
+        destination and uses zstandard to decompress into it. The resulting tar
+        is opened and extracted with a safety filter to avoid path traversal.
+
+        With ``stream=True`` the decompressed stream is read as a streaming tar
+        instead, and members are written by a pool of `max_workers` threads
+        while decompression continues. No temporary tar is written, so the
+        archive only needs the space of its extracted content.
+
+        Parameters
+        ----------
+        stream : bool
+            Extract directly from the decompressed stream.
+        max_workers : int
+            Number of writer threads used in streaming mode.
+        max_pending : int
+            Maximum number of members buffered in memory awaiting a write.
         """
+        if stream:
+            self._extract_stream(max_workers, max_pending)
+            print("Extraction complete")
+            return
+
         input_file = Path(self._file_path)
         tar_path = Path(self._destination, input_file.stem)
 
@@ -52,11 +250,12 @@ class Extractor:
             decomp = zstandard.ZstdDecompressor()
             decomp.copy_stream(compressed, decompressed)
 
-        if tarfile.is_tarfile(tar_path):
-            with tarfile.open(tar_path, 'r') as tar:
-                tar.extractall(path = self._destination, filter = self._safe_tar_filter)
-            tar_path.unlink()
-            print("Extraction complete")
-            return
-        print("Extraction failed")
-
+        try:
+            if tarfile.is_tarfile(tar_path):
+                with tarfile.open(tar_path, 'r') as tar:
+                    tar.extractall(path = self._destination, filter = self._safe_tar_filter)
+                print("Extraction complete")
+                return
+            print("Extraction failed")
+        finally:
+            tar_path.unlink(missing_ok=True)
@@ -0,0 +1,129 @@
+"""features.py
+
+Per-household load-profile features.
+
+`household_features` turns hourly readings into one wide row per household.
+The readings are scanned once: a streaming group-by reduces them to sums,
+counts and maxima per (household, season, hour of week), which is at most
+4 * 168 rows per household, and every feature is derived from that table. Memory
+therefore scales with the number of households, not the number of readings,
+and the group-by runs in parallel across households.
+
+Features
+--------
+- `n_readings`, `mean_kw`, `max_kw`: number of hourly readings, mean and
+  maximum hourly consumption (kWh per hour, i.e. average kW).
+- `h24_00` ... `h24_23`: mean consumption by hour of day.
+- `h168_000` ... `h168_167`: mean consumption by hour of week, Monday 00:00
+  first.
+- `base_load_kw`: lowest value of the mean daily (24-hour) profile.
+- `peak_hour`: hour of day with the highest mean consumption.
+- `weekday_weekend_ratio`: mean weekday over mean weekend consumption.
+- `kwh_winter`, `kwh_spring`, `kwh_summer`, `kwh_autumn`: total consumption
+  per meteorological season (Dec-Feb, Mar-May, Jun-Aug, Sep-Nov).
+- `p1_kw`, `load_factor`: contracted power (highest listed for the household)
+  and mean consumption relative to it.
+
+Profile slots without readings are NaN. The contracted power is joined per
+household after the readings are aggregated, so a household listed more than
+once in the metadata does not have its readings counted more than once.
+"""
+
+import polars as pl
+
+SEASONS = ['winter', 'spring', 'summer', 'autumn']
+
+# month -> index in SEASONS
+_SEASON_OF_MONTH = {12: 0, 1: 0, 2: 0, 3: 1, 4: 1, 5: 1, 6: 2, 7: 2, 8: 2, 9: 3, 10: 3, 11: 3}
+
+
+def hourly_aggregates(readings):
+    """Reduce hourly readings to sums, counts and maxima per (id, season, hour of week).
+
+    Parameters
+    ----------
+    readings : pl.LazyFrame
+        Readings with `id`, `timestamp` and `kWh` columns, one per household
+        and hour.
+
+    Returns
+    -------
+    pl.LazyFrame
+        Columns id, season, how (0-167), kwh, n and kwh_max.
+    """
+    return (
+        readings
+        .select(
+            'id',
+            pl.col('timestamp').dt.month().replace_strict(_SEASON_OF_MONTH, return_dtype=pl.UInt8).alias('season'),
+            ((pl.col('timestamp').dt.weekday().cast(pl.UInt8) - 1) * 24 + pl.col('timestamp').dt.hour()).alias('how'),
+            'kWh',
+        )
+        .group_by('id', 'season', 'how')
+        .agg(
+            pl.col('kWh').sum().alias('kwh'),
+            pl.col('kWh').count().alias('n'),
+            pl.col('kWh').max().alias('kwh_max'),
+        )
+    )
+
+
+def _mean(mask):
+    """Mean hourly kWh over the aggregate rows selected by `mask`."""
+    return pl.col('kwh').filter(mask).sum() / pl.col('n').filter(mask).sum()
+
+
+def household_features(readings, p1_kw=None):
+    """Compute the wide per-household feature table (see the module docstring).
+
+    Parameters
+    ----------
+    readings : pl.LazyFrame
+        Cleaned hourly readings with `id`, `timestamp` and `kWh` columns, one
+        per household and hour.
+    p1_kw : pl.DataFrame, optional
+        Contracted power of the households (`id`, `p1_kw`), possibly with
+        several rows per household. Without it, `p1_kw` and `load_factor`
+        are null.
+
+    Returns
+    -------
+    pl.DataFrame
+        One row per household, sorted by id.
+    """
+    aggregates = hourly_aggregates(readings).collect(engine='streaming')
+
+    hour = pl.col('how') % 24
+    h24 = [f'h24_{h:02d}' for h in range(24)]
+    h168 = [f'h168_{h:03d}' for h in range(168)]
+
+    features = aggregates.group_by('id').agg(
+        pl.col('n').sum().alias('n_readings'),
+        (pl.col('kwh').sum() / pl.col('n').sum()).alias('mean_kw'),
+        pl.col('kwh_max').max().alias('max_kw'),
+        (_mean(pl.col('how') < 120) / _mean(pl.col('how') >= 120)).alias('weekday_weekend_ratio'),
+        *[pl.col('kwh').filter(pl.col('season') == i).sum().alias(f'kwh_{season}') for i, season in enumerate(SEASONS)],
+        *[_mean(hour == h).alias(name) for h, name in enumerate(h24)],
+        *[_mean(pl.col('how') == h).alias(name) for h, name in enumerate(h168)],
+    )
+
+    if p1_kw is None:
+        features = features.with_columns(pl.lit(None, dtype=pl.Float64).alias('p1_kw'))
+    else:
+        contracted = (p1_kw.select('id', pl.col('p1_kw').cast(pl.Float64, strict=False))
+                      .group_by('id').agg(pl.col('p1_kw').max()))
+        features = features.join(contracted, on='id', how='left')
+
+    return (
+        features
+        .with_columns(
+            pl.min_horizontal(h24).alias('base_load_kw'),
+            pl.concat_list(h24).list.arg_max().alias('peak_hour'),
+            (pl.col('mean_kw') / pl.col('p1_kw')).alias('load_factor'),
+        )
+        .select(
+            'id', 'n_readings', 'mean_kw', 'max_kw', 'base_load_kw', 'peak_hour', 'weekday_weekend_ratio',
+            *[f'kwh_{season}' for season in SEASONS], 'p1_kw', 'load_factor', *h24, *h168,
+        )
+        .sort('id')
+    )
@@ -0,0 +1,181 @@
+"""ingest.py
+
+Ingest the GoiEner archive directly into a hive-partitioned Parquet dataset.
+
+Each per-household CSV member is read from the decompressed tar stream and
+parsed once with an explicit schema. Households are hashed (`crc32` of the id)
+into a fixed number of buckets, and each bucket's readings are written sorted
+by (id, timestamp) under ``<dataset_dir>/bucket=<NNN>/part-<NNNNN>.parquet``:
+a bucket is written as a new part once it has buffered `part_rows` readings,
+and the largest bucket is written early whenever all of them together hold
+more than `buffer_rows`. Memory is bounded by `buffer_rows`, every file holds
+at least `buffer_rows / n_buckets` readings (except each bucket's last), so
+the number of files grows with the data volume, not with households x months,
+and filters on `id` skip row groups by their min/max statistics. This replaces
+the extract -> merge -> re-parse sequence of text passes.
+
+Typical usage:
+    ingestor = ParquetIngestor('data/imputed_goiener_v7.tar.zst', 'data/household_kwh')
+    ingestor.ingest()
+    households_df = scan_household_kwh('data/household_kwh').collect()
+"""
+
+import io
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import polars as pl
+
+from extractors import Extractor
+
+# Column types of the per-household CSVs written by simel/4_goi2imp.py
+MEMBER_SCHEMA = {'index': pl.Datetime('us'), 'fl': pl.Int8, 'kWh': pl.Float64, 'imp': pl.Int8}
+
+# Partition key; zero-padded bucket numbers, never let them be inferred
+HIVE_SCHEMA = {'bucket': pl.String}
+
+
+def bucket_of(household_id, n_buckets):
+    """Bucket of a household id in a dataset of `n_buckets` buckets."""
+    return zlib.crc32(household_id.encode('utf-8')) % n_buckets
+
+
+class ParquetIngestor:
+    """Parse the archive members once and write a bucketed Parquet dataset.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the .tar.zst archive with per-household CSVs.
+    dataset_dir : str
+        Root directory of the hive-partitioned dataset to write.
+    n_buckets : int
+        Number of `bucket=` partitions households are hashed into.
+    part_rows : int
+        Readings buffered per bucket before they are written as one file.
+    buffer_rows : int
+        Readings buffered over all buckets before the largest is written.
+    row_group_size : int
+        Rows per Parquet row group; smaller groups make `id` pruning finer.
+    """
+    def __init__(self, file_path: str, dataset_dir: str, n_buckets: int = 16, part_rows: int = 2_000_000,
+                 buffer_rows: int = 8_000_000, row_group_size: int = 65_536):
+        self._extractor = Extractor(file_path, dataset_dir)
+        self._dataset_dir = dataset_dir
+        self._n_buckets = n_buckets
+        self._part_rows = part_rows
+        self._buffer_rows = buffer_rows
+        self._row_group_size = row_group_size
+
+    @staticmethod
+    def _parse_member(data, household_id):
+        """Parse one CSV member into the dataset layout (id, timestamp, kWh, imp)."""
+        return (
+            pl.read_csv(io.BytesIO(data), schema_overrides=MEMBER_SCHEMA)
+            .select(
+                pl.lit(household_id).alias('id'),
+                pl.col('index').alias('timestamp'),
+                pl.col('kWh'),
+                pl.col('imp'),
+            )
+        )
+
+    def _write_part(self, bucket, part, frames):
+        """Write the buffered households of one bucket, sorted by (id, timestamp), as one file."""
+        part_dir = Path(self._dataset_dir, f'bucket={bucket:03d}')
+        part_dir.mkdir(parents=True, exist_ok=True)
+        (
+            pl.concat(frames)
+            .sort(['id', 'timestamp'])
+            .write_parquet(part_dir / f'part-{part:05d}.parquet', row_group_size=self._row_group_size,
+                           statistics=True)
+        )
+
+    def ingest(self, households=None, max_workers: int = 8, max_pending: int = 64):
+        """Stream the archive and write every (or each selected) household.
+
+        Parsing and writing run on a bounded thread pool so they overlap with
+        decompression; Polars releases the GIL while doing both. Parsed
+        households wait in their bucket's buffer until it is written (see
+        the module docstring) or the archive ends.
+
+        Parameters
+        ----------
+        households : Iterable[str] | None
+            Optional household ids to ingest. All CSV members when None.
+        max_workers : int
+            Number of parser/writer threads.
+        max_pending : int
+            Maximum number of members waiting to be parsed.
+
+        Returns
+        -------
+        int
+            Number of readings written.
+        """
+        wanted = set(households) if households is not None else None
+        rows = 0
+        buffers = {}  # bucket -> (parsed frames, rows)
+        parts = {}    # bucket -> parts written so far
+        parsing, writing = deque(), deque()
+
+        def add(bucket, df):
+            frames, buffered = buffers.get(bucket, ([], 0))
+            frames.append(df)
+            buffers[bucket] = (frames, buffered + df.height)
+            if buffers[bucket][1] >= self._part_rows:
+                flush(bucket)
+            elif sum(buffered for _, buffered in buffers.values()) > self._buffer_rows:
+                flush(max(buffers, key=lambda b: buffers[b][1]))
+
+        def flush(bucket):
+            frames, _ = buffers.pop(bucket)
+            writing.append(pool.submit(self._write_part, bucket, parts.get(bucket, 0), frames))
+            parts[bucket] = parts.get(bucket, 0) + 1
+            # Parts being written hold their readings too; keep at most two in flight
+            while len(writing) > 2:
+                writing.popleft().result()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for member, data in self._extractor.iter_members():
+                path = Path(member.name)
+                if data is None or path.suffix != '.csv':
+                    continue
+                if wanted is not None and path.stem not in wanted:
+                    continue
+
+                parsing.append((bucket_of(path.stem, self._n_buckets),
+                                pool.submit(self._parse_member, data, path.stem)))
+                if len(parsing) >= max_pending:
+                    bucket, future = parsing.popleft()
+                    df = future.result()
+                    rows += df.height
+                    add(bucket, df)
+
+            while parsing:
+                bucket, future = parsing.popleft()
+                df = future.result()
+                rows += df.height
+                add(bucket, df)
+            for bucket in list(buffers):
+                flush(bucket)
+            while writing:
+                writing.popleft().result()
+
+        print(f"Ingested {rows} readings into {sum(parts.values())} files in {self._dataset_dir}")
+        return rows
+
+
+def scan_household_kwh(dataset_dir):
+    """Lazily scan the bucketed dataset written by `ParquetIngestor`.
+
+    Files are sorted by (id, timestamp), so filters on `id` skip the row
+    groups of other households by their statistics. The `bucket` partition
+    column is dropped.
+    """
+    return (
+        pl.scan_parquet(Path(dataset_dir, '**', '*.parquet'), hive_partitioning=True, hive_schema=HIVE_SCHEMA)
+        .drop('bucket')
+    )
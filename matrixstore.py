@@ -0,0 +1,177 @@
+"""matrixstore.py
+
+Dense household x hour matrix store backed by `numpy.memmap`.
+
+The cleaned readings lie on a regular hourly grid (4_goi2imp.py reindexes
+every series), so they are stored as a float32 matrix with one row per
+household and one column per hour instead of a long table repeating ids and
+timestamps. A store is a directory with:
+
+- `kwh.f32`: row-major float32 matrix, NaN where a household has no reading,
+- `imputed.bits`: the imputation flags of the same matrix, bit-packed per row
+  (`numpy.packbits`, big-endian bit order),
+- `meta.json`: household ids (row order), start of the time axis and shape.
+
+Opening a store only maps the files, so it takes milliseconds and pages are
+read from disk on first access. Slicing a time range, or a set of households
+whose rows are contiguous, returns a view of the mapping without copying.
+
+Typical usage:
+    with MatrixStore('data/household_kwh_matrix') as store:
+        kwh = store.kwh_matrix(start=date(2022, 1, 1), end=date(2023, 1, 1))
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+HOUR = np.timedelta64(1, 'h')
+
+
+def build_matrix_store(readings, ids, output_dir, batch_rows=1_000_000):
+    """Materialize hourly readings into a matrix store.
+
+    Parameters
+    ----------
+    readings : pl.LazyFrame
+        Hourly readings with `id`, `timestamp` (naive, on the hour) and `kWh`
+        columns, and optionally the `imp` imputation flag.
+    ids : Sequence[str]
+        Households to store, in row order. Readings of other households are
+        ignored; households without readings get an all-NaN row.
+    output_dir : Path
+        Store directory; replaced if it exists.
+    batch_rows : int
+        Readings converted per batch. Memory use is bounded by the batch, not
+        by the number of readings.
+    """
+    ids = list(ids)
+    readings = readings.filter(pl.col('id').is_in(ids))
+    bounds = readings.select(pl.col('timestamp').min().alias('start'), pl.col('timestamp').max().alias('end')).collect()
+    if bounds['start'][0] is None:
+        start = np.datetime64('1970-01-01T00', 'h')
+        n_hours = 0
+    else:
+        start = np.datetime64(bounds['start'][0], 'h')
+        n_hours = int((np.datetime64(bounds['end'][0], 'h') - start) // HOUR) + 1
+
+    output_dir = Path(output_dir)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir(parents=True)
+
+    shape = (len(ids), n_hours)
+    if all(shape):
+        kwh = np.memmap(output_dir / 'kwh.f32', dtype=np.float32, mode='w+', shape=shape)
+        kwh[:] = np.nan
+        # Unpacked flags are staged on disk and bit-packed row by row at the end
+        imputed = np.memmap(output_dir / 'imputed.tmp', dtype=bool, mode='w+', shape=shape)
+
+        has_imp = 'imp' in readings.collect_schema()
+        columns = ['id', 'timestamp', 'kWh'] + (['imp'] if has_imp else [])
+        row_of = pl.DataFrame({'id': ids, 'row': np.arange(len(ids), dtype=np.uint32)})
+
+        for batch in readings.select(columns).collect_batches(chunk_size=batch_rows):
+            batch = batch.join(row_of, on='id')
+            rows = batch['row'].to_numpy()
+            cols = (batch['timestamp'].to_numpy().astype('datetime64[h]') - start) // HOUR
+            kwh[rows, cols] = batch['kWh'].to_numpy()
+            if has_imp:
+                imputed[rows, cols] = batch['imp'].fill_null(0).to_numpy() != 0
+        kwh.flush()
+
+        with open(output_dir / 'imputed.bits', 'wb') as outfile:
+            for row in range(len(ids)):
+                outfile.write(np.packbits(imputed[row]).tobytes())
+        del kwh, imputed
+        os.remove(output_dir / 'imputed.tmp')
+
+    with open(output_dir / 'meta.json', 'w') as outfile:
+        json.dump({'ids': ids, 'start': str(start), 'n_hours': n_hours, 'dtype': 'float32'}, outfile)
+
+
+class MatrixStore:
+    """Read-only access to a store written by `build_matrix_store`.
+
+    Parameters
+    ----------
+    path : Path
+        Store directory.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / 'meta.json') as infile:
+            meta = json.load(infile)
+        self.ids = np.array(meta['ids'], dtype=object)
+        self.start = np.datetime64(meta['start'], 'h')
+        self.n_hours = meta['n_hours']
+        self._row_of = {household: row for row, household in enumerate(meta['ids'])}
+
+        shape = (len(self.ids), self.n_hours)
+        bits_shape = (len(self.ids), (self.n_hours + 7) // 8)
+        if all(shape):
+            self.kwh = np.memmap(self.path / 'kwh.f32', dtype=np.float32, mode='r', shape=shape)
+            self._imputed_bits = np.memmap(self.path / 'imputed.bits', dtype=np.uint8, mode='r', shape=bits_shape)
+        else:
+            # numpy cannot map empty files
+            self.kwh = np.empty(shape, dtype=np.float32)
+            self._imputed_bits = np.empty(bits_shape, dtype=np.uint8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Release the memory maps."""
+        self.kwh = None
+        self._imputed_bits = None
+
+    @property
+    def timestamps(self):
+        """Time axis as `datetime64[h]` values."""
+        return self.start + np.arange(self.n_hours) * HOUR
+
+    def rows(self, ids=None):
+        """Row selector for `ids`: a slice when the rows are contiguous, else an index array."""
+        if ids is None:
+            return slice(None)
+        try:
+            rows = np.array([self._row_of[household] for household in ids], dtype=np.int64)
+        except KeyError as e:
+            raise KeyError(f"Unknown household: {e.args[0]}") from None
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return slice(int(rows[0]), int(rows[0]) + len(rows))
+        return rows
+
+    def columns(self, start=None, end=None):
+        """Column slice for the half-open time range [start, end)."""
+        def col(t, default):
+            if t is None:
+                return default
+            return int(np.clip((np.datetime64(t, 'h') - self.start) // HOUR, 0, self.n_hours))
+        return slice(col(start, 0), col(end, self.n_hours))
+
+    def kwh_matrix(self, ids=None, start=None, end=None):
+        """kWh of `ids` (all households when None) over [start, end).
+
+        Returns a read-only view of the memory map unless `ids` selects
+        non-contiguous rows, in which case only the selected rows are copied.
+        """
+        return self.kwh[self.rows(ids), self.columns(start, end)]
+
+    def imputed(self, ids=None, start=None, end=None):
+        """Boolean imputation flags of `ids` over [start, end) (always a copy)."""
+        columns = self.columns(start, end)
+        first_byte = columns.start // 8
+        bits = self._imputed_bits[self.rows(ids), first_byte:(columns.stop + 7) // 8]
+        offset = columns.start - first_byte * 8
+        return np.unpackbits(bits, axis=1)[:, offset:offset + columns.stop - columns.start].astype(bool)
+
+    def household(self, household_id, start=None, end=None):
+        """kWh of one household over [start, end) as a 1-D view."""
+        return self.kwh_matrix([household_id], start, end)[0]
@@ -0,0 +1,190 @@
+"""metadata.py
+
+Indexed household metadata for parameterized cohort selection.
+
+`MetadataStore` opens the standardized metadata written once by
+`preprocessing.normalize_metadata` (typed Parquet: dates, Float64 power and
+string codes) and keeps it in memory with a hash index from household id to
+its rows and sorted indexes on the start and end dates, cnae, tariff and
+postal code. `cohort` answers a selection with a few binary searches on those
+indexes, so trying other cutoffs, windows or cnae ranges takes milliseconds
+instead of re-reading and re-normalizing `metadata.csv`.
+
+Typical usage:
+    store = MetadataStore('data/metadata_standardized.parquet')
+    cohort = store.cohort(cutoff=date(2021, 6, 1), end_date_range=(date(2021, 6, 1), date(3020, 3, 1)),
+                          cnae_range=('9699', '9900'), min_days=365)
+"""
+
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+COLUMNS = ['id', 'start_date', 'end_date', 'cnae', 'postal_code', 'p1_kw', 'tarriff']
+
+# Columns of a selected cohort (the layout of preprocessing.COHORT_FILE)
+COHORT_COLUMNS = ['id', 'start_date', 'end_date', 'cnae', 'postal_code', 'p1_kw', 'tarriff', 'days_from_ref_to_end']
+
+# A household's rows that differ only in their dates are reduced to the one
+# with the most days of coverage
+GROUP_COLUMNS = ['id', 'cnae', 'postal_code', 'p1_kw', 'tarriff']
+
+_EPOCH = date(1970, 1, 1)
+
+
+def _days(day):
+    """Days since 1970-01-01 of a `datetime.date`."""
+    return (day - _EPOCH).days
+
+
+class _SortedIndex:
+    """Rows of the non-null values of a column, ordered by value."""
+
+    def __init__(self, values, valid):
+        rows = np.flatnonzero(valid)
+        order = np.argsort(values[rows], kind='stable')
+        self.rows = rows[order]
+        self.values = values[rows][order]
+
+    def between(self, low=None, high=None, closed='both'):
+        """Rows with low <= value <= high (`closed='none'`: low < value < high); None is an open bound."""
+        start = 0 if low is None else np.searchsorted(self.values, low, side='left' if closed == 'both' else 'right')
+        stop = len(self.values) if high is None else np.searchsorted(self.values, high, side='right' if closed == 'both' else 'left')
+        return self.rows[start:max(start, stop)]
+
+    def isin(self, values):
+        """Rows whose value is one of `values`."""
+        return np.concatenate([self.between(value, value) for value in values] or [self.rows[:0]])
+
+
+class MetadataStore:
+    """Standardized metadata with id and column indexes.
+
+    Parameters
+    ----------
+    path : Path
+        Output of `preprocessing.normalize_metadata`.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self._frame = pl.read_parquet(self.path, columns=COLUMNS)
+
+        self._rows = {}
+        for row, household in enumerate(self._frame['id'].to_list()):
+            self._rows.setdefault(household, []).append(row)
+
+        self._valid = {column: self._frame[column].is_not_null().to_numpy() for column in COLUMNS}
+        # Dates as days since the epoch; null dates are never in an index
+        self._start = self._frame['start_date'].cast(pl.Int32).fill_null(0).to_numpy()
+        self._end = self._frame['end_date'].cast(pl.Int32).fill_null(0).to_numpy()
+        self._indexes = {'start_date': _SortedIndex(self._start, self._valid['start_date']),
+                         'end_date': _SortedIndex(self._end, self._valid['end_date'])}
+        for column in ('cnae', 'postal_code', 'tarriff'):
+            # Fixed-width unicode arrays compare by code point, like Polars strings
+            values = np.array(self._frame[column].fill_null('').to_list(), dtype=str)
+            self._indexes[column] = _SortedIndex(values, self._valid[column])
+
+        # Group of each row: equal GROUP_COLUMNS, numbered in sorted order (nulls first)
+        grouped = self._frame.with_row_index('row').sort(GROUP_COLUMNS, maintain_order=True)
+        boundary = pl.any_horizontal([pl.col(c).ne_missing(pl.col(c).shift()) for c in GROUP_COLUMNS])
+        self._group = np.empty(len(self), dtype=np.int64)
+        self._group[grouped['row'].to_numpy()] = grouped.select(boundary.fill_null(True).cum_sum()).to_series().to_numpy()
+
+    def __len__(self):
+        return self._frame.height
+
+    def households(self):
+        """Household ids in the store, in first-appearance order."""
+        return list(self._rows)
+
+    def lookup(self, ids):
+        """Metadata rows of the households `ids`."""
+        try:
+            rows = [row for household in ids for row in self._rows[household]]
+        except KeyError as e:
+            raise KeyError(f"Unknown household: {e.args[0]}") from None
+        return self._frame[rows]
+
+    def cohort(self, cutoff, end_date_range, cnae_range, min_days, start_date_range=None, tariffs=None,
+               postal_codes=None, one_per_id=False):
+        """Select households by contract end date, cnae and coverage after `cutoff`.
+
+        Same selection as `preprocessing.select_cohort`: rows whose end date
+        falls in `end_date_range` (inclusive) and whose cnae lies strictly
+        between the `cnae_range` strings, with at least `min_days` days from
+        the later of their start date and `cutoff` to their end date. Start
+        dates before the cutoff are moved to it, and of the rows of a household
+        that differ only in their dates the one with the most days is kept.
+
+        Parameters
+        ----------
+        cutoff : datetime.date
+            Start of the analysis window.
+        end_date_range : tuple[datetime.date, datetime.date]
+            Inclusive range of the contract end date.
+        cnae_range : tuple[str, str]
+            Exclusive (string) bounds of the cnae codes.
+        min_days : int
+            Minimum days of coverage after the cutoff.
+        start_date_range : tuple[datetime.date, datetime.date], optional
+            Inclusive range of the contract start date (before it is moved to
+            the cutoff).
+        tariffs : iterable of str, optional
+            Keep only these tariffs (`tarriff` column).
+        postal_codes : iterable of str, optional
+            Keep only these postal codes.
+        one_per_id : bool
+            Keep a single row per household (the one with the most days)
+            even when its rows differ in cnae, postal code, power or tariff.
+
+        Returns
+        -------
+        pl.DataFrame
+            The `COHORT_COLUMNS`, sorted by the `GROUP_COLUMNS`.
+        """
+        indexes = self._indexes
+        matches = [indexes['end_date'].between(_days(end_date_range[0]), _days(end_date_range[1])),
+                   indexes['cnae'].between(*cnae_range, closed='none')]
+        if start_date_range is not None:
+            matches.append(indexes['start_date'].between(_days(start_date_range[0]), _days(start_date_range[1])))
+        if tariffs is not None:
+            matches.append(indexes['tarriff'].isin(tariffs))
+        if postal_codes is not None:
+            matches.append(indexes['postal_code'].isin(postal_codes))
+        # Rows matching every condition
+        hits = np.zeros(len(self), dtype=np.int8)
+        for rows in matches:
+            hits[rows] += 1
+        selected = hits == len(matches)
+
+        rows = np.flatnonzero(selected)
+        # Days from the later of the start date and the cutoff (the cutoff if unknown) to the end date
+        ref = np.where(self._valid['start_date'][rows], np.maximum(self._start[rows], _days(cutoff)), _days(cutoff))
+        days = self._end[rows].astype(np.int64) - ref
+        rows, days = rows[days >= min_days], days[days >= min_days]
+
+        # Row with the max days_from_ref_to_end per group (the first one on ties), in group order
+        order = np.lexsort((-days, self._group[rows]))
+        rows, days = rows[order], days[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = self._group[rows[1:]] != self._group[rows[:-1]]
+        rows, days = rows[first], days[first]
+
+        cohort = (
+            self._frame[rows]
+            .with_columns(
+                pl.when(pl.col('start_date') < cutoff).then(pl.lit(cutoff)).otherwise(pl.col('start_date'))
+                  .alias('start_date'),
+                pl.Series('days_from_ref_to_end', days, dtype=pl.Int64),
+            )
+            .select(COHORT_COLUMNS)
+        )
+        if one_per_id:
+            cohort = (
+                cohort
+                .filter(pl.col('days_from_ref_to_end') == pl.col('days_from_ref_to_end').max().over('id'))
+                .unique('id', keep='first', maintain_order=True)
+            )
+        return cohort
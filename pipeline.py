@@ -0,0 +1,341 @@
+"""pipeline.py
+
+Incremental stage runner for the GoiEner preprocessing and processing steps.
+
+The pipeline is a chain of stages:
+
+    extract -> normalize_metadata -> select_cohort -> merge -> filter_window
+            -> index_readings
+            -> summarize_runs -> find_zero_runs -> join_metadata
+            -> load_profile_features -> build_matrix
+
+Each stage declares its input files, output files and parameters. Before a
+stage runs, the runner hashes its code (the source files of its module and of
+every repository module it imports, directly or not), its parameter values
+and the content of its inputs. If that key matches the one recorded after the previous run and
+all outputs still exist, the stage is skipped. Outputs are hashed as soon as
+they are written, so a stage whose output did not change does not invalidate
+the stages after it. Content hashes are cached per file by size and
+modification time, so unchanged multi-GB inputs are not re-read on every run.
+
+Every stage that runs appends a record to a JSON-lines telemetry log (see
+telemetry.py): wall and CPU time, peak RSS, input and output bytes and, where
+the stage reports them, rows in and out. Skipped stages are logged as such.
+
+Typical usage:
+    python pipeline.py                        # run whatever is out of date
+    python pipeline.py --until select_cohort  # stop after a stage
+    python pipeline.py --force join_metadata  # re-run a stage regardless
+    python pipeline.py --profile --plans      # also cProfile stages, log Polars plans
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import sys
+from datetime import date
+from pathlib import Path
+from types import ModuleType
+
+import preprocessing
+import processing
+from telemetry import Telemetry
+
+STATE_DIR = Path(preprocessing.DATA_DIR, '.stages')
+
+# Modules under this directory are part of a stage's code (see StageRunner._code)
+ROOT = Path(__file__).resolve().parent
+
+# Parameters shared by the stages. Changing any of them only re-runs the
+# stages that use it (and the stages whose inputs change as a result).
+PARAMS = {
+    'ingest_mode': preprocessing.INGEST_MODE,
+    'cutoff': date(2021, 6, 1),
+    'end_date_range': (date(2021, 6, 1), date(3020, 3, 1)),
+    'cnae_range': ('9699', '9900'),
+    'min_days': 365,
+    'window': (date(2021, 6, 1), date(3023, 1, 1)),
+    'zero_day_thresholds': (0.01, 0.05, 0.1),
+    'zero_hour_thresholds': (0.001,),
+    'zero_day_kwh': 0.01,
+    'min_zero_run': 2,
+    'batch_size': processing.BATCH_SIZE,
+}
+
+
+def _repo_source(module):
+    """Source file of `module` when it is part of this repository, else None."""
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return None
+    path = Path(path).resolve()
+    if not path.is_relative_to(ROOT):
+        return None
+    relative = path.relative_to(ROOT).parts
+    # Skip virtual environments and other hidden directories inside the checkout
+    if 'site-packages' in relative or relative[0].startswith('.'):
+        return None
+    return path
+
+
+class Stage:
+    """One step of the pipeline.
+
+    Parameters
+    ----------
+    name : str
+        Unique stage name.
+    func : Callable
+        Function called with the inputs, outputs and params as keyword arguments.
+    inputs : dict[str, Path]
+        Keyword argument name -> input file or directory.
+    outputs : dict[str, Path]
+        Keyword argument name -> output file or directory.
+    params : Sequence[str]
+        Names of the `PARAMS` entries passed to `func`.
+    """
+    def __init__(self, name, func, inputs, outputs, params=()):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params
+
+
+class StageRunner:
+    """Run stages in order, skipping those whose inputs and parameters are unchanged.
+
+    Parameters
+    ----------
+    stages : Sequence[Stage]
+        Stages in execution order.
+    params : dict
+        Parameter values available to the stages.
+    state_dir : Path
+        Directory holding the per-stage state and the content hash cache.
+    telemetry : Telemetry | None
+        Writer of the per-stage performance records; none are written when None.
+    """
+    def __init__(self, stages, params, state_dir=STATE_DIR, telemetry=None):
+        self._stages = stages
+        self._params = params
+        self._telemetry = telemetry or Telemetry()
+        self._state_dir = Path(state_dir)
+        self._state_dir.mkdir(parents=True, exist_ok=True)
+        self._hash_cache_path = self._state_dir / 'hashes.json'
+        self._hash_cache = self._load_json(self._hash_cache_path) or {}
+
+    @staticmethod
+    def _load_json(path):
+        if not path.exists():
+            return None
+        with open(path) as infile:
+            return json.load(infile)
+
+    def _file_hash(self, path):
+        """Content hash of a file, reusing the cached one while size and mtime match."""
+        stat = path.stat()
+        cached = self._hash_cache.get(str(path))
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(1 << 20), b''):
+                digest.update(block)
+        self._hash_cache[str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                       'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def _fingerprint(self, path):
+        """Hash a file, or every file under a directory; None when missing."""
+        path = Path(path)
+        if path.is_file():
+            return self._file_hash(path)
+        if path.is_dir():
+            digest = hashlib.sha256()
+            for file_path in sorted(p for p in path.rglob('*') if p.is_file()):
+                digest.update(f"{file_path.relative_to(path)}:{self._file_hash(file_path)}".encode())
+            return digest.hexdigest()
+        return None
+
+    @staticmethod
+    def _size(path):
+        """Size in bytes of a file, or of every file under a directory; 0 when missing."""
+        path = Path(path)
+        if path.is_file():
+            return path.stat().st_size
+        if path.is_dir():
+            return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+        return 0
+
+    def _code(self, stage):
+        """Content hashes of the repository modules `stage.func` depends on.
+
+        Starts from the module defining the function and follows, transitively,
+        every module, function or class it imports from this repository, so
+        editing a helper (e.g. metadata.py or runlength.py) invalidates the
+        stages that use it. Third-party and standard library modules are not
+        followed.
+        """
+        pending = [inspect.getmodule(stage.func)]
+        seen = {}
+        while pending:
+            module = pending.pop()
+            path = _repo_source(module)
+            if path is None or module.__name__ in seen:
+                continue
+            seen[module.__name__] = self._file_hash(path)
+            for value in vars(module).values():
+                if isinstance(value, ModuleType):
+                    pending.append(value)
+                elif getattr(value, '__module__', None) in sys.modules:
+                    pending.append(sys.modules[value.__module__])
+        return seen
+
+    def _key(self, stage):
+        payload = {
+            'stage': stage.name,
+            'code': self._code(stage),
+            'params': {name: self._params[name] for name in stage.params},
+            'inputs': {name: self._fingerprint(path) for name, path in stage.inputs.items()},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def run(self, until=None, force=()):
+        """Run the stages in order up to and including `until`.
+
+        Parameters
+        ----------
+        until : str | None
+            Last stage to run. All stages when None.
+        force : Iterable[str]
+            Stage names to re-run even when they are up to date.
+        """
+        force = set(force)
+        try:
+            for stage in self._stages:
+                state_path = self._state_dir / f'{stage.name}.json'
+                state = self._load_json(state_path) or {}
+                key = self._key(stage)
+                outputs_exist = all(Path(p).exists() for p in stage.outputs.values())
+
+                if stage.name not in force and state.get('key') == key and outputs_exist:
+                    print(f"[{stage.name}] up to date")
+                    self._telemetry.emit('stage', stage=stage.name, skipped=True)
+                else:
+                    print(f"[{stage.name}] running")
+                    bytes_in = sum(self._size(path) for path in stage.inputs.values())
+                    with self._telemetry.stage(stage.name, bytes_in=bytes_in) as record:
+                        stage.func(**stage.inputs, **stage.outputs,
+                                   **{name: self._params[name] for name in stage.params})
+                        record['bytes_out'] = sum(self._size(path) for path in stage.outputs.values())
+                    seconds = record['wall_s']
+                    # Hash the fresh outputs while they are still in the page cache
+                    for path in stage.outputs.values():
+                        self._fingerprint(path)
+                    with open(state_path, 'w') as outfile:
+                        json.dump({'key': key, 'seconds': seconds}, outfile)
+                    print(f"[{stage.name}] done in {seconds:.2f}s")
+
+                if stage.name == until:
+                    break
+        finally:
+            with open(self._hash_cache_path, 'w') as outfile:
+                json.dump(self._hash_cache, outfile)
+
+
+def build_stages(params):
+    """Return the GoiEner stages for the given parameters."""
+    if params['ingest_mode'] == 'parquet':
+        extracted = preprocessing.DATASET_DIR
+        readings = preprocessing.DATASET_DIR
+    else:
+        extracted = preprocessing.ARCHIVE_INDEX
+        readings = preprocessing.MERGED_FILE
+    post_covid = preprocessing.post_covid_file(params['ingest_mode'])
+
+    stages = [
+        Stage('extract', preprocessing.extract,
+              inputs={'archive': preprocessing.ARCHIVE},
+              outputs={'output': extracted},
+              params=['ingest_mode']),
+        Stage('normalize_metadata', preprocessing.normalize_metadata,
+              inputs={'metadata_csv': preprocessing.METADATA},
+              outputs={'output_file': preprocessing.METADATA_STANDARDIZED}),
+        Stage('select_cohort', preprocessing.select_cohort,
+              inputs={'metadata_standardized': preprocessing.METADATA_STANDARDIZED},
+              outputs={'output_file': preprocessing.COHORT_FILE},
+              params=['cutoff', 'end_date_range', 'cnae_range', 'min_days']),
+    ]
+    if params['ingest_mode'] != 'parquet':
+        stages.append(
+            Stage('merge', preprocessing.merge,
+                  inputs={'cohort': preprocessing.COHORT_FILE, 'archive_index': preprocessing.ARCHIVE_INDEX},
+                  outputs={'output_file': preprocessing.MERGED_FILE}))
+    stages += [
+        Stage('filter_window', preprocessing.filter_window,
+              inputs={'readings': readings, 'cohort': preprocessing.COHORT_FILE},
+              outputs={'output_file': post_covid},
+              params=['window']),
+        Stage('index_readings', preprocessing.index_readings,
+              inputs={'readings': post_covid},
+              outputs={'output_dir': preprocessing.QUERY_DIR}),
+        Stage('summarize_runs', processing.summarize_runs,
+              inputs={'readings': post_covid, 'cohort': preprocessing.COHORT_FILE},
+              outputs={'output_file': processing.RUN_LENGTHS_FILE},
+              params=['window', 'zero_day_thresholds', 'zero_hour_thresholds', 'batch_size']),
+        Stage('find_zero_runs', processing.find_zero_runs,
+              inputs={'run_lengths': processing.RUN_LENGTHS_FILE},
+              outputs={'output_file': processing.ZERO_RUNS_FILE},
+              params=['zero_day_thresholds', 'zero_day_kwh', 'min_zero_run']),
+        Stage('join_metadata', processing.join_metadata,
+              inputs={'readings': post_covid, 'cohort': preprocessing.COHORT_FILE,
+                      'zero_runs': processing.ZERO_RUNS_FILE},
+              outputs={'output_file': processing.OUTPUT_FILE},
+              params=['window']),
+        Stage('load_profile_features', processing.load_profile_features,
+              inputs={'readings': post_covid, 'cohort': preprocessing.COHORT_FILE,
+                      'zero_runs': processing.ZERO_RUNS_FILE},
+              outputs={'output_file': processing.LOAD_FEATURES_FILE},
+              params=['window']),
+        Stage('build_matrix', processing.build_matrix,
+              inputs={'readings': readings, 'cohort': preprocessing.COHORT_FILE,
+                      'zero_runs': processing.ZERO_RUNS_FILE},
+              outputs={'output_dir': processing.MATRIX_DIR},
+              params=['window']),
+    ]
+    return stages
+
+
+def run_pipeline(until=None, force=(), params=None, telemetry_log=STATE_DIR / 'telemetry.jsonl',
+                 profile=False, plans=False):
+    """Run the GoiEner pipeline, skipping stages that are up to date.
+
+    Stage telemetry is appended to `telemetry_log` (None disables it). With
+    `profile`, each stage that runs is profiled into ``STATE_DIR/profiles/<stage>.prof``;
+    with `plans`, the optimized plans of the stages' lazy Polars queries are
+    added to their records.
+    """
+    params = {**PARAMS, **(params or {})}
+    with Telemetry(telemetry_log, profile_dir=STATE_DIR / 'profiles' if profile else None,
+                   plans=plans) as telemetry:
+        StageRunner(build_stages(params), params, telemetry=telemetry).run(until=until, force=force)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--until', help='last stage to run')
+    parser.add_argument('--force', action='append', default=[], help='stage to re-run even if up to date')
+    parser.add_argument('--telemetry', type=Path, default=STATE_DIR / 'telemetry.jsonl',
+                        help='JSON-lines file the stage telemetry is appended to')
+    parser.add_argument('--profile', action='store_true', help='profile each stage with cProfile')
+    parser.add_argument('--plans', action='store_true', help='log the optimized plans of the lazy Polars queries')
+    args = parser.parse_args()
+    run_pipeline(until=args.until, force=args.force, telemetry_log=args.telemetry,
+                 profile=args.profile, plans=args.plans)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,32 @@
 """preprocessing.py
 
-One-off preprocessing script for Goiener dataset used to generate:
+Preprocessing stages for the Goiener dataset used to generate:
 - data/metadata_post_covid_households_year.csv
-- data/household_kwh.csv
-- data/post_covid_household_kwh.csv
+- data/household_kwh.csv (or .parquet/.arrow, or the data/household_kwh/ dataset)
+- data/post_covid_household_kwh.csv (.parquet in 'parquet' ingest mode)
+- data/readings_by_household/ (the same readings indexed by household, see query.py)
 
-The script normalizes the original metadata, filters post-COVID households with
-at least one year of data after a reference date, merges per-household CSVs
-into a single CSV, and writes filtered hourly readings for the post-COVID
-period.
+The stages normalize the original metadata, filter post-COVID households with
+at least one year of data after a reference date, extract just those
+households from the archive, merge their per-household CSVs into a single
+CSV, and write filtered hourly readings for the post-COVID period.
+
+Each stage is a function of its input paths, output paths and parameters, and
+is scheduled by the cached stage runner in `pipeline.py`. Running this file
+executes the preprocessing stages through that runner.
 """
 
-from extractors import Extractor
+import shutil
 from pathlib import Path
+
 import polars as pl
 
-from csvmerger import CSVMerger
+from csvmerger import CSVMerger, scan_merged
+from extractors import Extractor
+from ingest import ParquetIngestor, scan_household_kwh
+from metadata import MetadataStore
+from query import build_query_store
+from telemetry import capture_plan, count
 
 # Extract tar file
 DATA_DIR = 'data'
@@ -23,186 +34,253 @@ FILE_NAME = 'imputed_goiener_v7.tar.zst'
 EXTRACTED_DIR = Path(DATA_DIR, FILE_NAME.split('.')[0]) # imputed_goiener_v7
 
 METADATA = Path(DATA_DIR, 'metadata.csv')
+ARCHIVE = Path(DATA_DIR, FILE_NAME)
+ARCHIVE_INDEX = Path(DATA_DIR, f'{FILE_NAME}.index.csv')
 
-# If the extracted folder with per-household CSVs doesn't exist, decompress
-# the provided archive into `data/imputed_goiener_v7/`.
-if not EXTRACTED_DIR.exists():
-    # Pass string paths to match the Extractor constructor annotation
-    extractor = Extractor(str(Path(DATA_DIR, FILE_NAME)), DATA_DIR)
-
-    extractor.decompress_tzst()
-# Metadata standardization
-# Read raw metadata and coerce types where possible. The schema overrides
-# prevent some columns from being auto-inferred incorrectly (e.g. postal code
-# and cnae as strings rather than integers).
-metadata = pl.read_csv(METADATA, try_parse_dates=True, schema_overrides={'cnae':pl.String, 'codigo_postal':pl.String, 'fecha_alta':pl.String, 'fecha_baja':pl.String, 'p1_kw':pl.String, 'p2_kw':pl.String, 'p3_kw':pl.String, 'p4_kw':pl.String, 'p5_kw':pl.String, 'p6_kw':pl.String})
-
-# Normalize and clean several metadata fields. This block attempts to parse
-# dates in multiple formats and to coerce tariff tiers (p1_kw, etc.) to numeric
-# where possible. 'NA' strings are converted to None.
-metadata_standardized = metadata.with_columns(
-    pl.col("cups").alias("id"),
-    pl.when(pl.col("fecha_alta").str.contains("/"))
-      .then(
-          pl.col("fecha_alta")
-            .str.strptime(pl.Date, "%d/%m/%Y", strict=False)
-            .dt.strftime("%Y-%m-%d")
-      )
-      .otherwise(
-          pl.when(pl.col("fecha_alta").str.contains("-"))
-            .then(pl.col("fecha_alta"))
-            .otherwise(None)
-      ).alias("start_date")
-    .cast(pl.Date),
-    pl.when(pl.col("fecha_baja").str.contains("/"))
-      .then(
-          pl.col("fecha_baja")
-            .str.strptime(pl.Date, "%d/%m/%Y", strict=False)
-            .dt.strftime("%Y-%m-%d")
-      )
-      .otherwise(
-          pl.when(pl.col("fecha_baja").str.contains("-"))
-            .then(pl.col("fecha_baja"))
-            .otherwise(None)
-      ).alias("end_date")
-    .cast(pl.Date),
-    pl.when(pl.col("p1_kw") == "NA")
-      .then(pl.lit(None).cast(pl.Float64))
-      .otherwise(pl.col("p1_kw").cast(pl.Float64, strict=False)).alias("p1_kw"),
-    # other p*_kw columns were intentionally left commented in the original
-    # script; they can be restored if needed.
-
-    pl.when(pl.col("codigo_postal") == "NA")
-      .then(None)
-      .otherwise(pl.col("codigo_postal").cast(pl.String, strict=False)).alias("postal_code"),
-    pl.when(pl.col("cnae") == "NA")
-      .then(None)
-      .otherwise(pl.col("cnae").cast(pl.String, strict=False)).alias("cnae"),
-    pl.when(pl.col("tarifa_atr") == "NA")
-      .then(None)
-      .otherwise(pl.col("tarifa_atr").cast(pl.String, strict=False)).alias("tarriff"),
-).drop(["cups", "fecha_alta", "fecha_baja", "codigo_postal", "tarifa_atr"])
-
-# Keep only the columns used downstream. This reduces memory and makes outputs
-# predictable for subsequent steps.
-metadata_standardized = metadata_standardized.select([
-    pl.col("id"),
-    pl.col("start_date"),
-    pl.col("end_date"),
-    pl.col("cnae"),
-    pl.col("postal_code"),
-    pl.col("p1_kw"),
-    # pl.col("p2_kw"),
-    # pl.col("p3_kw"),
-    # pl.col("p4_kw"),
-    # pl.col("p5_kw"),
-    # pl.col("p6_kw"),
-    pl.col("tarriff"),
-])
-
-# Remove duplicate metadata rows while preserving input order where possible.
-metadata_standardized = metadata_standardized.unique(maintain_order=True)
-
-# Select households that were active after the initial pandemic period (loosely
-# defined here). This creates an intermediate 'post_covid' dataset used to
-# filter the list of household CSVs to merge.
-metadata_post_covid = metadata_standardized.filter([
-    pl.col("end_date").is_between(pl.datetime(2021, 6, 1, time_zone="UTC"), pl.datetime(3020, 3, 1, time_zone="UTC"))
-])
-
-# Narrow to residential households by cnae code range.
-metadata_post_covid_households = metadata_post_covid.filter(
-    (pl.col('cnae') > '9699'),
-    (pl.col('cnae') < '9900')
-)
-
-# Define a cutoff reference date (start of the post-COVID analysis window).
-cutoff = pl.datetime(2021, 6, 1)  # use pl.date(...) if your cols are Date
-
-# Compute number of days available after the reference for each metadata row.
-# We choose the row per household that maximizes the days available after the
-# reference date (after some grouping/aggregation below) so we can ensure at
-# least a year of post-reference coverage.
-metadata_post_covid_households = (
-    metadata_post_covid_households
-    .with_columns(
-        pl.max_horizontal(pl.col("start_date"), cutoff).alias("ref")
-    )
-    .with_columns(
-        (pl.col("end_date") - pl.col("ref")).dt.total_days().alias("days_from_ref_to_end")
-    )
-)
-
-# Keep only households with at least 365 days of data after the reference date.
-metadata_post_covid_households_year = metadata_post_covid_households.filter(pl.col('days_from_ref_to_end') >= 365)
-
-# Determine group-by columns (all metadata columns except the date helpers).
-group_cols = [c for c in metadata_post_covid_households_year.columns
-              if c not in ["start_date", "end_date", "ref", "days_from_ref_to_end"]]
-
-# For each household (and the other identifying metadata), keep the row that
-# provides the maximum days_from_ref_to_end. This helps disambiguate multiple
-# metadata entries per household and choose the most complete one.
-metadata_post_covid_households_year = (
-    metadata_post_covid_households_year
-    .with_columns(
-        pl.when(pl.col("start_date") < cutoff)
-          .then(cutoff)
-          .otherwise(pl.col("start_date"))
-          .cast(pl.Date)
-          .alias("start_date")
-    )
-    .with_columns(
-        pl.max_horizontal(pl.col("start_date"), cutoff).alias("ref")
+# Ingest mode: 'csv' extracts the per-household CSVs and merges them into
+# data/household_kwh.csv; 'parquet' parses every archive member once into the
+# hive-partitioned dataset data/household_kwh/ (see ingest.py) and writes the
+# post-COVID readings as Parquet.
+INGEST_MODE = 'csv'
+DATASET_DIR = Path(DATA_DIR, 'household_kwh')
+
+# Merged readings written in 'csv' ingest mode. Naming it household_kwh.parquet
+# (or .arrow) stores the household id as a UInt32 code plus a lookup table
+# instead of repeating the 64-character id on every row (see csvmerger.py).
+MERGED_FILE = Path(DATA_DIR, 'household_kwh.csv')
+
+METADATA_STANDARDIZED = Path(DATA_DIR, 'metadata_standardized.parquet')
+COHORT_FILE = Path(DATA_DIR, 'metadata_post_covid_households_year.csv')
+QUERY_DIR = Path(DATA_DIR, 'readings_by_household')
+
+
+def post_covid_file(ingest_mode):
+    """Post-COVID readings written by `filter_window` in `ingest_mode` (Parquet in 'parquet' mode)."""
+    return Path(DATA_DIR, 'post_covid_household_kwh.parquet' if ingest_mode == 'parquet' else 'post_covid_household_kwh.csv')
+
+
+# Post-COVID readings of the default ingest mode; the pipeline derives the
+# path from its `ingest_mode` parameter
+POST_COVID_FILE = post_covid_file(INGEST_MODE)
+
+
+def _datetime(day, time_zone=None):
+    """Datetime literal at midnight of a `datetime.date` parameter."""
+    return pl.datetime(day.year, day.month, day.day, time_zone=time_zone)
+
+
+def extract(archive, output, ingest_mode):
+    """Prepare the archive for the selected ingest mode.
+
+    In 'csv' mode the archive's member index is written to `output`; the
+    households themselves are extracted by `merge` once the cohort is known.
+    In 'parquet' mode every member is ingested into the dataset directory
+    `output`.
+    """
+    if ingest_mode == 'parquet':
+        shutil.rmtree(output, ignore_errors=True)
+        ParquetIngestor(str(archive), str(output)).ingest()
+    else:
+        # Pass string paths to match the Extractor constructor annotation
+        Extractor(str(archive), DATA_DIR).build_index(output)
+
+
+def normalize_metadata(metadata_csv, output_file):
+    """Standardize the raw metadata and write it to `output_file` (Parquet)."""
+    # Metadata standardization
+    # Read raw metadata and coerce types where possible. The schema overrides
+    # prevent some columns from being auto-inferred incorrectly (e.g. postal code
+    # and cnae as strings rather than integers).
+    metadata = pl.read_csv(metadata_csv, try_parse_dates=True, schema_overrides={'cnae':pl.String, 'codigo_postal':pl.String, 'fecha_alta':pl.String, 'fecha_baja':pl.String, 'p1_kw':pl.String, 'p2_kw':pl.String, 'p3_kw':pl.String, 'p4_kw':pl.String, 'p5_kw':pl.String, 'p6_kw':pl.String})
+
+    # Normalize and clean several metadata fields. This block attempts to parse
+    # dates in multiple formats and to coerce tariff tiers (p1_kw, etc.) to numeric
+    # where possible. 'NA' strings are converted to None.
+    metadata_standardized = metadata.with_columns(
+        pl.col("cups").alias("id"),
+        pl.when(pl.col("fecha_alta").str.contains("/"))
+          .then(
+              pl.col("fecha_alta")
+                .str.strptime(pl.Date, "%d/%m/%Y", strict=False)
+                .dt.strftime("%Y-%m-%d")
+          )
+          .otherwise(
+              pl.when(pl.col("fecha_alta").str.contains("-"))
+                .then(pl.col("fecha_alta"))
+                .otherwise(None)
+          ).alias("start_date")
+        .cast(pl.Date),
+        pl.when(pl.col("fecha_baja").str.contains("/"))
+          .then(
+              pl.col("fecha_baja")
+                .str.strptime(pl.Date, "%d/%m/%Y", strict=False)
+                .dt.strftime("%Y-%m-%d")
+          )
+          .otherwise(
+              pl.when(pl.col("fecha_baja").str.contains("-"))
+                .then(pl.col("fecha_baja"))
+                .otherwise(None)
+          ).alias("end_date")
+        .cast(pl.Date),
+        pl.when(pl.col("p1_kw") == "NA")
+          .then(pl.lit(None).cast(pl.Float64))
+          .otherwise(pl.col("p1_kw").cast(pl.Float64, strict=False)).alias("p1_kw"),
+        # other p*_kw columns were intentionally left commented in the original
+        # script; they can be restored if needed.
+
+        pl.when(pl.col("codigo_postal") == "NA")
+          .then(None)
+          .otherwise(pl.col("codigo_postal").cast(pl.String, strict=False)).alias("postal_code"),
+        pl.when(pl.col("cnae") == "NA")
+          .then(None)
+          .otherwise(pl.col("cnae").cast(pl.String, strict=False)).alias("cnae"),
+        pl.when(pl.col("tarifa_atr") == "NA")
+          .then(None)
+          .otherwise(pl.col("tarifa_atr").cast(pl.String, strict=False)).alias("tarriff"),
+    ).drop(["cups", "fecha_alta", "fecha_baja", "codigo_postal", "tarifa_atr"])
+
+    # Keep only the columns used downstream. This reduces memory and makes outputs
+    # predictable for subsequent steps.
+    metadata_standardized = metadata_standardized.select([
+        pl.col("id"),
+        pl.col("start_date"),
+        pl.col("end_date"),
+        pl.col("cnae"),
+        pl.col("postal_code"),
+        pl.col("p1_kw"),
+        # pl.col("p2_kw"),
+        # pl.col("p3_kw"),
+        # pl.col("p4_kw"),
+        # pl.col("p5_kw"),
+        # pl.col("p6_kw"),
+        pl.col("tarriff"),
+    ])
+
+    # Remove duplicate metadata rows while preserving input order where possible.
+    metadata_standardized = metadata_standardized.unique(maintain_order=True)
+
+    metadata_standardized.write_parquet(output_file)
+    count(rows_in=metadata.height, rows_out=metadata_standardized.height)
+
+
+def select_cohort(metadata_standardized, output_file, cutoff, end_date_range, cnae_range, min_days):
+    """Select post-COVID residential households with enough coverage.
+
+    Parameters
+    ----------
+    metadata_standardized : Path
+        Output of `normalize_metadata`.
+    output_file : Path
+        CSV with one row per selected household/metadata combination.
+    cutoff : datetime.date
+        Start of the post-COVID analysis window.
+    end_date_range : tuple[datetime.date, datetime.date]
+        Inclusive range the contract end date must fall in.
+    cnae_range : tuple[str, str]
+        Exclusive (string) bounds of the residential cnae codes.
+    min_days : int
+        Minimum days of coverage after the cutoff.
+    """
+    store = MetadataStore(metadata_standardized)
+
+    # Households active after the initial pandemic period (loosely defined by
+    # the contract end date), residential by cnae code, with at least `min_days`
+    # (365) days after the cutoff; per household, the metadata row with the most
+    # days_from_ref_to_end (see metadata.py).
+    metadata_post_covid_households_year = store.cohort(cutoff, end_date_range, cnae_range, min_days)
+
+    # Persist the per-household metadata used later to choose which CSVs to merge.
+    metadata_post_covid_households_year.write_csv(output_file)
+    count(rows_in=len(store), rows_out=metadata_post_covid_households_year.height)
+    households = metadata_post_covid_households_year['id'].unique().to_list()
+    print(f"Post-COVID households={len(households)}")
+
+
+def merge(cohort, archive_index, output_file):
+    """Extract the cohort's missing households and merge their CSVs into `output_file`."""
+    households = pl.read_csv(cohort, schema_overrides={'id': pl.String})['id'].unique().to_list()
+
+    # Extract only the selected households whose CSVs are not under
+    # `data/imputed_goiener_v7/` yet. The archive's member index lets a single
+    # forward pass skip every other member.
+    missing_households = [h for h in households if not Path(EXTRACTED_DIR, f'{h}.csv').exists()]
+    if missing_households:
+        extractor = Extractor(str(ARCHIVE), DATA_DIR)
+        not_in_archive = extractor.extract_households(missing_households, index_path=archive_index)
+        print(f"Households without readings in the archive={len(not_in_archive)}")
+
+    # Build a list of per-household CSV paths to merge. These files are expected to
+    # be present under the folder produced by extracting the original archive.
+    households_csvs = [f'{EXTRACTED_DIR}/{f}.csv' for f in households]
+
+    # Use the CSVMerger utility to combine all per-household CSVs into a single
+    # file. The combined file will include an `id` column.
+    csvMerger = CSVMerger(households_csvs, None, str(output_file))
+    csvMerger.combine_csv_files(fast=True, schema_overrides={'kWh':pl.Float64})
+
+
+def scan_readings(readings, households=None):
+    """Lazily scan all readings with id, timestamp, kWh and imp columns.
+
+    `readings` is either the merged file written by `merge` or the Parquet
+    dataset written by `extract` in 'parquet' mode. With `households`, only
+    their readings are kept, with the id predicate pushed into the scan.
+    """
+    if Path(readings).is_dir():
+        # Readings were parsed once at ingest time; files are sorted by id, so
+        # id filters skip other households' row groups.
+        readings_lf = scan_household_kwh(readings)
+        return readings_lf if households is None else readings_lf.filter(pl.col('id').is_in(households))
+    # Scan the merged table and rename the auto-generated index column to
+    # `timestamp` so downstream code expects the same column names.
+    return (
+        scan_merged(readings, schema_overrides={'kWh':pl.Float64}, ids=households)
+        .rename({'index': 'timestamp'})
     )
-    .with_columns(
-        (pl.col("end_date") - pl.col("ref")).dt.total_days().alias("days_from_ref_to_end")
+
+
+def window_query(readings, households, window):
+    """Lazy query of the `households`' id, timestamp and kWh inside `window` (see `filter_window`)."""
+    return (
+        scan_readings(readings, households)
+        .filter(pl.col('timestamp').is_between(_datetime(window[0]), _datetime(window[1])))
+        .select('id', 'timestamp', 'kWh')
     )
-    # choose row with max days_from_ref_to_end per group
-    .sort(group_cols + ["days_from_ref_to_end"], descending=[False]*len(group_cols) + [True])
-    .group_by(group_cols, maintain_order=True)
-    .head(1)
-)
-
-# Keep a subset of useful output fields and persist the resulting metadata CSV
-# for later stages.
-metadata_post_covid_households_year = metadata_post_covid_households_year.select(['id', 'start_date', 'end_date', 'cnae','postal_code', 'p1_kw', 'tarriff', 'days_from_ref_to_end'])
-
-# When multiple rows exist for the same household id, keep the last one after
-# sorting by days_from_ref_to_end (i.e., the row with most coverage).
-metadata_post_covid_households_year_clean = (
-    metadata_post_covid_households_year
-    .sort(["id", "days_from_ref_to_end"], descending=True)
-    .unique(subset=["id"], keep="last", maintain_order=True)
-)
-
-# Persist the per-household metadata used later to choose which CSVs to merge.
-metadata_post_covid_households_year.write_csv('data/metadata_post_covid_households_year.csv')
-households = metadata_post_covid_households_year['id'].unique().to_list()
-print(f"Post-COVID households={len(households)}")
-
-# Build a list of per-household CSV paths to merge. These files are expected to
-# be present under the folder produced by extracting the original archive.
-households_csvs = [f'{EXTRACTED_DIR}/{f}.csv' for f in households]
-
-
-# Use the CSVMerger utility to combine all per-household CSVs into a single
-# file `data/household_kwh.csv`. The combined CSV will include an `id` column.
-csvMerger = CSVMerger(households_csvs, None, 'data/household_kwh.csv')
-csvMerger.combine_csv_files()
-
-
-# Read the merged table, coerce types and rename the auto-generated index
-# column to `timestamp` so downstream code expects the same column names.
-households_df = pl.read_csv('data/household_kwh.csv', try_parse_dates=True, schema_overrides={'kWh':pl.Float64}).with_columns(pl.col('index').alias('timestamp')).select('id', 'timestamp', 'kWh', 'imp')
-
-# Filter hourly readings to the post-COVID analysis window and write the
-# per-reading CSV used by the `processing` script. Replace timezone to UTC
-# to make subsequent date/duration computations consistent.
-post_covid_households_df = households_df.filter([pl.col('timestamp')
-                                          .dt.replace_time_zone("UTC")
-                                          .is_between(
-                                            pl.datetime(2021, 6, 1, time_zone="UTC"),
-                                            pl.datetime(3023, 1, 1, time_zone="UTC"))]).drop("imp")
-
-post_covid_households_df.write_csv('data/post_covid_household_kwh.csv')
+
+
+def filter_window(readings, cohort, output_file, window):
+    """Write the cohort's hourly readings inside the post-COVID window.
+
+    `readings` is either the merged file written by `merge` or the Parquet
+    dataset written by `extract` in 'parquet' mode. The step is a lazy query
+    run on the streaming engine: the id and time-window predicates and the
+    column projection (the `imp` flag is never read) are pushed into the scan,
+    and rows are written as they stream through, so memory stays bounded
+    regardless of the number of households. Timestamps are naive, so comparing
+    them with naive bounds selects the same rows as replacing their time zone
+    with UTC first.
+    """
+    households = pl.read_csv(cohort, schema_overrides={'id': pl.String})['id'].unique().to_list()
+
+    post_covid_households_lf = window_query(readings, households, window)
+    capture_plan('filter_window', post_covid_households_lf)
+
+    if Path(output_file).suffix == '.parquet':
+        post_covid_households_lf.sink_parquet(output_file, engine='streaming')
+    else:
+        post_covid_households_lf.sink_csv(output_file, engine='streaming')
+
+
+def index_readings(readings, output_dir):
+    """Write the post-COVID readings as an id/time-indexed query store (see query.py)."""
+    if Path(readings).suffix == '.parquet':
+        readings_lf = pl.scan_parquet(readings)
+    else:
+        readings_lf = pl.scan_csv(readings, try_parse_dates=True, schema_overrides={'kWh':pl.Float64})
+    build_query_store(readings_lf, output_dir)
+
+
+if __name__ == "__main__":
+    from pipeline import run_pipeline
+
+    run_pipeline(until='index_readings')
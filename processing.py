@@ -1,97 +1,224 @@
 """processing.py
 
-Data processing pipeline for post-COVID household kWh data.
+Processing stages for post-COVID household kWh data.
 
-This module loads post-COVID household kWh and metadata CSV files, computes
-daily totals per household, identifies households with runs of consecutive
-zero-consumption days, filters them out, joins metadata and writes the final
-features CSV used by downstream analysis.
+These stages load post-COVID household kWh and metadata files, summarize the
+run lengths of zero-consumption days (and near-zero hours and flat lines) per
+household, identify households with runs of consecutive zero-consumption days,
+filter them out, join metadata and write the final features CSV used by
+downstream analysis, plus a per-household table of load-profile features and
+a memory-mapped household x hour matrix of the cleaned readings.
 
 Notes
 -----
-- This file is a small script-style pipeline intended to be run interactively
-  or from the command line. It performs I/O on the `data/` directory and
-  writes `data/households_post_covid_features.csv`.
+- The stages are scheduled by the cached stage runner in `pipeline.py`;
+  running this file executes the whole pipeline through it and writes
+  `data/households_post_covid_features.csv`.
+- A `batch_size` pipeline parameter switches the run-length summary to an
+  out-of-core mode whose memory use scales with the batch size instead of the
+  dataset; the output is byte-identical.
 """
 
+import math
+import tempfile
+from pathlib import Path
+
 import polars as pl
 
-# Load pre-selected household metadata (post-COVID, one-year coverage)
-metadata = pl.read_csv('data/metadata_post_covid_households_year.csv', try_parse_dates=True, schema_overrides= {'cnae':pl.String, 'postal_code':pl.String, 'start_date':pl.Date, 'end_date':pl.Date, 'p1_kw':pl.String, 'count_at_least_this_many_days':pl.Int16})
-
-# Load per-reading (hourly) household measurements filtered for the post-COVID window
-households_df = pl.read_csv('data/post_covid_household_kwh.csv', try_parse_dates=True, schema_overrides={'kWh':pl.Float64})
-
-# Keep only readings that occur on or after the chosen reference date and
-# restrict to the household ids present in the metadata we prepared earlier.
-households_pc = households_df.filter(
-    (pl.col("timestamp")>=pl.datetime(2021, 6, 1)),
-    (pl.col("id").is_in(metadata.select("id").unique().to_series())))
-
-# Quick aggregate example: count very small readings per household (not persisted here)
-households_pc.group_by("id").agg(
-    (pl.col("kWh") < 0.001).sum().alias("n_lt_0_01")
-)
-
-# Work on the filtered dataframe from here on
-df = households_pc
-
-# 1) Compute daily totals per household
-#    - Convert timestamp -> date
-#    - Sum kWh per day
-#    - Mark days whose total consumption is effectively zero
-#    - Sort by id and date for deterministic processing
-daily = (
-    df.with_columns(pl.col("timestamp").dt.date().alias("date"))
-      .group_by(["id", "date"])
-      .agg(pl.col("kWh").sum().alias("kwh_day"))
-      .with_columns((pl.col("kwh_day") < 0.01).alias("zero_day"))
-      .sort(["id", "date"])
-)
-
-# 2) Identify households that have runs of consecutive zero days (length >= 2)
-#    The approach below:
-#      - Filter to days marked as zero_day
-#      - For each household, detect where a new run begins by checking if the
-#        gap between consecutive dates is not 1 day
-#      - Cumulative-sum the run starts to assign a run id
-#      - Group by (id, run_id) and compute the run length
-#      - Keep households that have any run of length >= 2
-ids_with_2_consecutive_zero_days = (
-    daily.filter(pl.col("zero_day"))
-         .with_columns(
-             # start a new run when date is not previous date + 1 day
-             (pl.col("date").diff().over("id") != pl.duration(days=1))
-             .fill_null(True)
-             .alias("new_run")
-         )
-         .with_columns(
-             pl.col("new_run").cum_sum().over("id").alias("run_id")
-         )
-         .group_by(["id", "run_id"])
-         .agg(pl.len().alias("run_len"))
-         .filter(pl.col("run_len") >= 2)
-         .select("id")
-         .unique()
-)
-
-# 3) Remove (anti-join) households that exhibit the undesirable consecutive-zero runs
-#    The anti join keeps only households that are NOT in `ids_with_2_consecutive_zero_days`.
-clean_df = households_pc.join(
-    ids_with_2_consecutive_zero_days, on="id", how="anti"
-)
-
-# 4) Attach metadata back to the cleaned readings so downstream tasks have
-#    household-level attributes (start/end date, cnae, postal_code, tariff, etc.).
-clean_with_metadata_df = clean_df.join(metadata, on="id", how="left").select(['id',
- 'timestamp',
- 'kWh',
- 'start_date',
- 'end_date',
- 'cnae',
- 'postal_code',
- 'p1_kw',
- 'tarriff'])
-
-# 5) Persist the final per-reading features CSV used by modeling/analysis steps
-clean_with_metadata_df.write_csv('data/households_post_covid_features.csv')
+from features import household_features
+from matrixstore import build_matrix_store
+from preprocessing import scan_readings
+from runlength import households_with_runs, run_length_summary
+from telemetry import capture_plan, count
+
+# Batched execution: None summarizes run lengths in memory. An integer
+# processes the households in hash-partitioned batches of about that many
+# households.
+BATCH_SIZE = None
+
+RUN_LENGTHS_FILE = Path('data/run_lengths.parquet')
+ZERO_RUNS_FILE = Path('data/zero_run_households.csv')
+OUTPUT_FILE = Path('data/households_post_covid_features.csv')
+LOAD_FEATURES_FILE = Path('data/household_load_features.parquet')
+MATRIX_DIR = Path('data/household_kwh_matrix')
+FEATURE_COLUMNS = ['id', 'timestamp', 'kWh', 'start_date', 'end_date', 'cnae', 'postal_code', 'p1_kw', 'tarriff']
+
+
+def read_cohort(path):
+    """Load pre-selected household metadata (post-COVID, one-year coverage)."""
+    return pl.read_csv(path, try_parse_dates=True, schema_overrides= {'cnae':pl.String, 'postal_code':pl.String, 'start_date':pl.Date, 'end_date':pl.Date, 'p1_kw':pl.String, 'count_at_least_this_many_days':pl.Int16})
+
+
+def post_covid_readings(readings, metadata, window):
+    """Lazily scan per-reading (hourly) household measurements.
+
+    preprocessing.py writes Parquet instead of CSV when run in 'parquet'
+    ingest mode. Only readings that occur on or after the chosen reference
+    date and belong to the household ids present in the metadata are kept.
+    """
+    if Path(readings).suffix == '.parquet':
+        households_lf = pl.scan_parquet(readings)
+    else:
+        households_lf = pl.scan_csv(readings, try_parse_dates=True, schema_overrides={'kWh':pl.Float64})
+
+    start = window[0]
+    return households_lf.filter(
+        (pl.col("timestamp")>=pl.datetime(start.year, start.month, start.day)),
+        (pl.col("id").is_in(metadata.select("id").unique().to_series().implode())))
+
+
+def summarize_runs(readings, cohort, output_file, window, zero_day_thresholds, zero_hour_thresholds, batch_size):
+    """Write the run-length summary of the cohort's post-COVID readings.
+
+    Histograms of zero-day, near-zero-hour and flat-line run lengths per
+    household are computed in one pass (see runlength.py), so exclusion
+    policies can be changed without rescanning the readings.
+
+    With `batch_size` set, households are assigned to
+    ``ceil(n_households / batch_size)`` batches by hashing their id. The
+    readings are read once and written to one temporary Parquet directory
+    per batch next to `output_file`, and the summary is computed one batch at
+    a time from those files, so only one batch of readings is in memory.
+
+    Parameters
+    ----------
+    readings : Path
+        Post-COVID readings written by preprocessing (.csv or .parquet).
+    cohort : Path
+        Selected household metadata.
+    output_file : Path
+        Parquet file with the run-length summary.
+    window : tuple[datetime.date, datetime.date]
+        Post-COVID analysis window; readings before its start are ignored.
+    zero_day_thresholds : Sequence[float]
+        Daily totals (kWh) below which a day counts as zero consumption.
+    zero_hour_thresholds : Sequence[float]
+        Hourly readings (kWh) below which an hour counts as near zero.
+    batch_size : int | None
+        Approximate number of households per batch, or None for in-memory.
+    """
+    metadata = read_cohort(cohort)
+    households_pc = post_covid_readings(readings, metadata, window)
+
+    if batch_size is None:
+        summary_lf = run_length_summary(households_pc, zero_day_thresholds, zero_hour_thresholds)
+        capture_plan('run_length_summary', summary_lf)
+        summary = summary_lf.collect()
+    else:
+        n_batches = max(1, math.ceil(metadata["id"].n_unique() / batch_size))
+        batch_of = (pl.col("id").hash() % n_batches).alias("batch")
+
+        summary = []
+        # Split the readings once into one Parquet directory per batch, then
+        # summarize each batch from its own files
+        with tempfile.TemporaryDirectory(prefix=".batches-", dir=Path(output_file).parent) as batches_dir:
+            households_pc.sink_parquet(pl.PartitionByKey(batches_dir, by=batch_of, include_key=False),
+                                       mkdir=True, engine="streaming")
+            for batch in range(n_batches):
+                batch_dir = Path(batches_dir) / f"batch={batch}"
+                if not batch_dir.exists():
+                    continue
+                part_lf = run_length_summary(pl.scan_parquet(batch_dir), zero_day_thresholds, zero_hour_thresholds)
+                if not summary:
+                    capture_plan('run_length_summary_batch', part_lf)
+                part = part_lf.collect(engine="streaming")
+                summary.append(part)
+                print(f"Batch {batch + 1}/{n_batches}: {part['id'].n_unique()} households")
+        if not summary:
+            # No readings at all: an empty summary with the usual schema
+            summary.append(run_length_summary(households_pc.head(0), zero_day_thresholds,
+                                              zero_hour_thresholds).collect())
+        summary = pl.concat(summary).sort(["id", "kind", "threshold", "run_len"], nulls_last=True)
+
+    summary.write_parquet(output_file)
+    count(rows_out=summary.height)
+
+
+def find_zero_runs(run_lengths, output_file, zero_day_thresholds, zero_day_kwh, min_zero_run):
+    """Write the ids of households with runs of consecutive zero days.
+
+    A day is a zero day when its total is below `zero_day_kwh`, which must be
+    one of the `zero_day_thresholds` the run-length summary was computed for;
+    households with a run of at least `min_zero_run` such days are excluded.
+    """
+    if zero_day_kwh not in zero_day_thresholds:
+        raise ValueError(f"zero_day_kwh={zero_day_kwh} is not one of the summarized thresholds {zero_day_thresholds}")
+
+    summary = pl.read_parquet(run_lengths)
+    excluded = households_with_runs(summary, "zero_day", zero_day_kwh, min_run=min_zero_run)
+    excluded.write_csv(output_file)
+    count(rows_in=summary.height, rows_out=excluded.height)
+    print(f"Households with zero-consumption runs={excluded.height}")
+
+
+def join_metadata(readings, cohort, zero_runs, output_file, window):
+    """Write the final per-reading features CSV used by modeling/analysis steps.
+
+    3) Remove (anti-join) households that exhibit the undesirable
+       consecutive-zero runs listed in `zero_runs`.
+    4) Attach metadata back to the cleaned readings so downstream tasks have
+       household-level attributes (start/end date, cnae, postal_code, tariff, etc.).
+
+    Both joins run in a single streaming pass that appends rows to
+    `output_file` in input order, so memory stays bounded.
+    """
+    metadata = read_cohort(cohort)
+    excluded = pl.read_csv(zero_runs, schema_overrides={'id': pl.String})
+
+    features_lf = (
+        post_covid_readings(readings, metadata, window)
+        .join(excluded.lazy(), on="id", how="anti", maintain_order="left")
+        .join(metadata.lazy(), on="id", how="left", maintain_order="left")
+        .select(FEATURE_COLUMNS)
+    )
+    capture_plan('join_metadata', features_lf)
+    features_lf.sink_csv(output_file, engine="streaming")
+
+
+def load_profile_features(readings, cohort, zero_runs, output_file, window):
+    """Write one row of load-profile features per household (see features.py).
+
+    The features are computed from the post-COVID readings of the households
+    kept by `join_metadata` (cohort households not listed in `zero_runs`).
+    The contracted power `p1_kw` is joined per household afterwards, so a
+    household with several cohort rows does not have its readings repeated.
+    """
+    metadata = read_cohort(cohort)
+    excluded = pl.read_csv(zero_runs, schema_overrides={'id': pl.String})
+
+    households_lf = (
+        post_covid_readings(readings, metadata, window)
+        .join(excluded.lazy(), on="id", how="anti")
+    )
+    capture_plan('load_profile_features', households_lf)
+    features = household_features(households_lf, metadata.select('id', 'p1_kw'))
+    features.write_parquet(output_file)
+    count(rows_out=features.height)
+    print(f"Load-profile features for {features.height} households")
+
+
+def build_matrix(readings, cohort, zero_runs, output_dir, window):
+    """Write the cleaned households' readings as a dense matrix store (see matrixstore.py).
+
+    Rows are the cohort households not listed in `zero_runs`, sorted by id;
+    columns are the hours of the post-COVID window that have readings. The
+    imputation flags come from the `imp` column of the full readings, which
+    is why this stage reads them instead of the post-COVID file.
+    """
+    metadata = read_cohort(cohort)
+    excluded = pl.read_csv(zero_runs, schema_overrides={'id': pl.String})['id']
+    ids = metadata.filter(~pl.col('id').is_in(excluded.implode()))['id'].unique().sort().to_list()
+
+    readings_lf = scan_readings(readings).filter(
+        pl.col('timestamp').is_between(pl.datetime(window[0].year, window[0].month, window[0].day),
+                                       pl.datetime(window[1].year, window[1].month, window[1].day)))
+    capture_plan('build_matrix', readings_lf)
+    build_matrix_store(readings_lf, ids, output_dir)
+    count(rows_out=len(ids))
+    print(f"Matrix store with {len(ids)} households")
+
+
+if __name__ == "__main__":
+    from pipeline import run_pipeline
+
+    run_pipeline()
@@ -0,0 +1,138 @@
+"""query.py
+
+Indexed per-household time-range queries over hourly readings.
+
+`build_query_store` writes the readings sorted by (id, timestamp) into a
+directory of Parquet files, each holding whole households, plus an index
+(`index.parquet`) mapping every household id to its file and first and last
+timestamp. `ReadingsQuery` looks households up in the index, skips those whose
+readings lie outside the time range, and scans only the files that hold the
+rest with the id and time predicates pushed into the scan. Because
+rows are sorted, the row-group min/max statistics of `id` and `timestamp`
+prune everything but the requested households' row groups in the range, so a
+one-household, one-month query decodes a few small row groups instead of
+scanning the dataset.
+
+Typical usage:
+    with ReadingsQuery('data/readings_by_household') as q:
+        df = q.query([household_id], start=datetime(2022, 1, 1), end=datetime(2022, 2, 1))
+"""
+
+import shutil
+from pathlib import Path
+
+import polars as pl
+
+INDEX_FILE = 'index.parquet'
+
+
+def _file_name(file):
+    return f'part-{file:05d}.parquet'
+
+
+def build_query_store(readings, output_dir, rows_per_file=1_000_000, row_group_size=8_192):
+    """Write `readings` sorted by (id, timestamp) with an id -> file and time-range index.
+
+    Parameters
+    ----------
+    readings : pl.LazyFrame
+        Readings with at least `id` and `timestamp` columns.
+    output_dir : Path
+        Store directory; replaced if it exists.
+    rows_per_file : int
+        Approximate rows per Parquet file. Households are never split across
+        files; small files keep the footer parsed on every query small.
+    row_group_size : int
+        Rows per row group; smaller groups make time-range pruning finer.
+    """
+    output_dir = Path(output_dir)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir(parents=True)
+
+    # Sort once into a staging file; the streaming engine spills if needed.
+    staging = output_dir / 'sorted.tmp.parquet'
+    readings.sort(['id', 'timestamp']).sink_parquet(staging, engine='streaming')
+
+    index = (
+        pl.scan_parquet(staging)
+        .group_by('id', maintain_order=True)
+        .agg(pl.len().alias('n_rows'), pl.col('timestamp').min().alias('start'), pl.col('timestamp').max().alias('end'))
+        .collect(engine='streaming')
+        .with_columns((pl.col('n_rows').cum_sum() - pl.col('n_rows')).alias('offset'))
+        # A household goes to the file its first row falls in, so none is split
+        .with_columns(((pl.col('offset') // rows_per_file).rank('dense') - 1).cast(pl.UInt32).alias('file'))
+    )
+
+    files = index.group_by('file', maintain_order=True).agg(pl.col('offset').min(), pl.col('n_rows').sum())
+    for file, offset, n_rows in files.iter_rows():
+        (
+            pl.scan_parquet(staging)
+            .slice(offset, n_rows)
+            .sink_parquet(output_dir / _file_name(file), row_group_size=row_group_size, statistics=True)
+        )
+    if files.is_empty():
+        pl.scan_parquet(staging).head(0).sink_parquet(output_dir / _file_name(0))
+    staging.unlink()
+
+    index.select('id', 'file', 'start', 'end').write_parquet(output_dir / INDEX_FILE)
+
+
+class ReadingsQuery:
+    """Look up readings written by `build_query_store` by household and time range.
+
+    Parameters
+    ----------
+    path : Path
+        Store directory.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        index = pl.read_parquet(self.path / INDEX_FILE)
+        self._index = {row[0]: row[1:] for row in index.iter_rows()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def households(self):
+        """Household ids in the store, sorted."""
+        return list(self._index)
+
+    def scan(self, ids, start=None, end=None):
+        """Lazy frame of the readings of `ids` with start <= timestamp < end.
+
+        `start` and `end` are `datetime.datetime` values (or None for an open
+        bound). Rows are sorted by (id, timestamp). Households whose readings
+        lie outside the range are skipped without touching their file.
+        """
+        by_file = {}
+        for household in ids:
+            try:
+                file, first, last = self._index[household]
+            except KeyError:
+                raise KeyError(f"Unknown household: {household}") from None
+            if (start is not None and last < start) or (end is not None and first >= end):
+                continue
+            by_file.setdefault(file, []).append(household)
+
+        frames = []
+        for file, households in sorted(by_file.items()):
+            # One filter holding the id and time predicates, so both reach the
+            # Parquet scan: row groups of other households are pruned by their
+            # id statistics and those outside the range by their timestamp ones
+            predicates = [pl.col('id').is_in(households)]
+            if start is not None:
+                predicates.append(pl.col('timestamp') >= start)
+            if end is not None:
+                predicates.append(pl.col('timestamp') < end)
+            frames.append(pl.scan_parquet(self.path / _file_name(file)).filter(*predicates))
+
+        if not frames:
+            return pl.scan_parquet(self.path / _file_name(0)).head(0)
+        return pl.concat(frames)
+
+    def query(self, ids, start=None, end=None):
+        """Readings of `ids` with start <= timestamp < end (see `scan`)."""
+        return self.scan(ids, start, end).collect()
@@ -0,0 +1,183 @@
+"""runlength.py
+
+Vectorized run-length summaries of household readings.
+
+`run_length_summary` computes, in one query over the hourly readings, the
+histogram of run lengths of every household for three kinds of runs:
+
+- 'zero_day': consecutive days whose total consumption is below a threshold,
+- 'zero_hour': consecutive hourly readings below a threshold,
+- 'flat_line': consecutive hourly readings with identical values (length >= 2).
+
+The summary has one row per (id, kind, threshold, run_len) with the number of
+runs of that length, so exclusion policies (`households_with_runs`) and the
+longest run per household (`longest_runs`) are answered from it without
+rescanning the readings. Several thresholds per kind are evaluated in the same
+pass.
+
+Runs follow calendar/clock order: a missing day or hour ends a run, as does a
+change of value.
+"""
+
+import polars as pl
+
+SUMMARY_SCHEMA = {'id': pl.String, 'kind': pl.String, 'threshold': pl.Float64,
+                  'run_len': pl.UInt32, 'n_runs': pl.UInt32}
+
+
+def daily_kwh(readings):
+    """Total kWh per household and day, sorted by id and date."""
+    return (
+        readings.with_columns(pl.col("timestamp").dt.date().alias("date"))
+                .group_by(["id", "date"])
+                .agg(pl.col("kWh").sum().alias("kwh_day"))
+                .sort(["id", "date"])
+    )
+
+
+def run_lengths(frame, value, order, step, by=("id",)):
+    """Split each group of `frame` into maximal runs of equal `value`.
+
+    A new run starts at the first row of a group, when `order` does not advance
+    by exactly `step` from the previous row, or when `value` changes. `frame`
+    must be sorted by `by` and then `order`.
+
+    Parameters
+    ----------
+    frame : pl.LazyFrame
+        Rows to split.
+    value : str
+        Column whose consecutive equal values form a run.
+    order : str
+        Date or datetime column.
+    step : pl.Expr
+        Expected difference between consecutive rows of a run (a duration).
+    by : Sequence[str]
+        Grouping columns; runs never span groups.
+
+    Returns
+    -------
+    pl.LazyFrame
+        One row per run with the `by` columns, `value` and `run_len`.
+    """
+    by = list(by)
+    new_run = (
+        (pl.col(order).diff().over(by) != step)
+        | (pl.col(value) != pl.col(value).shift().over(by))
+    ).fill_null(True)
+    return (
+        frame.with_columns(new_run.cum_sum().alias("run_id"))
+             .group_by(by + ["run_id"])
+             .agg(pl.col(value).first(), pl.len().alias("run_len"))
+             .drop("run_id")
+    )
+
+
+def _histogram(runs, kind, by):
+    """Count runs per (id, run_len) and tag them with `kind`."""
+    threshold = pl.col("threshold") if "threshold" in by else pl.lit(None, dtype=pl.Float64).alias("threshold")
+    return (
+        runs.group_by(list(by) + ["run_len"])
+            .agg(pl.len().alias("n_runs"))
+            .select("id", pl.lit(kind).alias("kind"), threshold, "run_len", "n_runs")
+            .cast(SUMMARY_SCHEMA)
+    )
+
+
+def _below_threshold_runs(frame, column, order, step, thresholds, kind):
+    """Histogram of runs where `column` is below each of `thresholds`."""
+    flagged = (
+        frame.join(pl.LazyFrame({"threshold": list(thresholds)}, schema={"threshold": pl.Float64}), how="cross")
+             .with_columns((pl.col(column) < pl.col("threshold")).alias("below"))
+             .sort(["id", "threshold", order])
+    )
+    runs = run_lengths(flagged, "below", order, step, by=("id", "threshold")).filter(pl.col("below"))
+    return _histogram(runs, kind, by=("id", "threshold"))
+
+
+def run_length_summary(readings, zero_day_kwh=(0.01,), zero_hour_kwh=(0.001,), flat_line=True):
+    """Run-length histograms of zero-consumption days, near-zero hours and flat lines.
+
+    Parameters
+    ----------
+    readings : pl.LazyFrame
+        Hourly readings with `id`, `timestamp` and `kWh` columns.
+    zero_day_kwh : Sequence[float]
+        Daily totals below each threshold count as zero days.
+    zero_hour_kwh : Sequence[float]
+        Hourly readings below each threshold count as near-zero hours.
+    flat_line : bool
+        Include runs of identical consecutive readings.
+
+    Returns
+    -------
+    pl.LazyFrame
+        Columns id, kind, threshold (null for 'flat_line'), run_len, n_runs.
+    """
+    parts = []
+    if zero_day_kwh:
+        parts.append(_below_threshold_runs(daily_kwh(readings), "kwh_day", "date",
+                                           pl.duration(days=1), zero_day_kwh, "zero_day"))
+    hourly = readings.select("id", "timestamp", "kWh").sort(["id", "timestamp"])
+    if zero_hour_kwh:
+        parts.append(_below_threshold_runs(hourly, "kWh", "timestamp",
+                                           pl.duration(hours=1), zero_hour_kwh, "zero_hour"))
+    if flat_line:
+        runs = run_lengths(hourly, "kWh", "timestamp", pl.duration(hours=1)).filter(pl.col("run_len") >= 2)
+        parts.append(_histogram(runs, "flat_line", by=("id",)))
+    if not parts:
+        return pl.LazyFrame(schema=SUMMARY_SCHEMA)
+    return pl.concat(parts).sort(["id", "kind", "threshold", "run_len"], nulls_last=True)
+
+
+def _select(summary, kind, threshold):
+    summary = summary.filter(pl.col("kind") == kind)
+    if threshold is not None and kind != "flat_line":
+        summary = summary.filter(pl.col("threshold") == threshold)
+    return summary
+
+
+def longest_runs(summary, kind, threshold=None):
+    """Longest run per household for one kind (and threshold) of run."""
+    return (
+        _select(summary, kind, threshold)
+        .group_by("id")
+        .agg(pl.col("run_len").max().alias("longest_run"))
+        .sort("id")
+    )
+
+
+def households_with_runs(summary, kind, threshold=None, min_run=2, min_runs=1):
+    """Households with at least `min_runs` runs of `min_run` or more.
+
+    With the defaults and kind='zero_day', this selects the households with two
+    or more consecutive zero-consumption days.
+
+    Parameters
+    ----------
+    summary : pl.DataFrame | pl.LazyFrame
+        Output of `run_length_summary`.
+    kind : str
+        'zero_day', 'zero_hour' or 'flat_line'.
+    threshold : float | None
+        Threshold the runs were computed for; must be one of those passed to
+        `run_length_summary`. Ignored for 'flat_line'.
+    min_run : int
+        Minimum run length (days for 'zero_day', hours otherwise).
+    min_runs : int
+        Minimum number of such runs.
+
+    Returns
+    -------
+    pl.DataFrame | pl.LazyFrame
+        Single `id` column, sorted.
+    """
+    return (
+        _select(summary, kind, threshold)
+        .filter(pl.col("run_len") >= min_run)
+        .group_by("id")
+        .agg(pl.col("n_runs").sum())
+        .filter(pl.col("n_runs") >= min_runs)
+        .select("id")
+        .sort("id")
+    )
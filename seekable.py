@@ -0,0 +1,185 @@
+"""seekable.py
+
+Seekable re-packing of the GoiEner archive for random per-household access.
+
+The original ``.tar.zst`` is a single zstd frame, so reading one household
+means decompressing every member stored before it. `SeekableRepacker` converts
+it once into a file of independent zstd frames (one per household, or per group
+of households) followed by a frame table. `SeekableArchive` then returns any
+household's CSV by id by decompressing just its frame.
+
+The output remains a valid zstd stream: the frame table is stored in a zstd
+skippable frame, so ``zstd -d`` yields the concatenated CSVs.
+
+Typical usage:
+    SeekableRepacker('data/imputed_goiener_v7.tar.zst', 'data/imputed_goiener_v7.seekable.zst').repack()
+
+    with SeekableArchive('data/imputed_goiener_v7.seekable.zst') as archive:
+        df = archive.read_household(household_id)
+"""
+
+import io
+import json
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import polars as pl
+import zstandard
+
+from extractors import Extractor
+from ingest import MEMBER_SCHEMA
+
+# zstd skippable frame magic (0x184D2A50-0x184D2A5F are reserved for user data)
+SKIPPABLE_MAGIC = 0x184D2A5E
+# Trailer closing the file: <uint32 table length><FOOTER_MAGIC>
+FOOTER_MAGIC = b'GSZT'
+FOOTER = struct.Struct('<I4s')
+
+
+class SeekableRepacker:
+    """Re-compress a .tar.zst archive into independently decompressible frames.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the .tar.zst file with per-household CSVs.
+    output_path : str
+        Path of the seekable file to write.
+    """
+    def __init__(self, file_path: str, output_path: str):
+        self._extractor = Extractor(file_path, str(Path(output_path).parent))
+        self._output_path = output_path
+
+    def _groups(self, households_per_frame):
+        """Yield lists of ``(household_id, data)`` read from the archive stream."""
+        group = []
+        for member, data in self._extractor.iter_members():
+            path = Path(member.name)
+            if data is None or path.suffix != '.csv':
+                continue
+            group.append((path.stem, data))
+            if len(group) == households_per_frame:
+                yield group
+                group = []
+        if group:
+            yield group
+
+    @staticmethod
+    def _compress(group, level):
+        """Compress one group of households into a single zstd frame."""
+        members = []
+        offset = 0
+        for household_id, data in group:
+            members.append((household_id, offset, len(data)))
+            offset += len(data)
+        frame = zstandard.ZstdCompressor(level=level).compress(b''.join(data for _, data in group))
+        return members, offset, frame
+
+    def repack(self, households_per_frame: int = 1, level: int = 9, max_workers: int = 8, max_pending: int = 64):
+        """Write the seekable file and return the number of households packed.
+
+        Frames are compressed on a bounded thread pool while the source archive
+        is still being decompressed, and written in archive order.
+
+        Parameters
+        ----------
+        households_per_frame : int
+            Households stored per frame. Larger groups compress better but each
+            lookup decompresses the whole group.
+        level : int
+            zstd compression level.
+        max_workers : int
+            Number of compression threads.
+        max_pending : int
+            Maximum number of frames buffered in memory awaiting a write.
+        """
+        frames = []
+        households = {}
+
+        def write(out, result):
+            members, size, frame = result
+            for household_id, offset, length in members:
+                households[household_id] = [len(frames), offset, length]
+            frames.append([out.tell(), len(frame), size])
+            out.write(frame)
+
+        pending = deque()
+        with open(self._output_path, 'wb') as out, ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for group in self._groups(households_per_frame):
+                pending.append(pool.submit(self._compress, group, level))
+                if len(pending) >= max_pending:
+                    write(out, pending.popleft().result())
+
+            while pending:
+                write(out, pending.popleft().result())
+
+            table = json.dumps({'frames': frames, 'households': households}).encode()
+            payload = table + FOOTER.pack(len(table), FOOTER_MAGIC)
+            out.write(struct.pack('<II', SKIPPABLE_MAGIC, len(payload)))
+            out.write(payload)
+
+        print(f"Packed {len(households)} households into {len(frames)} frames")
+        return len(households)
+
+
+class SeekableArchive:
+    """Random access reader for files written by `SeekableRepacker`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the seekable file.
+    """
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._cached_frame = (None, b'')
+
+        self._file.seek(-FOOTER.size, io.SEEK_END)
+        table_size, magic = FOOTER.unpack(self._file.read(FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            raise ValueError(f"Not a seekable GoiEner archive: {path}")
+        self._file.seek(-FOOTER.size - table_size, io.SEEK_END)
+        table = json.loads(self._file.read(table_size))
+        self._frames = table['frames']
+        self._households = table['households']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def households(self):
+        """Return the ids of all packed households."""
+        return list(self._households)
+
+    def _frame(self, index):
+        """Decompress a frame, keeping the most recent one for grouped lookups."""
+        cached_index, data = self._cached_frame
+        if cached_index != index:
+            offset, size, decompressed_size = self._frames[index]
+            self._file.seek(offset)
+            data = self._decompressor.decompress(self._file.read(size), max_output_size=decompressed_size)
+            self._cached_frame = (index, data)
+        return data
+
+    def read_bytes(self, household_id):
+        """Return the raw CSV content of one household."""
+        if household_id not in self._households:
+            raise KeyError(f"Unknown household: {household_id}")
+        frame, offset, size = self._households[household_id]
+        return self._frame(frame)[offset:offset + size]
+
+    def read_household(self, household_id):
+        """Return one household's readings as a DataFrame.
+
+        Columns and types match the CSVs extracted from the original archive
+        (``index``, ``fl``, ``kWh``, ``imp``).
+        """
+        return pl.read_csv(io.BytesIO(self.read_bytes(household_id)), schema_overrides=MEMBER_SCHEMA)
@@ -9,45 +9,185 @@
 import os
 import re
 import json
+import shutil
+import tempfile
+import zlib
 import pandas as pd
 import logging
-from concurrent.futures import ProcessPoolExecutor
 from glob import glob
-from filelock import FileLock
+
+from scheduler import Telemetry, count, open_telemetry, record_tasks, run_tasks, timing_summary
+
+SIMEL_PATTERN = re.compile(r'^(A5D|B5D|F5D|P5D|RF5D|F1|P1|P1D)_.*\.\d+$')
 
 def load_config(config_path):
     with open(config_path, 'r') as file:
         config = json.load(file)
     return config
 
-def process_file(file_path, id_dir):
+def partition_of(name, num_partitions):
+    """Partition of an id file; every spill file sends an id to the same one."""
+    return zlib.crc32(name.encode('utf-8')) % num_partitions
+
+def render_groups(df):
+    """CSV text of each id group, as `group.to_csv` would append it to the id file."""
+    grouped = df.groupby(df.columns[2])
+    # Render the whole file once and pick each group's lines from it
+    lines = df.to_csv(sep=';', header=False, index=False).split(os.linesep)[:-1]
+    if len(lines) != len(df):
+        # Quoted line breaks inside fields: render group by group
+        for id_value, group in grouped:
+            yield f"{id_value}", group.to_csv(sep=';', header=False, index=False)
+        return
+    for id_value, positions in grouped.indices.items():
+        yield f"{id_value}", ''.join(lines[i] + os.linesep for i in positions)
+
+def spill_file(file_path, spill_dir, num_partitions):
+    """Phase 1: write the id groups of one SIMEL file into its own spill file.
+
+    Groups are written ordered by partition, each as a record with a
+    "<name bytes> <data bytes>" header line followed by the id file name and
+    the CSV data. Returns the log message, the spill file path, the
+    (offset, length) of every partition's section in it and the names of the
+    id files it writes to. No file is shared with other workers, so no
+    locking is needed.
+    """
     try:
         file_name = os.path.basename(file_path)
         file_prefix = file_name.split('_')[0]
-        
+
         # Read the file into a DataFrame
         df = pd.read_csv(file_path, sep=';', header=None)
-        
+        count(rows_in=len(df))
+
         # Add the new columns
         df.insert(0, 'original_file', file_name)
         df.insert(1, 'file_prefix', file_prefix)
-        
-        # Group by the ID (assuming the ID is in the first column)
-        grouped = df.groupby(df.columns[2])  # Adjusting to group by the third column which is the original ID column
-        
-        # Write each group to the corresponding ID file
-        for id_value, group in grouped:
-            id_file_path = os.path.join(id_dir, f"{id_value}.csv")
-            lock_file_path = f"{id_file_path}.lock"
-            with FileLock(lock_file_path):
-                if os.path.exists(id_file_path):
-                    group.to_csv(id_file_path, sep=';', mode='a', header=False, index=False)
-                else:
-                    group.to_csv(id_file_path, sep=';', mode='w', header=False, index=False)
-                
-        return f"Processed {file_name}"
+
+        # Group by the ID (the third column, the original ID column) and sort the groups by partition
+        sections = [[] for _ in range(num_partitions)]
+        names = []
+        for name, text in render_groups(df):
+            names.append(name)
+            name_bytes, data = name.encode('utf-8'), text.encode('utf-8')
+            sections[partition_of(name, num_partitions)].append(
+                f"{len(name_bytes)} {len(data)}\n".encode() + name_bytes + data)
+
+        spill_path = os.path.join(spill_dir, f"{file_name}.spill")
+        offsets = []
+        offset = 0
+        with open(spill_path, 'wb') as spill:
+            for records in sections:
+                section = b''.join(records)
+                spill.write(section)
+                offsets.append((offset, len(section)))
+                offset += len(section)
+        count(bytes_out=offset)
+
+        return f"Processed {file_name}", spill_path, offsets, names
     except Exception as e:
-        return f"Failed to process {file_name}: {e}"
+        return f"Failed to process {file_name}: {e}", None, None, None
+
+def read_section(spill_path, offset, length):
+    """Yield the (id file name, data) records of one partition section of a spill file."""
+    with open(spill_path, 'rb') as spill:
+        spill.seek(offset)
+        section = spill.read(length)
+    position = 0
+    while position < len(section):
+        header_end = section.index(b'\n', position)
+        name_length, data_length = map(int, section[position:header_end].split())
+        name_end = header_end + 1 + name_length
+        yield section[header_end + 1:name_end].decode('utf-8'), section[name_end:name_end + data_length]
+        position = name_end + data_length
+
+def merge_partition(partition, spills, id_dir, max_buffer=256 << 20):
+    """Phase 2: append one partition's records from every spill file to the id files.
+
+    `spills` lists (spill_path, offset, length) in the order the SIMEL files
+    were submitted, so each id file receives its chunks in that order. Data is
+    buffered per id and appended with one write per id file, flushing early if
+    more than `max_buffer` bytes are pending. Partitions hold disjoint ids,
+    so partitions are merged in parallel without locks.
+    """
+    buffers = {}
+    pending = written = 0
+    n_ids = set()
+
+    def flush():
+        nonlocal written
+        for name, chunks in buffers.items():
+            with open(os.path.join(id_dir, f"{name}.csv"), 'ab') as id_file:
+                written += id_file.write(b''.join(chunks))
+        buffers.clear()
+
+    for spill_path, offset, length in spills:
+        for name, data in read_section(spill_path, offset, length):
+            buffers.setdefault(name, []).append(data)
+            n_ids.add(name)
+            pending += len(data)
+            if pending > max_buffer:
+                flush()
+                pending = 0
+    flush()
+    count(bytes_out=written, files_out=len(n_ids))
+    return f"Merged partition {partition}: {len(n_ids)} ids"
+
+def split_by_id(simel_files, id_dir, num_workers, num_partitions=64, telemetry=None, profile_dir=None):
+    """Split SIMEL files into per-id files with a two-phase shuffle.
+
+    Phase 1 writes one spill file per SIMEL file (`spill_file`); phase 2 merges
+    each partition into the id files (`merge_partition`). Both phases run
+    through `scheduler.run_tasks`, largest SIMEL file or partition first; the
+    id files still receive their chunks in the order of `simel_files`. Spill
+    files live in a temporary directory inside `id_dir` that is removed at the
+    end. Returns the log messages of both phases (plus a timing summary of
+    each) and, for every SIMEL file split without errors, the names of the id
+    files it was appended to. Each phase is written to `telemetry` as stage
+    "simel2user.spill" or "simel2user.merge", with one record per task.
+    """
+    telemetry = telemetry or Telemetry()
+    spill_dir = tempfile.mkdtemp(prefix='.spill-', dir=id_dir)
+    try:
+        # Largest SIMEL files first; results are put back in submission order
+        with telemetry.stage('simel2user.spill') as stage:
+            spill_results = list(run_tasks(spill_file, [(f, spill_dir, num_partitions) for f in simel_files],
+                                           num_workers=num_workers, profile_dir=profile_dir))
+            record_tasks(telemetry, stage, spill_results)
+        by_file = {task.task[0]: task for task in spill_results}
+        spilled = []
+        for file_path in simel_files:
+            task = by_file[file_path]
+            if task.error is None:
+                spilled.append(task.result)
+            else:
+                spilled.append((f"Failed to process {os.path.basename(file_path)}: {task.error}", None, None, None))
+
+        spills = [[] for _ in range(num_partitions)]
+        for _, spill_path, offsets, _ in spilled:
+            if spill_path is None:
+                continue
+            for partition, (offset, length) in enumerate(offsets):
+                if length:
+                    spills[partition].append((spill_path, offset, length))
+
+        with telemetry.stage('simel2user.merge') as stage:
+            merge_results = list(run_tasks(merge_partition, [(p, spills[p], id_dir) for p in range(num_partitions)],
+                                           sizes=[sum(length for _, _, length in s) for s in spills],
+                                           num_workers=num_workers, batch_tasks=1, profile_dir=profile_dir))
+            record_tasks(telemetry, stage, merge_results)
+        for task in merge_results:
+            if task.error is not None:
+                raise task.error
+        merged = [task.result for task in sorted(merge_results, key=lambda task: task.task[0])]
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    touched = {os.path.basename(file_path): names
+               for file_path, (_, spill_path, _, names) in zip(simel_files, spilled) if spill_path is not None}
+    messages = [message for message, _, _, _ in spilled] + merged
+    messages.append(f"Spill phase: {timing_summary(spill_results)}")
+    messages.append(f"Merge phase: {timing_summary(merge_results)}")
+    return messages, touched
 
 def setup_logging(simel2id_log):
     logging.basicConfig(
@@ -59,10 +199,11 @@ def setup_logging(simel2id_log):
     logging.getLogger().addHandler(logging.StreamHandler())  # Añadir salida a la consola
 
 
-def main():
+def main(config_path=None):
     print("Iniciando script...")
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(script_dir, 'config.json')
+    # Por defecto, el config.json junto al script
+    config_path = config_path or os.path.join(script_dir, 'config.json')
 
     print(f"Cargando configuración desde {config_path}...")
     config = load_config(config_path)
@@ -82,8 +223,7 @@ def main():
     
     print(f"Se encontraron {len(all_files)} archivos en la carpeta.")
     
-    pattern = re.compile(r'^(A5D|B5D|F5D|P5D|RF5D|F1|P1|P1D)_.*\.\d+$')
-    simel_files = [f for f in all_files if pattern.match(os.path.basename(f))]
+    simel_files = [f for f in all_files if SIMEL_PATTERN.match(os.path.basename(f))]
     
     print(f"Se encontraron {len(simel_files)} archivos que cumplen el patrón.")
 
@@ -91,12 +231,13 @@ def main():
         print("No hay archivos que coincidan con el patrón. Saliendo...")
         return
     
-    print("Procesando archivos con ProcessPoolExecutor...")
+    print("Procesando archivos en paralelo...")
     
     num_workers = max(1, os.cpu_count() - 1)  # Evita que el número de workers sea 0
     
-    with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        results = list(executor.map(process_file, simel_files, [id_dir]*len(simel_files)))
+    with open_telemetry(config, script_dir) as telemetry:
+        results, _ = split_by_id(simel_files, id_dir, num_workers, telemetry=telemetry,
+                                 profile_dir=config.get('profile_dir'))
 
     print("Procesamiento finalizado. Guardando logs...")
 
@@ -8,12 +8,14 @@
 
 import os
 import json
+import numpy as np
 import pandas as pd
 import logging
-from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 from datetime import datetime, timedelta
 
+from scheduler import count, open_telemetry, record_tasks, run_tasks, timing_summary
+
 def load_config(config_path):
     with open(config_path, 'r') as file:
         config = json.load(file)
@@ -59,60 +61,166 @@ def adjust_datetime(row):
     row[0] = dt.strftime("%Y/%m/%d %H:%M")
     return row
 
-def process_file(file_path, raw_dir):
+def build_rows(lines, file_type_map):
+    """Construcción fila a fila de las filas raw (implementación original)."""
+    # Process each line individually
+    processed_lines = [process_line(line, file_type_map) for line in lines]
+    processed_lines = [line for line in processed_lines if line is not None]
+
+    # Adjust the datetime based on the flag
+    adjusted_lines = [adjust_datetime(line) for line in processed_lines]
+
+    # Create a DataFrame from adjusted lines and remove duplicate rows
+    df = pd.DataFrame(adjusted_lines).drop_duplicates()
+
+    # Group by DT and FL
+    grouped = df.groupby([0, 1])
+
+    output_data = []
+
+    for (dt, fl), group in grouped:
+        row = [dt, fl]
+        num_entries = len(group)  # Count the number of entries in this group
+        row.append(num_entries)  # Add the number of initial entries as the third field
+        for _, entry in group.iterrows():
+            row.extend(entry[2:].tolist())
+        output_data.append(row)
+
+    # Sort by DT
+    output_data.sort(key=lambda x: datetime.strptime(x[0], "%Y/%m/%d %H:%M"))
+
+    # Pad rows to ensure each has 50 fields
+    padded_output_data = [row + [''] * (50 - len(row)) for row in output_data]
+    return [';'.join(map(str, row)) for row in padded_output_data]
+
+# Fechas con todos los campos de dos dígitos y en rango, con segundos en los tipos que los llevan
+DT_PATTERN = r'[1-9]\d{3}/(0[1-9]|1[0-2])/(0[1-9]|[12]\d|3[01]) ([01]\d|2[0-3]):[0-5]\d(:[0-5]\d)?'
+DT_SECONDS_TYPES = ['P1', 'P1D', 'F1']
+
+def build_rows_vectorized(lines, file_type_map):
+    """Construcción vectorizada de las filas raw, con el mismo resultado que `build_rows`.
+
+    Las líneas se separan en una tabla de campos de una vez; las columnas de fecha,
+    flag, in, out y DCM de cada tipo se toman con indexado de arrays, el cambio de
+    hora de las filas con fl == 1 se hace con aritmética de datetime64, y las filas de
+    salida se forman agrupando por (dt, fl) y colocando cada entrada en su posición
+    dentro del grupo. La separación en campos y la validación de las fechas se hacen
+    con las operaciones de texto de pandas sobre todas las líneas. Devuelve None si
+    alguna línea se sale del formato habitual (flag distinto de 0/1, fecha sin ceros a
+    la izquierda, líneas vacías...); en ese caso se usa `build_rows`, que da el mismo
+    resultado o el mismo error.
+    """
+    if not lines:
+        return None
+    # Tabla de campos; las líneas más cortas se rellenan con None
+    parts = pd.Series(lines, dtype=object).str.strip().str.split(';', expand=True)
+    n_parts = parts.notna().sum(axis=1).to_numpy()
+    if (n_parts < 2).any():
+        return None
+    parts = parts.to_numpy(dtype=object)
+
+    # Posiciones de dt, fl, in, out y DCM de cada línea según su tipo (-1 si no hay DCM)
+    types = parts[:, 1]
+    positions = np.full((len(parts), 5), -1)
+    known = np.zeros(len(parts), dtype=bool)
+    for file_type, cols in file_type_map.items():
+        mask = types == file_type
+        positions[mask] = [-1 if col is None else col for col in cols]
+        known |= mask
+    keep = known & (positions[:, 2] < n_parts) & (positions[:, 3] < n_parts)
+    if not keep.any():
+        return None
+    parts, positions, n_parts, types = parts[keep], positions[keep], n_parts[keep], types[keep]
+
+    rows = np.arange(len(parts))
+    dt, fl, entry_in, entry_out = (parts[rows, positions[:, i]] for i in range(4))
+    has_dcm = (positions[:, 4] >= 0) & (positions[:, 4] < n_parts)
+    dcm = np.where(has_dcm, parts[rows, positions[:, 4]], '')
+
+    dt = pd.Series(dt, dtype=object)
+    with_seconds = np.isin(types, DT_SECONDS_TYPES)
+    if not (dt.str.fullmatch(DT_PATTERN).all() and ((dt.str.len().to_numpy() == 19) == with_seconds).all()
+            and np.isin(fl, ['0', '1']).all()):
+        return None
+
+    # Restar una hora a las filas con fl == 1; el resto conserva la fecha sin segundos
+    minutes = dt.str[:16]
+    shift = fl == '1'
     try:
-        file_name = os.path.basename(file_path)
-        print(f"Processing file: {file_name}")
+        stamps = minutes[shift].str.replace('/', '-').to_numpy().astype('datetime64[m]')
+        # Valida también el resto de fechas (p. ej. 30 de febrero), como strptime
+        dt.str[:10].drop_duplicates().str.replace('/', '-').to_numpy().astype('datetime64[D]')
+    except ValueError:
+        return None
+    shifted = pd.Series(np.datetime_as_string(stamps - np.timedelta64(1, 'h'), unit='m'), dtype=object)
+    minutes[shift] = shifted.str.replace('-', '/').str.replace('T', ' ').to_numpy()
 
-        file_type_map = {
-            'A5D': (3, 4, 5, 6, 11),
-            'B5D': (3, 4, 5, 6, 11),
-            'F5D': (3, 4, 5, 6, 11),
-            'P5D': (3, 4, 5, 6, None),
-            'RF5D': (3, 4, 5, 6, 11),
-            'F1': (4, 5, 6, 7, 14),
-            'P1': (4, 5, 6, 8, 22),
-            'P1D': (4, 5, 6, 8, 22)
-        }
+    df = pd.DataFrame({'dt': minutes.to_numpy(), 'fl': fl, 'type': types, 'in': entry_in, 'out': entry_out, 'dcm': dcm})
+    df = df.drop_duplicates().sort_values(['dt', 'fl'])
 
-        # Read the file as raw text lines
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
+    # Grupos (dt, fl) consecutivos y posición de cada entrada dentro de su grupo
+    new_group = (df['dt'] != df['dt'].shift()) | (df['fl'] != df['fl'].shift())
+    group = new_group.cumsum().to_numpy() - 1
+    position = df.groupby(group).cumcount().to_numpy()
+    first = df[new_group.to_numpy()]
+    num_entries = np.bincount(group)
 
-        # Process each line individually
-        processed_lines = [process_line(line, file_type_map) for line in lines]
-        processed_lines = [line for line in processed_lines if line is not None]
+    entries = np.full((len(first), position.max() + 1), '', dtype=object)
+    entries[group, position] = (';' + df['type'] + ';' + df['in'] + ';' + df['out'] + ';' + df['dcm']).to_numpy()
 
-        # Adjust the datetime based on the flag
-        adjusted_lines = [adjust_datetime(line) for line in processed_lines]
+    # Relleno hasta 50 campos: dt, fl, número de entradas y cuatro campos por entrada
+    padding = np.array([';' * i for i in range(48)], dtype=object)[np.clip(47 - 4 * num_entries, 0, None)]
+    output = (first['dt'] + ';' + first['fl'] + ';').to_numpy() + num_entries.astype(str).astype(object)
+    for column in entries.T:
+        output = output + column
+    return (output + padding).tolist()
 
-        # Create a DataFrame from adjusted lines and remove duplicate rows
-        df = pd.DataFrame(adjusted_lines).drop_duplicates()
+FILE_TYPE_MAP = {
+    'A5D': (3, 4, 5, 6, 11),
+    'B5D': (3, 4, 5, 6, 11),
+    'F5D': (3, 4, 5, 6, 11),
+    'P5D': (3, 4, 5, 6, None),
+    'RF5D': (3, 4, 5, 6, 11),
+    'F1': (4, 5, 6, 7, 14),
+    'P1': (4, 5, 6, 8, 22),
+    'P1D': (4, 5, 6, 8, 22)
+}
 
-        # Group by DT and FL
-        grouped = df.groupby([0, 1])
+def user_to_raw(file_path):
+    """Contenido del fichero raw de un fichero de usuario, como texto."""
+    # Read the file as raw text lines
+    with open(file_path, 'r') as f:
+        lines = f.read().split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    output_lines = lines_to_raw(lines, os.path.basename(file_path))
+    count(rows_in=len(lines), rows_out=len(output_lines))
+    return ''.join(line + '\n' for line in output_lines)
 
-        output_data = []
+def lines_to_raw(lines, file_name):
+    """Filas raw de unas líneas de fichero de usuario (vectorizado, o fila a fila si hace falta).
 
-        for (dt, fl), group in grouped:
-            row = [dt, fl]
-            num_entries = len(group)  # Count the number of entries in this group
-            row.append(num_entries)  # Add the number of initial entries as the third field
-            for _, entry in group.iterrows():
-                row.extend(entry[2:].tolist())
-            output_data.append(row)
+    Los ficheros que pasan por `build_rows` se registran en el log y se cuentan en
+    `rowwise_files` de la telemetría.
+    """
+    output_lines = build_rows_vectorized(lines, FILE_TYPE_MAP)
+    if output_lines is None:
+        logging.warning(f"Líneas fuera del formato habitual en {file_name}: se procesa línea a línea")
+        count(rowwise_files=1)
+        output_lines = build_rows(lines, FILE_TYPE_MAP)
+    return output_lines
 
-        # Sort by DT
-        output_data.sort(key=lambda x: datetime.strptime(x[0], "%Y/%m/%d %H:%M"))
+def process_file(file_path, raw_dir):
+    try:
+        file_name = os.path.basename(file_path)
+        print(f"Processing file: {file_name}")
 
-        # Pad rows to ensure each has 50 fields
-        padded_output_data = [row + [''] * (50 - len(row)) for row in output_data]
+        raw_text = user_to_raw(file_path)
 
         # Write the processed data to the corresponding raw file
         raw_file_path = os.path.join(raw_dir, file_name)
         with open(raw_file_path, 'w') as f:
-            for row in padded_output_data:
-                f.write(';'.join(map(str, row)) + '\n')
+            count(bytes_out=f.write(raw_text))
 
         return f"Processed {file_name}"
     except Exception as e:
@@ -127,9 +235,10 @@ def setup_logging(id2raw_log):
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-def main():
+def main(config_path=None):
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(script_dir, 'config.json')
+    # Por defecto, el config.json junto al script
+    config_path = config_path or os.path.join(script_dir, 'config.json')
 
     config = load_config(config_path)
     id_files_pattern = os.path.join(config['id_dir'], '*.csv')
@@ -144,16 +253,18 @@ def main():
 
     id_files = glob(id_files_pattern)
 
-    num_workers = max(1, os.cpu_count() - 1)  # Asegura al menos 1 worker
-    # Process files in parallel using ProcessPoolExecutor
-    with ProcessPoolExecutor(max_workers=num_workers) as executor:
-      futures = [executor.submit(process_file, file, raw_dir) for file in id_files]
-      results = [future.result() for future in futures]  # Obtiene resultados una vez completados
-
+    # Process files in parallel, largest first, logging each result as it completes
+    tasks = []
+    with open_telemetry(config, script_dir) as telemetry, telemetry.stage('user2raw') as stage:
+        for task in run_tasks(process_file, [(file, raw_dir) for file in id_files],
+                              profile_dir=config.get('profile_dir')):
+            tasks.append(task)
+            record_tasks(telemetry, stage, [task])
+            result = task.result if task.error is None else f"Failed to process {os.path.basename(task.task[0])}: {task.error}"
+            logging.info(result)
+            print(result)  # Print result to standard output for immediate feedback
 
-    for result in results:
-        logging.info(result)
-        print(result)  # Print result to standard output for immediate feedback
+    logging.info(timing_summary(tasks))
 
 if __name__ == "__main__":
     main()
@@ -8,149 +8,193 @@
 
 import os
 import json
+import numpy as np
 import pandas as pd
 import logging
-from concurrent.futures import ProcessPoolExecutor, as_completed
 from glob import glob
 
+from scheduler import count, open_telemetry, record_tasks, run_tasks, timing_summary
+
 def load_config(config_path):
     with open(config_path, 'r') as file:
         config = json.load(file)
     return config
 
+# Tipos de lectura cuyos valores vienen en Wh y se pasan a kWh
+SCALED_TYPES = ['A5D', 'B5D', 'F5D', 'P5D', 'RF5D']
+
+# Contadores escritos en goi7_log (tras fname, max_entries y rows)
+COUNTERS = ['unique_count', 'p5d_wins', 'p5d_mean', 'f5d_wins', 'f5d_min', 'f5d_mean',
+            'p1d_wins', 'p1d_min', 'p1d_mean', 'a5d_wins', 'a5d_mean', 'equal_in', 'skipped']
+
+def _first(mask, values):
+    """Valor de la primera entrada seleccionada por `mask` en cada fila."""
+    return values[np.arange(len(values)), mask.argmax(axis=1)]
+
+def _mean(mask, values, is_int, selected):
+    """Media de las entradas seleccionadas por `mask` en las filas `selected`.
+
+    Se calcula con sum() sobre los mismos int y float de Python que la implementación
+    original: desde Python 3.12 sum() compensa el error de redondeo y la media tiene
+    que coincidir bit a bit.
+    """
+    mean = np.full(len(values), np.nan)
+    rows = np.flatnonzero(selected)
+    entries_in = values[rows].astype(object)
+    ints = is_int[rows]
+    entries_in[ints] = values[rows][ints].astype(np.int64).astype(object)
+    selected_ins = [ins[m].tolist() for ins, m in zip(entries_in, mask[rows])]
+    mean[rows] = [sum(ins) / len(ins) for ins in selected_ins]
+    return mean
+
+def reconcile_rows(df, file_name):
+    """Reconciliación de las entradas de cada fila según la prioridad de fuentes.
+
+    Devuelve el DataFrame de salida (dt, fl, kWh, con el índice de la fila de origen),
+    los contadores y el máximo número de entradas. Las entradas de cada fila (tipo,
+    valor y DCM en las columnas 3 + 4*i, 4 + 4*i y 6 + 4*i) se tratan como matrices
+    filas x entradas y las reglas de prioridad (P5D > F5D con DCM mínimo > P1D con DCM
+    mínimo > A5D > todas iguales) se aplican con máscaras sobre todas las filas a la vez.
+    Las filas que no se pueden resolver (número de entradas fuera de rango, o ningún
+    valor que coincida con el de DCM mínimo) se registran como error y se omiten, como
+    hacía el bucle fila a fila original. Un fichero sin columnas de entradas, con un
+    número de entradas no entero o con valores o DCM no numéricos lanza ValueError.
+    """
+    if len(df) == 0:
+        return pd.DataFrame([], columns=['dt', 'fl', 'kWh'], index=[]), dict.fromkeys(COUNTERS, 0), 0
+    n_slots = (df.shape[1] - 3) // 4
+    if n_slots == 0:
+        raise ValueError(f"{file_name}: sin columnas de entradas (dt;fl;n;[tipo;in;out;dcm]*n)")
+    if not pd.api.types.is_integer_dtype(df[2]):
+        raise ValueError(f"{file_name}: número de entradas vacío o no entero")
+    entries = df[2].to_numpy()
+    max_entries = max(0, int(entries.max()))
+    # Las entradas más allá del máximo de la fila no se usan nunca
+    width = max(1, min(n_slots, max_entries))
+    type_cols = [3 + i * 4 for i in range(width)]
+    value_cols = [4 + i * 4 for i in range(width)]
+    dcm_cols = [6 + i * 4 for i in range(width)]
+    if not all(pd.api.types.is_numeric_dtype(df[c]) for c in value_cols + dcm_cols):
+        raise ValueError(f"{file_name}: valores o DCM no numéricos")
+
+    n = len(df)
+    rows = np.arange(n)
+
+    types = df[type_cols].to_numpy(dtype=object)
+    values = df[value_cols].to_numpy(dtype=np.float64)
+    dcms = df[dcm_cols].to_numpy(dtype=np.float64)
+
+    active = np.arange(width) < entries[:, None]
+    # Comparar códigos enteros es mucho más rápido que comparar cadenas una a una
+    codes = np.full(types.shape, -1)
+    codes[active], uniques = pd.factorize(types[active])
+    uniques = list(uniques)
+    is_type = {t: active & (codes == (uniques.index(t) if t in uniques else -2))
+               for t in SCALED_TYPES + ['P1D']}
+    scaled = np.logical_or.reduce([is_type[t] for t in SCALED_TYPES])
+    values = np.where(scaled, values / 1000, values)
+    # Valores que en la implementación original siguen siendo int de Python
+    is_int = np.array([pd.api.types.is_integer_dtype(df[c]) for c in value_cols])[None, :] & ~scaled
+
+    kwh = np.full(n, np.nan)
+    kwh_int = np.zeros(n, dtype=bool)
+    outcome = np.full(n, -1)
+    out_of_range = (entries < 1) | (entries > n_slots)
+    no_match = np.zeros(n, dtype=bool)
+    pending = ~out_of_range
+
+    def assign(selected, value, value_int, counter):
+        kwh[selected] = value[selected]
+        kwh_int[selected] = value_int[selected]
+        outcome[selected] = COUNTERS.index(counter)
+
+    # Una sola entrada
+    unique = pending & (entries == 1)
+    assign(unique, values[:, 0], is_int[:, 0], 'unique_count')
+    pending &= ~unique
+
+    for entry_type, prefix, by_min_dcm in [('P5D', 'p5d', False), ('F5D', 'f5d', True),
+                                           ('P1D', 'p1d', True), ('A5D', 'a5d', False)]:
+        mask = is_type[entry_type]
+        count = mask.sum(axis=1)
+        present = pending & (count > 0)
+        pending &= ~present
+
+        single = present & (count == 1)
+        assign(single, _first(mask, values), _first(mask, is_int), f'{prefix}_wins')
+
+        several = present & (count > 1)
+        if not by_min_dcm:
+            assign(several, _mean(mask, values, is_int, several), np.zeros(n, dtype=bool), f'{prefix}_mean')
+            continue
+
+        # Primera entrada con el DCM estrictamente mínimo (los DCM NaN nunca ganan)
+        min_dcms = np.where(mask & (dcms < np.inf), dcms, np.inf)
+        min_slot = (min_dcms == min_dcms.min(axis=1)[:, None]).argmax(axis=1)
+        has_min = min_dcms.min(axis=1) < np.inf
+        value_min = values[rows, min_slot]
+        # Entradas del tipo con el mismo valor que la de DCM mínimo
+        equal = mask & (values == value_min[:, None]) & has_min[:, None]
+        n_equal = equal.sum(axis=1)
+
+        assign(several & (n_equal == 1), value_min, is_int[rows, min_slot], f'{prefix}_min')
+        several_equal = several & (n_equal > 1)
+        assign(several_equal, _mean(equal, values, is_int, several_equal), np.zeros(n, dtype=bool), f'{prefix}_mean')
+        # Sin coincidencias (DCM o valores vacíos) no hay valor que elegir
+        no_match |= several & (n_equal == 0)
+
+    # Ninguno de los tipos anteriores: se acepta si todas las entradas son iguales
+    all_equal = np.all(~active | (values == values[:, [0]]), axis=1)
+    assign(pending & all_equal, values[:, 0], is_int[:, 0], 'equal_in')
+    outcome[pending & ~all_equal] = COUNTERS.index('skipped')
+
+    counts = {name: int((outcome == i).sum()) for i, name in enumerate(COUNTERS)}
+
+    output = np.flatnonzero((outcome >= 0) & (outcome != COUNTERS.index('skipped')))
+    kwh = kwh[output]
+    # Como en la implementación original, la columna solo es entera si todos los valores lo son
+    if kwh_int[output].all():
+        kwh = kwh.astype(np.int64)
+    output_df = pd.DataFrame({'dt': df[0].to_numpy()[output], 'fl': df[1].to_numpy()[output], 'kWh': kwh},
+                             index=df.index[output])
+
+    for idx in df.index[out_of_range]:
+        logging.error(f"Error processing row {idx} in {file_name}: número de entradas fuera de rango")
+    for idx in df.index[no_match]:
+        logging.error(f"Error processing row {idx} in {file_name}: ningún valor coincide con el de DCM mínimo")
+
+    return output_df, counts, max_entries
+
+def raw_to_goi(source, file_name, dt_range=None):
+    """Serie de consumo (dt, fl, kWh) de un fichero raw y su fila de goi7_log.
+
+    `source` es la ruta del fichero raw o un buffer de texto con su contenido. Con
+    `dt_range` = (primera, última) solo se reconcilian las filas de ese intervalo; el
+    fichero se lee entero para que los tipos de columna sean los de la lectura completa.
+    """
+    logging.info(f"Processing file: {file_name}")
+    
+    df = pd.read_csv(source, header=None, delimiter=';', low_memory=False)
+    logging.info(f"Read {len(df)} rows from {file_name}")
+    if dt_range is not None:
+        df = df[df[0].between(*dt_range)]
+
+    total_rows = len(df)
+    output_df, counts, max_entries = reconcile_rows(df, file_name)
+    count(rows_in=total_rows, rows_out=len(output_df))
+    return output_df, (file_name, max_entries, total_rows, *[counts[name] for name in COUNTERS])
+
 def process_file(file_path, output_dir):
     try:
         file_name = os.path.basename(file_path)
-        logging.info(f"Processing file: {file_name}")
-        
-        df = pd.read_csv(file_path, header=None, delimiter=';', low_memory=False)
-        logging.info(f"Read {len(df)} rows from {file_name}")
-
-        processed_data = []
-        max_entries = 0
-        unique_count = 0
-        p5d_wins = 0
-        p5d_mean = 0
-        f5d_wins = 0
-        f5d_min = 0
-        f5d_mean = 0
-        p1d_wins = 0
-        p1d_min = 0
-        p1d_mean = 0
-        a5d_wins = 0
-        a5d_mean = 0
-        equal_in = 0
-        skipped = 0
-        total_rows = len(df)
-
-        for idx, row in df.iterrows():
-            try:
-                dt = row[0]
-                fl = row[1]
-                entries = row[2]
-                max_entries = max(max_entries, entries)
-
-                for i in range(entries):
-                    entry_type = row[3 + i * 4]
-                    if entry_type in ['A5D', 'B5D', 'F5D', 'P5D', 'RF5D']:
-                        row[4 + i * 4] /= 1000
-
-                kWh = None
-                
-                if entries == 1:
-                    kWh = row[4]
-                    unique_count += 1
-                else:
-                    p5d_ins = []
-                    f5d_ins = []
-                    f5d_dcmin = float('inf')
-                    f5d_in_min = None
-                    p1d_ins = []
-                    p1d_dcmin = float('inf')
-                    p1d_in_min = None
-                    a5d_ins = []
-                    all_ins = []
-
-                    for i in range(entries):
-                        entry_type = row[3 + i * 4]
-                        entry_in = row[4 + i * 4]
-                        entry_dcm = row[6 + i * 4]
-                        all_ins.append(entry_in)
-
-                        if entry_type == 'P5D':
-                            p5d_ins.append(entry_in)
-                        elif entry_type == 'F5D':
-                            f5d_ins.append(entry_in)
-                            if entry_dcm < f5d_dcmin:
-                                f5d_dcmin = entry_dcm
-                                f5d_in_min = entry_in
-                        elif entry_type == 'P1D':
-                            p1d_ins.append(entry_in)
-                            if entry_dcm < p1d_dcmin:
-                                p1d_dcmin = entry_dcm
-                                p1d_in_min = entry_in
-                        elif entry_type == 'A5D':
-                            a5d_ins.append(entry_in)
-                    
-                    if p5d_ins:
-                        if len(p5d_ins) == 1:
-                            kWh = p5d_ins[0]
-                            p5d_wins += 1
-                        else:
-                            kWh = sum(p5d_ins) / len(p5d_ins)
-                            p5d_mean += 1
-                    elif f5d_ins:
-                        if len(f5d_ins) == 1:
-                            kWh = f5d_ins[0]
-                            f5d_wins += 1
-                        else:
-                            min_f5d_ins = [entry_in for entry_in in f5d_ins if entry_in == f5d_in_min]
-                            if len(min_f5d_ins) == 1:
-                                kWh = f5d_in_min
-                                f5d_min += 1
-                            else:
-                                kWh = sum(min_f5d_ins) / len(min_f5d_ins)
-                                f5d_mean += 1
-                    elif p1d_ins:
-                        if len(p1d_ins) == 1:
-                            kWh = p1d_ins[0]
-                            p1d_wins += 1
-                        else:
-                            min_p1d_ins = [entry_in for entry_in in p1d_ins if entry_in == p1d_in_min]
-                            if len(min_p1d_ins) == 1:
-                                kWh = p1d_in_min
-                                p1d_min += 1
-                            else:
-                                kWh = sum(min_p1d_ins) / len(min_p1d_ins)
-                                p1d_mean += 1
-                    elif a5d_ins:
-                        if len(a5d_ins) == 1:
-                            kWh = a5d_ins[0]
-                            a5d_wins += 1
-                        else:
-                            kWh = sum(a5d_ins) / len(a5d_ins)
-                            a5d_mean += 1
-                    else:
-                        if all(x == all_ins[0] for x in all_ins):
-                            kWh = all_ins[0]
-                            equal_in += 1
-                        else:
-                            skipped += 1
-                            continue
-
-                if kWh is not None:
-                    processed_data.append([dt, fl, kWh])
-            except Exception as row_error:
-                logging.error(f"Error processing row {idx} in {file_name}: {row_error}")
-
-        output_df = pd.DataFrame(processed_data, columns=['dt', 'fl', 'kWh'])
+        output_df, result = raw_to_goi(file_path, file_name)
+
         output_file_path = os.path.join(output_dir, file_name)
         output_df.to_csv(output_file_path, index=False, sep=',')
+        count(bytes_out=os.path.getsize(output_file_path))
 
         logging.info(f"Successfully processed file: {file_name}")
-        return (file_name, max_entries, total_rows, unique_count, p5d_wins, p5d_mean,
-                f5d_wins, f5d_min, f5d_mean, p1d_wins, p1d_min, p1d_mean,
-                a5d_wins, a5d_mean, equal_in, skipped)
+        return result
     except Exception as e:
         logging.error(f"Failed to process {file_path}: {e}")
         return (os.path.basename(file_path), None, None, None, None, None, None, None, None, None, None, None, None, None, None, None)
@@ -164,16 +208,16 @@ def setup_logging(log_file_path):
     )
 
 
-def main():
+def main(config_path=None):
     import os
     import json
     import logging
     from glob import glob
-    from concurrent.futures import ProcessPoolExecutor, as_completed
 
     # Cargar configuración
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(script_dir, 'config.json')
+    # Por defecto, el config.json junto al script
+    config_path = config_path or os.path.join(script_dir, 'config.json')
     config = load_config(config_path)
 
     input_pattern = os.path.join(config['raw_dir'], '*.csv')
@@ -191,28 +235,29 @@ def main():
         logging.warning("No se encontraron archivos para procesar.")
         return
 
-    num_workers = max(1, os.cpu_count() - 1)
-
     # Abrir el log especial en modo append y escribir la cabecera si el archivo está vacío
     with open(special_log_file, 'a') as spec_log:
         if os.stat(special_log_file).st_size == 0:
             spec_log.write("fname,max_entries,rows,unique,p5d_wins,p5d_mean,f5d_wins,f5d_min,f5d_mean,"
                            "p1d_wins,p1d_min,p1d_mean,a5d_wins,a5d_mean,equal_in,skipped\n")
-        # Procesar archivos en paralelo y escribir cada resultado a medida que se obtiene
-        with ProcessPoolExecutor(max_workers=num_workers,
-                                 initializer=setup_logging,
-                                 initargs=(log_file_path,)) as executor:
-            futures = {executor.submit(process_file, file, output_dir): file for file in input_files}
-            for future in as_completed(futures):
-                try:
-                    result = future.result()
-                    # Escribir sólo si el resultado es válido (max_entries distinto de None)
-                    if result[1] is not None:
-                        spec_log.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(*result))
-                        spec_log.flush()
-                        os.fsync(spec_log.fileno())
-                except Exception as e:
-                    logging.error("Error al procesar {}: {}".format(futures[future], e))
+        # Procesar archivos en paralelo (los más grandes primero) y escribir cada resultado a medida que se obtiene
+        tasks = []
+        with open_telemetry(config, script_dir) as telemetry, telemetry.stage('raw2goi') as stage:
+            for task in run_tasks(process_file, [(file, output_dir) for file in input_files],
+                                  initializer=setup_logging, initargs=(log_file_path,),
+                                  profile_dir=config.get('profile_dir')):
+                tasks.append(task)
+                record_tasks(telemetry, stage, [task])
+                if task.error is not None:
+                    logging.error("Error al procesar {}: {}".format(task.task[0], task.error))
+                    continue
+                result = task.result
+                # Escribir sólo si el resultado es válido (max_entries distinto de None)
+                if result[1] is not None:
+                    spec_log.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(*result))
+                    spec_log.flush()
+                    os.fsync(spec_log.fileno())
+    logging.info(timing_summary(tasks))
 
 if __name__ == "__main__":
     main()
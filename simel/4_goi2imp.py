@@ -7,22 +7,16 @@
 # -----------------------------------------------------------------------------------
 
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import pytz
-from concurrent.futures import ProcessPoolExecutor
 import json
-from multiprocessing import cpu_count, Manager
 
-# Cargar configuración desde config.json
-with open('config.json', 'r') as file:
-    config = json.load(file)
+from scheduler import count, open_telemetry, record_tasks, run_tasks, timing_summary
 
-# Obtener la ruta del log CSV desde config.json
-log_csv = config["goi72imp_log"]
-
-# Crear el directorio del log si no existe
-os.makedirs(os.path.dirname(log_csv), exist_ok=True)
+# Horas en una semana: desfase entre valores del mismo día de la semana y hora
+WEEK_HOURS = 7 * 24
 
 # Definir la función para convertir UTC a CET
 def transform_utc_to_cet(utc_dt):
@@ -37,10 +31,51 @@ def check_dst(utc_dt):
     cet_dt = transform_utc_to_cet(utc_dt - timedelta(hours=1))
     return 1 if cet_dt.dst() != timedelta(0) else 0
 
-# Función para procesar archivos CSV e imputar valores
-def impute_values(file_path, output_folder, stats_list):
+# Versión vectorizada de check_dst para un DatetimeIndex (naive, en UTC) completo:
+# una sola conversión de zona horaria en lugar de una llamada a pytz por hora.
+# En Europe/Madrid el desfase respecto a UTC es de 1 h en horario de invierno, así que
+# cualquier otro desfase indica horario de verano.
+def dst_flags(utc_index):
+    utc_index = pd.DatetimeIndex(utc_index) - pd.Timedelta(hours=1)
+    local = utc_index.tz_localize('UTC').tz_convert(pytz.timezone('Europe/Madrid'))
+    offset = local.tz_localize(None) - utc_index
+    return (offset != pd.Timedelta(hours=1)).astype(int)
+
+# Imputar los valores faltantes de una serie horaria completa (sin huecos en el índice).
+# Cada hueco toma el valor válido más cercano del mismo día de la semana y hora en
+# semanas anteriores y posteriores: la media redondeada de ambos si existen, el único
+# disponible si solo hay uno, o la media redondeada de la serie si no hay ninguno.
+# Las posiciones i e i + 168 comparten día de la semana y hora, así que basta con
+# rellenar hacia delante y hacia atrás dentro de cada una de las 168 franjas semanales.
+def impute_kwh(kwh):
+    missing = kwh.isna()
+    if not missing.any():
+        return kwh
+
+    lane = np.arange(len(kwh)) % WEEK_HOURS
+    past = kwh.groupby(lane).ffill()[missing]
+    future = kwh.groupby(lane).bfill()[missing]
+
+    # Media redondeada de la serie para los huecos sin valores en ninguna dirección
+    imputed = pd.Series(round(kwh.mean(), 3), index=past.index)
+    imputed = imputed.mask(future.notna(), future)
+    imputed = imputed.mask(past.notna(), past)
+
+    both = past.notna() & future.notna()
+    # Los valores son np.float64, cuyo round() es np.round
+    imputed[both] = np.round((past[both] + future[both]) / 2, 3)
+
+    kwh = kwh.copy()
+    kwh[missing] = imputed
+    return kwh
+
+# Imputar un fichero de consumo y devolver su fila de estadísticas (rep = -1 si hay error).
+# Si se pasa `df` (con 'dt' ya convertido a datetime) se usa en lugar de leer file_path.
+def impute_file(file_path, output_folder, df=None):
     try:
-        df = pd.read_csv(file_path, parse_dates=['dt'])
+        if df is None:
+            df = pd.read_csv(file_path, parse_dates=['dt'])
+        count(rows_in=len(df))
 
         # Contar duplicados antes de eliminarlos
         rep_count = df.duplicated(subset=['dt'], keep=False).sum()
@@ -64,53 +99,16 @@ def impute_values(file_path, output_folder, stats_list):
         # Reindexar para asegurarse de que no falten timestamps
         df = df.reindex(full_index)
 
-        df['fl'] = df.index.map(check_dst)
-        df['imp'] = df.apply(lambda row: 0 if pd.notna(row['kWh']) else 1, axis=1)
-
-        # Función para imputar valores faltantes
-        def impute_kwh(row):
-            if pd.notna(row['kWh']):
-                return row['kWh']
-            
-            target_dt = row.name
-            day_of_week = target_dt.weekday()
-            hour_of_day = target_dt.hour
-
-            past_values = []
-            future_values = []
-
-            past_dt = target_dt - timedelta(weeks=1)
-            future_dt = target_dt + timedelta(weeks=1)
-
-            while past_dt >= df.index.min() or future_dt <= df.index.max():
-                if past_dt >= df.index.min() and past_dt.weekday() == day_of_week and past_dt.hour == hour_of_day and pd.notna(df.loc[past_dt, 'kWh']):
-                    past_values.append(df.loc[past_dt, 'kWh'])
-                
-                if future_dt <= df.index.max() and future_dt.weekday() == day_of_week and future_dt.hour == hour_of_day and pd.notna(df.loc[future_dt, 'kWh']):
-                    future_values.append(df.loc[future_dt, 'kWh'])
-
-                if len(past_values) >= 1 and len(future_values) >= 1:
-                    break
-                
-                past_dt -= timedelta(weeks=1)
-                future_dt += timedelta(weeks=1)
-
-            if len(past_values) > 0 and len(future_values) > 0:
-                return round((past_values[0] + future_values[0]) / 2, 3)
-            elif len(past_values) > 0:
-                return past_values[0]
-            elif len(future_values) > 0:
-                return future_values[0]
-            else:
-                return round(df['kWh'].mean(), 3)
-
-        df['kWh'] = df.apply(impute_kwh, axis=1)
+        df['fl'] = dst_flags(df.index)
+        df['imp'] = df['kWh'].isna().astype(int)
+
+        df['kWh'] = impute_kwh(df['kWh'])
 
         # Guardar el archivo corregido
         output_file = os.path.join(output_folder, os.path.basename(file_path))
         df.reset_index().to_csv(output_file, index=False)
+        count(rows_out=len(df), bytes_out=os.path.getsize(output_file))
 
-        # Guardar en el CSV inmediatamente después de cada archivo procesado
         stats_df = pd.DataFrame([{
             'dt': datetime.utcnow().isoformat(),
             'fname': os.path.basename(file_path),
@@ -119,8 +117,6 @@ def impute_values(file_path, output_folder, stats_list):
             'imp': sum(df['imp'] > 0)
         }])
 
-        stats_df.to_csv(log_csv, mode='a', header=not os.path.exists(log_csv), index=False)
-
     except Exception as e:
         # Registrar el error en la terminal para depuración
         print(f"Error procesando {file_path}: {e}")
@@ -135,8 +131,8 @@ def impute_values(file_path, output_folder, stats_list):
             'samples': 0,
             'imp': 0
         }])
-    
-        stats_df.to_csv(log_csv, mode='a', header=not os.path.exists(log_csv), index=False)
+
+    return stats_df
 
 # Función para procesar múltiples archivos en paralelo
 def process_files(config_path):
@@ -146,22 +142,37 @@ def process_files(config_path):
     input_folder = config['goiener_dir']
     output_folder = config['imputation_dir']
     stats_log_path = config['imputed_log']
-    
+    log_csv = config['goi72imp_log']
+
+    # Crear el directorio del log si no existe
+    os.makedirs(os.path.dirname(log_csv), exist_ok=True)
     os.makedirs(output_folder, exist_ok=True)
 
     files = [os.path.join(input_folder, f) for f in os.listdir(input_folder) if f.endswith('.csv')]
 
-    with Manager() as manager:
-        stats_list = manager.list()
-
-        num_workers = max(1, cpu_count() - 1)  # Usa todos los núcleos menos uno
-        with ProcessPoolExecutor(max_workers=num_workers) as executor:
-            executor.map(impute_values, files, [output_folder]*len(files), [stats_list]*len(files))
-
-        # Guardar estadísticas en un CSV
-        stats_df = pd.DataFrame(list(stats_list))
-        stats_df.to_csv(stats_log_path, index=False)
+    # Los ficheros más grandes primero; las estadísticas las escribe este proceso según llegan
+    tasks, stats_list = [], []
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open_telemetry(config, script_dir) as telemetry, telemetry.stage('goi2imp') as stage:
+        for task in run_tasks(impute_file, [(file, output_folder) for file in files],
+                              profile_dir=config.get('profile_dir')):
+            tasks.append(task)
+            record_tasks(telemetry, stage, [task])
+            if task.error is not None:
+                print(f"Error procesando {task.task[0]}: {task.error}")
+                continue
+            stats_df = task.result
+            # Guardar en el CSV inmediatamente después de cada archivo procesado
+            stats_df.to_csv(log_csv, mode='a', header=not os.path.exists(log_csv), index=False)
+            stats_list.append(stats_df)
+
+    # Guardar estadísticas en un CSV
+    stats_df = pd.concat(stats_list, ignore_index=True) if stats_list else pd.DataFrame([])
+    stats_df.to_csv(stats_log_path, index=False)
+    print(timing_summary(tasks))
 
 # Ejecutar el procesamiento
-config_path = 'config.json'
-process_files(config_path)
+if __name__ == "__main__":
+    config_path = 'config.json'
+    process_files(config_path)
+
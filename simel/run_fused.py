@@ -0,0 +1,446 @@
+# -----------------------------------------------------------------------------------
+# Script Name: run_fused.py
+# -----------------------------------------------------------------------------------
+
+# Ejecuta el pipeline SIMEL completo con los pasos 2-4 fusionados: tras el reparto por
+# usuario del paso 1, cada fichero de usuario pasa por user -> raw -> goi -> imp en
+# memoria dentro de una sola tarea, sin escribir ni volver a leer los CSV intermedios
+# de raw_dir y goiener_dir (se pueden guardar con --keep-intermediates para depurar).
+# Produce los mismos ficheros de log y estadísticas que los scripts por separado.
+#
+# Los ficheros SIMEL repartidos se anotan en un manifiesto (nombre, tamaño, mtime, hash
+# del contenido y ficheros de usuario a los que se han añadido). Con --incremental solo
+# se reparten los ficheros nuevos o modificados desde la última ejecución, las líneas
+# de la versión anterior de un fichero modificado solo se buscan en sus ficheros de
+# usuario, y solo se actualizan los usuarios afectados: se convierten y reconcilian las
+# líneas del intervalo de fechas que tocan esos ficheros, el resultado sustituye a ese
+# intervalo en la serie de consumo guardada en goiener_dir, y se vuelve a imputar la
+# serie completa.
+
+import os
+import re
+import io
+import json
+import hashlib
+import logging
+import argparse
+import importlib
+import pandas as pd
+from datetime import datetime, timedelta
+from glob import glob
+
+from scheduler import (Telemetry, count, default_workers, measure, open_telemetry, record_tasks,
+                       run_tasks, timing_summary)
+
+simel2user = importlib.import_module('1_simel2user')
+user2raw = importlib.import_module('2_user2raw')
+raw2goi = importlib.import_module('3_raw2goi')
+goi2imp = importlib.import_module('4_goi2imp')
+
+# Fechas de las líneas de usuario, completas o solo el día
+DT_PATTERN = re.compile(user2raw.DT_PATTERN)
+DATE_PATTERN = re.compile(r'\d{4}/\d{2}/\d{2}')
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+MANIFEST_COLUMNS = ['fname', 'size', 'mtime_ns', 'sha256', 'ids']
+
+def load_config(config_path):
+    with open(config_path, 'r') as file:
+        config = json.load(file)
+    return config
+
+def file_logger(name, log_file_path, level=logging.INFO):
+    """Logger propio para un fichero de log, con el formato de los scripts del pipeline."""
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    handler = logging.FileHandler(log_file_path)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT))
+    logger.addHandler(handler)
+    return logger
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(manifest_path):
+    """fname -> (size, mtime_ns, sha256, ids) de los ficheros SIMEL ya repartidos; None si no hay manifiesto.
+
+    `ids` son los nombres de los ficheros de usuario a los que se añadió el fichero
+    (None en los manifiestos anteriores a esa columna).
+    """
+    if not os.path.exists(manifest_path):
+        return None
+    manifest = pd.read_csv(manifest_path, dtype={'fname': str, 'sha256': str, 'ids': str}, keep_default_na=False)
+    if 'ids' not in manifest:
+        manifest['ids'] = None
+    return {row.fname: (row.size, row.mtime_ns, row.sha256, None if row.ids is None else row.ids.split())
+            for row in manifest.itertuples(index=False)}
+
+def write_manifest(manifest_path, entries):
+    tmp_path = manifest_path + '.tmp'
+    pd.DataFrame([(name, size, mtime_ns, sha256, None if ids is None else ' '.join(ids))
+                  for name, (size, mtime_ns, sha256, ids) in sorted(entries.items())],
+                 columns=MANIFEST_COLUMNS).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, manifest_path)
+
+def scan_simel_files(simel_files, manifest):
+    """Entradas del manifiesto de `simel_files` y listas de ficheros nuevos y modificados.
+
+    El hash solo se calcula si el tamaño o el mtime no coinciden con los del manifiesto.
+    Los ficheros nuevos y modificados quedan sin `ids` hasta que se reparten.
+    """
+    entries, new, changed = {}, [], []
+    for file_path in simel_files:
+        name = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        known = manifest.get(name)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            entries[name] = known
+            continue
+        sha256 = file_hash(file_path)
+        if known is None:
+            new.append(file_path)
+        elif known[2] != sha256:
+            changed.append(file_path)
+        entries[name] = (stat.st_size, stat.st_mtime_ns, sha256,
+                         known[3] if known is not None and known[2] == sha256 else None)
+    return entries, new, changed
+
+def strip_deliveries(file_path, simel_names):
+    """Quita de un fichero de usuario las líneas de los ficheros SIMEL indicados y las devuelve."""
+    with open(file_path, 'r', newline='') as f:
+        lines = f.read().splitlines(keepends=True)
+    removed = [line for line in lines if line.split(';', 1)[0] in simel_names]
+    if removed:
+        with open(file_path, 'w', newline='') as f:
+            f.write(''.join(line for line in lines if line.split(';', 1)[0] not in simel_names))
+    return [line.rstrip('\r\n') for line in removed]
+
+def latest_stats(log_csv):
+    """Última fila de estadísticas de cada fichero en goi72imp_log."""
+    if not os.path.exists(log_csv):
+        return pd.DataFrame([])
+    return pd.read_csv(log_csv).drop_duplicates('fname', keep='last')
+
+def touched_range(lines):
+    """Intervalo que incluye las fechas de las filas raw de unas líneas de usuario; None si no se puede saber.
+
+    Se toma de las fechas de las líneas, sin pasar por el paso 2: cada fila raw tiene la
+    fecha de su línea, o la hora anterior si su fl es 1.
+    """
+    dts = []
+    for line in lines:
+        parts = line.strip().split(';')
+        if len(parts) < 2:
+            return None
+        cols = user2raw.FILE_TYPE_MAP.get(parts[1])
+        # Líneas que el paso 2 descarta
+        if cols is None or cols[2] >= len(parts) or cols[3] >= len(parts):
+            continue
+        if not DT_PATTERN.fullmatch(parts[cols[0]]):
+            return None
+        dts.append(parts[cols[0]][:16])
+    if not dts:
+        return None
+    first = datetime.strptime(min(dts), '%Y/%m/%d %H:%M') - timedelta(hours=1)
+    return first.strftime('%Y/%m/%d %H:%M'), max(dts)
+
+def goi_frame(goi_df):
+    """Serie de consumo del paso 3 tal como la leería el paso 4 de su CSV."""
+    if pd.api.types.is_numeric_dtype(goi_df['kWh']) and pd.api.types.is_numeric_dtype(goi_df['fl']):
+        df = goi_df.reset_index(drop=True)
+        df['dt'] = pd.to_datetime(df['dt'], format='%Y/%m/%d %H:%M')
+        return df
+    # Tipos inesperados: pasar por el texto del CSV para que la lectura sea la misma
+    return pd.read_csv(io.StringIO(goi_df.to_csv(index=False, sep=',')), parse_dates=['dt'])
+
+def process_user(file_path, raw_dir, goiener_dir, imputation_dir, keep_intermediates):
+    """Pasos 2-4 para un fichero de usuario.
+
+    Devuelve el mensaje del paso 2, la fila de goi7_log del paso 3 (None si el paso 2
+    falla) y la fila de estadísticas del paso 4 (None si falla alguno de los anteriores).
+    """
+    file_name = os.path.basename(file_path)
+
+    # Paso 2: fichero de usuario -> filas raw
+    try:
+        print(f"Processing file: {file_name}")
+        with measure('user2raw', bytes_in=os.path.getsize(file_path)):
+            raw_text = user2raw.user_to_raw(file_path)
+            if keep_intermediates:
+                with open(os.path.join(raw_dir, file_name), 'w') as f:
+                    f.write(raw_text)
+    except Exception as e:
+        print(f"Error processing file {file_name}: {e}")
+        return f"Failed to process {file_name}: {e}", None, None
+    user2raw_message = f"Processed {file_name}"
+
+    # Paso 3: filas raw -> serie de consumo
+    raw_path = os.path.join(raw_dir, file_name)
+    goi_path = os.path.join(goiener_dir, file_name)
+    try:
+        with measure('raw2goi', bytes_in=len(raw_text)):
+            goi_df, goi7_row = raw2goi.raw_to_goi(io.StringIO(raw_text), file_name)
+            if keep_intermediates:
+                goi_df.to_csv(goi_path, index=False, sep=',')
+        logging.info(f"Successfully processed file: {file_name}")
+    except Exception as e:
+        logging.error(f"Failed to process {raw_path}: {e}")
+        return user2raw_message, (file_name,) + (None,) * 15, None
+
+    # Paso 4: imputación (con la serie en memoria en lugar de leer goi_path)
+    with measure('goi2imp'):
+        stats_df = goi2imp.impute_file(goi_path, imputation_dir, goi_frame(goi_df))
+    return user2raw_message, goi7_row, stats_df
+
+def lines_in_range(lines, dt_range):
+    """Líneas de usuario que pueden dar filas raw en `dt_range`.
+
+    Las filas con fl = 1 pasan a la hora anterior, así que se incluye también el día
+    siguiente al último. Las líneas de tipos desconocidos se descartan, como en el paso
+    2, y las que no tienen una fecha reconocible se conservan para que se traten igual
+    que en el fichero completo.
+    """
+    first = dt_range[0][:10]
+    last = (datetime.strptime(dt_range[1][:10], '%Y/%m/%d') + timedelta(days=1)).strftime('%Y/%m/%d')
+    selected = []
+    for line in lines:
+        # Basta con los campos hasta la fecha (columna 3 o 4)
+        parts = line.strip().split(';', 5)
+        if len(parts) < 2:
+            selected.append(line)
+            continue
+        cols = user2raw.FILE_TYPE_MAP.get(parts[1])
+        if cols is None:
+            continue
+        date = parts[cols[0]][:10] if cols[0] < len(parts) else ''
+        if not DATE_PATTERN.fullmatch(date) or first <= date <= last:
+            selected.append(line)
+    return selected
+
+def update_user(file_path, simel_names, removed, raw_dir, goiener_dir, imputation_dir):
+    """Pasos 2-4 para un usuario afectado por una ejecución incremental.
+
+    `simel_names` son los ficheros SIMEL repartidos en esta ejecución y `removed` las
+    líneas que se han quitado del fichero de usuario (versiones anteriores de ficheros
+    modificados). Solo se convierten y reconcilian las líneas de usuario con fechas entre
+    la primera y la última que tocan esas líneas; el resultado sustituye a ese intervalo
+    en la serie guardada en goiener_dir y la serie completa se vuelve a imputar. Si no
+    hay serie guardada, o no se puede acotar el intervalo, el usuario se procesa
+    completo. Devuelve lo mismo que `process_user`.
+    """
+    file_name = os.path.basename(file_path)
+    goi_path = os.path.join(goiener_dir, file_name)
+
+    # Paso 2: solo las líneas que pueden dar filas raw en el intervalo
+    try:
+        print(f"Processing file: {file_name}")
+        with measure('user2raw', bytes_in=os.path.getsize(file_path)):
+            with open(file_path, 'r') as f:
+                lines = f.read().split('\n')
+            if lines[-1] == '':
+                lines.pop()
+
+            delivered = [line for line in lines if line.split(';', 1)[0] in simel_names]
+            ranges = [touched_range(part) for part in (delivered, removed) if part]
+            dt_range = None
+            if not os.path.exists(goi_path):
+                logging.warning(f"Se procesa completo {file_name}: no hay serie guardada en {goiener_dir}")
+            elif not ranges or None in ranges:
+                logging.warning(f"Se procesa completo {file_name}: no se puede acotar el intervalo de fechas")
+            else:
+                dt_range = (min(r[0] for r in ranges), max(r[1] for r in ranges))
+                goi_df = pd.read_csv(goi_path)
+                goi_df = goi_df[~goi_df['dt'].between(*dt_range)]
+                kwh = goi_df['kWh']
+                # El paso 3 deja kWh como columna entera si todos los valores lo son; si la serie
+                # guardada es decimal pero lo que queda fuera del intervalo es entero, no se sabe
+                # si los decimales estaban solo en el intervalo
+                if len(kwh) and pd.api.types.is_float_dtype(kwh) and (kwh % 1 == 0).all():
+                    logging.warning(f"Se procesa completo {file_name}: no se sabe si kWh es entero fuera del intervalo")
+                    dt_range = None
+                else:
+                    lines = lines_in_range(lines, dt_range)
+            raw_lines = user2raw.lines_to_raw(lines, file_name) if lines else []
+            count(rows_in=len(lines), rows_out=len(raw_lines))
+    except Exception as e:
+        print(f"Error processing file {file_name}: {e}")
+        return f"Failed to process {file_name}: {e}", None, None
+    user2raw_message = f"Processed {file_name}"
+
+    # Paso 3: reconciliar el intervalo y unirlo a la serie guardada
+    try:
+        raw_text = ''.join(line + '\n' for line in raw_lines)
+        with measure('raw2goi', bytes_in=len(raw_text)):
+            if dt_range is None:
+                goi_df, goi7_row = raw2goi.raw_to_goi(io.StringIO(raw_text), file_name)
+            else:
+                goi7_row = (file_name,) + (None,) * 15
+                if any(dt_range[0] <= line.split(';', 1)[0] <= dt_range[1] for line in raw_lines):
+                    range_df, goi7_row = raw2goi.raw_to_goi(io.StringIO(raw_text), file_name, dt_range)
+                    goi_df = pd.concat([goi_df, range_df], ignore_index=True).sort_values(['dt', 'fl'], kind='stable')
+            goi_df.to_csv(goi_path, index=False, sep=',')
+        logging.info(f"Successfully processed file: {file_name}")
+    except Exception as e:
+        logging.error(f"Failed to process {os.path.join(raw_dir, file_name)}: {e}")
+        return user2raw_message, (file_name,) + (None,) * 15, None
+
+    # Paso 4: imputación de la serie completa
+    with measure('goi2imp'):
+        stats_df = goi2imp.impute_file(goi_path, imputation_dir, goi_frame(goi_df))
+    return user2raw_message, goi7_row, stats_df
+
+def run(config, script_dir, split=True, incremental=False, keep_intermediates=False, telemetry=None):
+    """Ejecuta el pipeline; cada fase y cada usuario quedan en `telemetry` (ver telemetry.py).
+
+    El registro de cada usuario incluye el de sus pasos 2, 3 y 4 en `substages`.
+    """
+    telemetry = telemetry or Telemetry()
+    profile_dir = config.get('profile_dir')
+    id_dir = config['id_dir']
+    raw_dir = config['raw_dir']
+    goiener_dir = config['goiener_dir']
+    imputation_dir = config['imputation_dir']
+    special_log_file = config['goi7_log']
+    log_csv = config['goi72imp_log']
+    manifest_path = config.get('simel_manifest', os.path.join(id_dir, '.simel_manifest.csv'))
+
+    num_workers = default_workers()
+    os.makedirs(id_dir, exist_ok=True)
+    os.makedirs(imputation_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(log_csv), exist_ok=True)
+    if keep_intermediates:
+        os.makedirs(raw_dir, exist_ok=True)
+    if keep_intermediates or incremental:
+        os.makedirs(goiener_dir, exist_ok=True)
+
+    # Pasos 2-4 por usuario; el paso 3 registra en el log raíz, como 3_raw2goi.py
+    id2raw_log = file_logger('user2raw', os.path.join(script_dir, config['id2raw_log']))
+    raw2goi.setup_logging(config['raw2goiener_log'])
+
+    # Paso 1: reparto de los ficheros SIMEL por usuario
+    if split or incremental:
+        simel2id_log = file_logger('simel2user', os.path.join(script_dir, config['simel2id_log']), logging.DEBUG)
+        simel_files = sorted(f for f in glob(os.path.join(config['simel_dir'], '*'))
+                             if simel2user.SIMEL_PATTERN.match(os.path.basename(f)))
+        print(f"Se encontraron {len(simel_files)} archivos SIMEL que cumplen el patrón.")
+
+        manifest = load_manifest(manifest_path) if incremental else None
+        if incremental and manifest is None and glob(os.path.join(id_dir, '*.csv')):
+            print(f"No existe el manifiesto {manifest_path} y {id_dir} no está vacío; "
+                  "ejecuta antes el pipeline completo.")
+            return
+        entries, new, changed = scan_simel_files(simel_files, manifest or {})
+        # Ficheros que se conservan en el manifiesto aunque ya no estén en simel_dir
+        entries = {**(manifest or {}), **entries}
+        print(f"Ficheros SIMEL nuevos: {len(new)}, modificados: {len(changed)}")
+
+        removed = {}
+        if changed:
+            # Quitar de los ficheros de usuario las líneas de la versión anterior, buscándolas
+            # solo en los ficheros a los que se añadió (en todos si el manifiesto no lo indica)
+            changed_names = {os.path.basename(f) for f in changed}
+            old_ids = [manifest[name][3] for name in changed_names]
+            if any(ids is None for ids in old_ids):
+                id_files = glob(os.path.join(id_dir, '*.csv'))
+            else:
+                id_files = sorted({os.path.join(id_dir, f"{name}.csv") for ids in old_ids for name in ids})
+                id_files = [f for f in id_files if os.path.exists(f)]
+            with telemetry.stage('fused.strip') as stage:
+                for task in run_tasks(strip_deliveries, [(f, changed_names) for f in id_files],
+                                      num_workers=num_workers, profile_dir=profile_dir):
+                    record_tasks(telemetry, stage, [task])
+                    if task.error is not None:
+                        raise task.error
+                    if task.result:
+                        removed[task.task[0]] = task.result
+
+        messages, touched = simel2user.split_by_id(new + changed, id_dir, num_workers,
+                                                   telemetry=telemetry, profile_dir=profile_dir)
+        for message in messages:
+            simel2id_log.info(message)
+        # Los ficheros que fallan se quitan del manifiesto para repartirlos en la siguiente ejecución
+        for file_path in new + changed:
+            name = os.path.basename(file_path)
+            if name in touched:
+                entries[name] = entries[name][:3] + (touched[name],)
+            else:
+                entries.pop(name, None)
+        write_manifest(manifest_path, entries)
+
+    if incremental:
+        affected = {os.path.join(id_dir, f"{name}.csv") for names in touched.values() for name in names}
+        id_files = sorted(affected | set(removed))
+        simel_names = set(touched)
+    else:
+        id_files = glob(os.path.join(id_dir, '*.csv'))
+    if not id_files:
+        logging.warning("No se encontraron archivos para procesar.")
+        return
+
+    with open(special_log_file, 'a') as spec_log:
+        if os.stat(special_log_file).st_size == 0:
+            spec_log.write("fname,max_entries,rows,unique,p5d_wins,p5d_mean,f5d_wins,f5d_min,f5d_mean,"
+                           "p1d_wins,p1d_min,p1d_mean,a5d_wins,a5d_mean,equal_in,skipped\n")
+        if incremental:
+            func, tasks = update_user, [(file, simel_names, removed.get(file, []), raw_dir, goiener_dir,
+                                         imputation_dir) for file in id_files]
+        else:
+            func, tasks = process_user, [(file, raw_dir, goiener_dir, imputation_dir, keep_intermediates)
+                                         for file in id_files]
+        results, stats_list = [], []
+        with telemetry.stage('fused.incremental' if incremental else 'fused') as stage:
+            for task in run_tasks(func, tasks, num_workers=num_workers,
+                                  initializer=raw2goi.setup_logging, initargs=(config['raw2goiener_log'],),
+                                  profile_dir=profile_dir):
+                results.append(task)
+                record_tasks(telemetry, stage, [task])
+                if task.error is not None:
+                    logging.error("Error al procesar {}: {}".format(task.task[0], task.error))
+                    continue
+                user2raw_message, goi7_row, stats_df = task.result
+                id2raw_log.info(user2raw_message)
+                print(user2raw_message)
+                # Escribir sólo si el resultado es válido (max_entries distinto de None)
+                if goi7_row is not None and goi7_row[1] is not None:
+                    spec_log.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(*goi7_row))
+                    spec_log.flush()
+                    os.fsync(spec_log.fileno())
+                if stats_df is not None:
+                    stats_df.to_csv(log_csv, mode='a', header=not os.path.exists(log_csv), index=False)
+                    stats_list.append(stats_df)
+    id2raw_log.info(timing_summary(results))
+
+    # Estadísticas de imputación, como 4_goi2imp.py; en modo incremental, las de todos
+    # los usuarios y no solo las de los actualizados
+    if incremental:
+        stats_df = latest_stats(log_csv)
+    else:
+        stats_df = pd.concat(stats_list, ignore_index=True) if stats_list else pd.DataFrame([])
+    stats_df.to_csv(config['imputed_log'], index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pipeline SIMEL con los pasos 2-4 fusionados')
+    parser.add_argument('--config', help='Fichero de configuración (por defecto, config.json junto al script)')
+    parser.add_argument('--skip-split', action='store_true',
+                        help='No ejecutar el paso 1; usar los ficheros de usuario existentes en id_dir')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Procesar solo los ficheros SIMEL nuevos o modificados según el manifiesto')
+    parser.add_argument('--keep-intermediates', action='store_true',
+                        help='Guardar también los ficheros de raw_dir y goiener_dir')
+    args = parser.parse_args()
+
+    # Cargar configuración
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    config = load_config(args.config or os.path.join(script_dir, 'config.json'))
+    with open_telemetry(config, script_dir) as telemetry:
+        run(config, script_dir, split=not args.skip_split, incremental=args.incremental,
+            keep_intermediates=args.keep_intermediates, telemetry=telemetry)
+
+if __name__ == "__main__":
+    main()
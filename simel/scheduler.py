@@ -0,0 +1,141 @@
+# -----------------------------------------------------------------------------------
+# Script Name: scheduler.py
+# -----------------------------------------------------------------------------------
+
+# Planificador común de los pasos del pipeline SIMEL. Reparte tareas (una por fichero)
+# entre procesos con cuatro reglas:
+#   - las tareas más grandes se envían primero, para que un fichero enorme no quede
+#     para el final y alargue la ejecución;
+#   - las tareas pequeñas se agrupan en lotes, y cada lote es un solo envío al proceso
+#     (menos coste de comunicación con decenas de miles de ficheros de usuario);
+#   - solo hay un número acotado de lotes en vuelo, y los resultados se devuelven a
+#     medida que terminan, para escribir los logs desde el proceso principal;
+#   - cada tarea se mide (tiempo, CPU, memoria y los recuentos que registre con
+#     `count`, ver telemetry.py en la raíz del repositorio) y la medida vuelve con
+#     su resultado.
+
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# telemetry.py está en la raíz del repositorio, compartido con pipeline.py. Los pasos
+# importan este módulo antes que nada del proyecto, así que basta con añadir aquí la raíz
+# a sys.path. Se reexporta para los pasos.
+if os.path.dirname(os.path.dirname(os.path.abspath(__file__))) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telemetry import Telemetry, count, measure
+
+# Resultado de una tarea: sus argumentos, lo que devuelve la función (None si falla),
+# la excepción (None si no falla), los segundos que ha tardado en el proceso y su
+# registro de telemetría (wall_s, cpu_s, peak_rss_mb, bytes_in y los recuentos)
+TaskResult = namedtuple('TaskResult', ['task', 'result', 'error', 'seconds', 'metrics'])
+
+def default_workers():
+    return max(1, os.cpu_count() - 1)  # Evita que el número de workers sea 0
+
+def make_batches(tasks, sizes, batch_bytes=8 << 20, batch_tasks=64):
+    """Pares (tarea, tamaño) ordenados de mayor a menor tamaño y agrupados en lotes.
+
+    Las tareas de `batch_bytes` o más van solas; las demás se juntan hasta sumar
+    `batch_bytes` o `batch_tasks` tareas.
+    """
+    order = sorted(range(len(tasks)), key=lambda i: sizes[i], reverse=True)
+    batches, batch, batch_size = [], [], 0
+    for i in order:
+        batch.append((tasks[i], sizes[i]))
+        batch_size += sizes[i]
+        if batch_size >= batch_bytes or len(batch) >= batch_tasks:
+            batches.append(batch)
+            batch, batch_size = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+def run_batch(func, batch, profile_dir=None):
+    """Ejecuta un lote en un proceso; los errores de una tarea no paran las demás.
+
+    Con `profile_dir`, cada lote se perfila con cProfile en un fichero propio.
+    """
+    profile = None
+    if profile_dir:
+        first = os.path.basename(str(batch[0][0][0]))
+        profile = os.path.join(profile_dir, f"{func.__name__}-{os.getpid()}-{first}.prof")
+    results = []
+    with measure(profile=profile):
+        for task, size in batch:
+            with measure(bytes_in=size) as metrics:
+                try:
+                    result, error = func(*task), None
+                except Exception as e:
+                    result, error = None, e
+            results.append(TaskResult(task, result, error, metrics['wall_s'], metrics))
+    return results
+
+def task_size(task):
+    """Tamaño de una tarea: el del fichero de su primer argumento (0 si no existe)."""
+    try:
+        return os.path.getsize(task[0])
+    except (OSError, TypeError):
+        return 0
+
+def run_tasks(func, tasks, sizes=None, num_workers=None, max_in_flight=None,
+              batch_bytes=8 << 20, batch_tasks=64, initializer=None, initargs=(), profile_dir=None):
+    """Ejecuta `func(*task)` para cada tupla de `tasks` y devuelve los TaskResult según terminan.
+
+    `sizes` da el tamaño de cada tarea (por defecto, el del fichero de su primer
+    argumento). Como mucho hay `max_in_flight` lotes enviados a la vez (por defecto,
+    dos por proceso). Con `profile_dir` se perfila cada lote (ver run_batch).
+    """
+    tasks = list(tasks)
+    if not tasks:
+        return
+    if sizes is None:
+        sizes = [task_size(task) for task in tasks]
+    num_workers = num_workers or default_workers()
+    max_in_flight = max_in_flight or 2 * num_workers
+    batches = iter(make_batches(tasks, sizes, batch_bytes, batch_tasks))
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=initializer, initargs=initargs) as executor:
+        in_flight = {}
+        for batch in batches:
+            in_flight[executor.submit(run_batch, func, batch, profile_dir)] = batch
+            if len(in_flight) >= max_in_flight:
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # El proceso ha fallado (p. ej. sin memoria): todo el lote queda con error
+                    results = [TaskResult(task, None, e, 0.0, {'bytes_in': size}) for task, size in batch]
+                yield from results
+                for next_batch in batches:
+                    in_flight[executor.submit(run_batch, func, next_batch, profile_dir)] = next_batch
+                    break
+
+def timing_summary(results, top=5):
+    """Resumen de tiempos: número de tareas, tiempo total y las `top` más lentas."""
+    if not results:
+        return "0 tasks"
+    slowest = sorted(results, key=lambda r: r.seconds, reverse=True)[:top]
+    total = sum(r.seconds for r in results)
+    return (f"{len(results)} tasks, {total:.1f}s of task time; slowest: "
+            + ", ".join(f"{os.path.basename(str(r.task[0]))} ({r.seconds:.2f}s)" for r in slowest))
+
+def open_telemetry(config, script_dir):
+    """Telemetry del fichero `telemetry_log` de la configuración (por defecto, junto al script).
+
+    El perfilado (`profile_dir` en la configuración) se hace por lote en los procesos
+    (ver run_batch), no en el proceso principal, que solo reparte tareas: un perfilador
+    activo al crear los procesos se heredaría y no dejaría activar el suyo.
+    """
+    path = config.get('telemetry_log', os.path.join(script_dir, 'telemetry.jsonl'))
+    return Telemetry(path)
+
+def record_tasks(telemetry, stage, results):
+    """Escribe el registro de cada tarea de `results` y lo suma al del paso `stage`."""
+    for r in results:
+        telemetry.task(stage, os.path.basename(str(r.task[0])), r.metrics, r.error)
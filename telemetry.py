@@ -0,0 +1,286 @@
+"""telemetry.py
+
+Structured performance telemetry for the pipeline stages and the SIMEL scripts.
+
+Each measurement records wall time, CPU time (of the process and of the worker
+processes it has waited for), peak resident memory during the measurement (of
+the process, and separately of the worker processes it has waited for) and
+whatever row and byte counts the measured code reports. Records are written as
+JSON lines, one object per stage or per file, by a `Telemetry` writer in the
+parent process; workers only measure (`measure`) and hand their records back
+with the task result, so the log is never appended to from several processes.
+
+Code anywhere under a measurement adds counts with `count(rows_in=...)` and
+lazy Polars queries with `capture_plan(name, lf)`. Both are no-ops when nothing
+is being measured, so library functions can call them unconditionally.
+
+Typical usage:
+    with Telemetry('data/.stages/telemetry.jsonl') as tel:
+        with tel.stage('filter_window', bytes_in=size):
+            ...
+"""
+
+import cProfile
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Open measurements of this process, innermost last
+_active = []
+
+# Whether capture_plan stores query plans; set by Telemetry(plans=True)
+_capture_plans = False
+
+# Numeric task fields are summed into their stage record, except these, which keep the maximum
+_MAX_FIELDS = {'peak_rss_mb', 'children_peak_rss_mb'}
+
+# Whether /proc/self/clear_refs can reset the peak RSS (VmHWM) of this process; None until tried
+_can_reset_peak = None
+
+
+def _peak_kb():
+    """Peak RSS (VmHWM) of this process in kB since its last reset, or None if it cannot be read."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak():
+    """Reset VmHWM to the current RSS and return its value before the reset (kB), or None."""
+    global _can_reset_peak
+    if _can_reset_peak is False:
+        return None
+    peak = _peak_kb()
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        _can_reset_peak = peak is not None
+    except OSError:
+        _can_reset_peak = False
+    return peak if _can_reset_peak else None
+
+
+def _maxrss_kb(children=False):
+    """ru_maxrss of this process (or of its largest waited-for child) in kB, or None."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return maxrss / 2 ** 10 if sys.platform == 'darwin' else maxrss
+
+
+def _mb(kb):
+    return None if kb is None else round(kb / 2 ** 10, 1)
+
+
+def _grown_mb(start, end):
+    """`end` in MB if the high-water mark grew from `start` during a block (it is then the
+    block's peak), or None."""
+    return _mb(end) if start is not None and end > start else None
+
+
+def _cpu_seconds():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def count(**amounts):
+    """Add `amounts` (e.g. rows_in=..., bytes_out=...) to the innermost open measurement."""
+    if _active:
+        record = _active[-1]
+        for key, value in amounts.items():
+            record[key] = record.get(key, 0) + int(value)
+
+
+def capture_plan(name, lf):
+    """Store the optimized plan of lazy query `lf` in the innermost measurement.
+
+    Only when plan capture is enabled (``Telemetry(plans=True)``); the plan is
+    built without running the query.
+    """
+    if _capture_plans and _active:
+        _active[-1].setdefault('plans', {})[name] = lf.explain()
+
+
+@contextmanager
+def measure(name=None, profile=None, **fields):
+    """Measure the enclosed block and yield its record (a dict).
+
+    Parameters
+    ----------
+    name : str, optional
+        When given and the block runs under another measurement, the record is
+        also attached to the enclosing one as ``substages[name]``, so a task
+        that runs several steps reports each of them.
+    profile : str or Path, optional
+        Run the block under cProfile and dump the statistics to this file.
+    **fields
+        Initial fields of the record, e.g. the task's file name or bytes_in.
+
+    The record gets wall_s, cpu_s, peak_rss_mb and children_peak_rss_mb when the
+    block exits, also if it raises. ``peak_rss_mb`` is the peak RSS of this
+    process during the block: on Linux VmHWM is reset when a measurement starts,
+    after adding the peak so far to the open measurements around it; elsewhere
+    it is ``ru_maxrss`` if that grew during the block, and None if it did not.
+    ``children_peak_rss_mb`` is ``ru_maxrss`` of the waited-for child processes
+    if it grew during the block, i.e. the peak of a child that ended during it
+    (None otherwise); the peak of every worker task is in its own record.
+    """
+    record = dict(fields)
+    parent = _active[-1] if _active else None
+    profiler = cProfile.Profile() if profile else None
+    # The peak so far belongs to the open measurements; this one starts from the current RSS
+    peak = _reset_peak()
+    if peak is not None:
+        for outer in _active:
+            outer['_peak_kb'] = max(outer['_peak_kb'], peak)
+    record['_peak_kb'] = 0
+    self_start, children_start = _maxrss_kb(), _maxrss_kb(children=True)
+    _active.append(record)
+    wall, cpu = time.perf_counter(), _cpu_seconds()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+            Path(profile).parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(profile))
+        record['wall_s'] = round(time.perf_counter() - wall, 6)
+        record['cpu_s'] = round(_cpu_seconds() - cpu, 6)
+        if _can_reset_peak:
+            record['peak_rss_mb'] = _mb(max(record['_peak_kb'], _peak_kb() or 0))
+        else:
+            record['peak_rss_mb'] = _grown_mb(self_start, _maxrss_kb())
+        record['children_peak_rss_mb'] = _grown_mb(children_start, _maxrss_kb(children=True))
+        del record['_peak_kb']
+        _active.pop()
+        if name is not None and parent is not None:
+            parent.setdefault('substages', {})[name] = record
+
+
+def _merge(total, record):
+    """Add the numeric fields of `record` to `total` (maximum for peak fields), recursing into substages."""
+    for key, value in record.items():
+        if key == 'substages':
+            for name, sub in value.items():
+                _merge(total.setdefault('substages', {}).setdefault(name, {}), sub)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if key in _MAX_FIELDS:
+                total[key] = max(total.get(key) or 0, value)
+            else:
+                total[key] = round(total.get(key, 0) + value, 6)
+
+
+class Telemetry:
+    """JSON-lines writer of stage and task records.
+
+    Parameters
+    ----------
+    path : str or Path, optional
+        Log file, appended to. None measures without writing anything.
+    profile_dir : str or Path, optional
+        Profile every stage with cProfile into ``<profile_dir>/<stage>.prof``.
+    plans : bool
+        Capture the plans of the lazy Polars queries passed to `capture_plan`.
+    """
+
+    def __init__(self, path=None, profile_dir=None, plans=False):
+        global _capture_plans
+        self.path = Path(path) if path else None
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.run = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%fZ')
+        _capture_plans = plans
+        self._file = None
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, 'a', buffering=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        global _capture_plans
+        _capture_plans = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def emit(self, event, **fields):
+        """Write one record: the event type, run id, UTC time and `fields`."""
+        if self._file is None:
+            return
+        record = {'event': event, 'run': self.run, 'time': datetime.now(timezone.utc).isoformat(), **fields}
+        self._file.write(json.dumps(record, default=str) + '\n')
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Measure a stage and write its record when it ends.
+
+        Yields the stage record. Task records passed to `task` are written and
+        summed into it; the stage record also gets `files` (the number of task
+        records), `files_per_s` and `mb_per_s` (input bytes of the stage, or else
+        of its tasks, over wall time) and, if the stage raises, `error`.
+        """
+        profile = self.profile_dir / f'{name}.prof' if self.profile_dir else None
+        record = None
+        try:
+            with measure(profile=profile, _stage=name, _tasks={}, **fields) as record:
+                yield record
+        except BaseException as e:
+            record['error'] = repr(e)
+            raise
+        finally:
+            del record['_stage']
+            tasks = record.pop('_tasks')
+            if tasks:
+                record['files'] = tasks.pop('files')
+                record['tasks'] = tasks
+            wall = record.get('wall_s') or float('nan')
+            if 'files' in record:
+                record['files_per_s'] = round(record['files'] / wall, 3)
+            bytes_in = record.get('bytes_in') or record.get('tasks', {}).get('bytes_in')
+            if bytes_in:
+                record['mb_per_s'] = round(bytes_in / 2 ** 20 / wall, 3)
+            self.emit('stage', stage=name, **record)
+
+    def task(self, stage, file, metrics, error=None):
+        """Write the record of one task (usually one file) of `stage` and sum it into the stage.
+
+        Parameters
+        ----------
+        stage : dict
+            Record yielded by `stage`.
+        file : str
+            Name of the file (or other unit) the task processed.
+        metrics : dict
+            Task record from `measure`, as returned by the worker.
+        error : Exception, optional
+            Error of a failed task.
+        """
+        metrics = metrics or {}
+        tasks = stage['_tasks']
+        tasks['files'] = tasks.get('files', 0) + 1
+        if error is not None:
+            tasks['errors'] = tasks.get('errors', 0) + 1
+        _merge(tasks, metrics)
+        self.emit('task', stage=stage['_stage'], file=file, **metrics,
+                  **({'error': repr(error)} if error is not None else {}))
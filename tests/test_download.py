@@ -0,0 +1,121 @@
+"""download() against a local HTTP server, with and without Range support."""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from download import download
+
+CONTENT = bytes(range(256)) * 40  # 10,240 bytes
+SEGMENT = 1000                    # 11 segments, the last one short
+ETAG = '"v1"'
+
+
+def sha256(data):
+    return f'sha256:{hashlib.sha256(data).hexdigest()}'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    ranges = True     # set per server class
+    requests = None   # Range headers received, per server class
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        self.requests.append(header)
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)', header or '')
+        if self.ranges and match:
+            start, end = int(match[1]), min(int(match[2]), len(CONTENT) - 1)
+            body = CONTENT[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(CONTENT)}')
+        else:
+            body = CONTENT
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(request):
+    """Base URL of a local server; parametrize with False for one that ignores Range."""
+    handler = type('Handler', (Handler,), {'ranges': getattr(request, 'param', True), 'requests': []})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}', handler.requests
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_segmented_download(tmp_path, server):
+    base, requests = server
+    path = download(f'{base}/data.bin', str(tmp_path), checksum=sha256(CONTENT), segment_size=SEGMENT,
+                    max_workers=3, max_pending=4)
+    assert open(path, 'rb').read() == CONTENT
+    # The probe plus one request per segment
+    assert len(requests) == 1 + 11
+    assert sorted(os.listdir(tmp_path)) == ['data.bin']
+
+
+def test_resumes_from_the_state_file(tmp_path, server):
+    base, requests = server
+    url = f'{base}/data.bin'
+    # An interrupted run left segments 0, 1 and 5 on disk
+    part = bytearray(len(CONTENT))
+    for index in (0, 1, 5):
+        part[index * SEGMENT:(index + 1) * SEGMENT] = CONTENT[index * SEGMENT:(index + 1) * SEGMENT]
+    (tmp_path / 'data.bin.part').write_bytes(bytes(part))
+    (tmp_path / 'data.bin.part.json').write_text(json.dumps(
+        {'url': url, 'size': len(CONTENT), 'segment_size': SEGMENT, 'validator': ETAG, 'done': [0, 1, 5]}))
+
+    path = download(url, str(tmp_path), checksum=sha256(CONTENT), segment_size=SEGMENT)
+    assert open(path, 'rb').read() == CONTENT
+    fetched = {int(r.split('=')[1].split('-')[0]) // SEGMENT for r in requests[1:]}
+    assert fetched == set(range(11)) - {0, 1, 5}
+    assert sorted(os.listdir(tmp_path)) == ['data.bin']
+
+
+@pytest.mark.parametrize('server', [False], indirect=True)
+def test_falls_back_to_a_single_stream_without_range_support(tmp_path, server):
+    base, requests = server
+    path = download(f'{base}/data.bin', str(tmp_path), checksum=sha256(CONTENT), segment_size=SEGMENT)
+    assert open(path, 'rb').read() == CONTENT
+    assert len(requests) == 2  # the probe and one full GET
+    assert requests[1] is None
+
+
+@pytest.mark.parametrize('server', [True, False], indirect=True)
+def test_checksum_mismatch_raises_and_cleans_up(tmp_path, server):
+    base, _ = server
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        download(f'{base}/data.bin', str(tmp_path), checksum=sha256(b'other'), segment_size=SEGMENT)
+    assert os.listdir(tmp_path) == []
+
+
+def test_existing_file_is_kept_if_it_matches_the_checksum(tmp_path, server):
+    base, requests = server
+    (tmp_path / 'data.bin').write_bytes(CONTENT)
+    path = download(f'{base}/data.bin', str(tmp_path), checksum=sha256(CONTENT), segment_size=SEGMENT)
+    assert open(path, 'rb').read() == CONTENT
+    assert requests == []
+
+
+def test_existing_file_is_downloaded_again_if_it_does_not_match(tmp_path, server):
+    base, requests = server
+    # A truncated earlier download
+    (tmp_path / 'data.bin').write_bytes(CONTENT[:SEGMENT])
+    path = download(f'{base}/data.bin', str(tmp_path), checksum=sha256(CONTENT), segment_size=SEGMENT)
+    assert open(path, 'rb').read() == CONTENT
+    assert len(requests) == 1 + 11
+    assert sorted(os.listdir(tmp_path)) == ['data.bin']
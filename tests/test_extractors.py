@@ -0,0 +1,72 @@
+"""Path-traversal checks of Extractor on small .tar.zst archives."""
+
+import io
+import tarfile
+
+import pytest
+import zstandard
+
+from extractors import Extractor
+
+
+def write_archive(path, members, mtime=0):
+    """Write a .tar.zst with `members`: (name, bytes) for files, (name, None) for a symlink to /etc.
+
+    Member i is dated `mtime` + i days.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for i, (name, data) in enumerate(members):
+            info = tarfile.TarInfo(name)
+            info.mtime = mtime + i * 86400
+            if data is None:
+                info.type, info.linkname = tarfile.SYMTYPE, '/etc'
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    path.write_bytes(zstandard.ZstdCompressor().compress(buffer.getvalue()))
+    return path
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_extracts_regular_members(tmp_path, stream):
+    archive = write_archive(tmp_path / 'ok.tar.zst', [('goi/a.csv', b'index,kWh\n')])
+    Extractor(str(archive), str(tmp_path / 'out')).decompress_tzst(stream=stream)
+    assert (tmp_path / 'out' / 'goi' / 'a.csv').read_bytes() == b'index,kWh\n'
+    assert sorted(p.name for p in (tmp_path / 'out').iterdir()) == ['goi']
+
+
+@pytest.mark.parametrize('stream', [True, False])
+@pytest.mark.parametrize('member', [('../evil.csv', b'x'), ('goi/../../evil.csv', b'x'),
+                                    ('/tmp/evil.csv', b'x'), ('goi/link', None)])
+def test_rejects_members_leaving_the_destination(tmp_path, stream, member):
+    archive = write_archive(tmp_path / 'bad.tar.zst', [member])
+    with pytest.raises(ValueError, match='Unsafe path'):
+        Extractor(str(archive), str(tmp_path / 'out')).decompress_tzst(stream=stream)
+    assert not (tmp_path / 'evil.csv').exists()
+    assert not (tmp_path / 'out' / 'goi' / 'link').exists()
+
+
+def test_extract_households_rejects_unsafe_index_entries(tmp_path):
+    archive = write_archive(tmp_path / 'a.tar.zst', [('goi/a.csv', b'x')])
+    index = tmp_path / 'index.csv'
+    index.write_text("name,id,offset,size,mtime\n../evil.csv,a,512,1,0\n")
+    with pytest.raises(ValueError, match='Unsafe path'):
+        Extractor(str(archive), str(tmp_path / 'out')).extract_households(['a'], index_path=index)
+    assert not (tmp_path / 'evil.csv').exists()
+
+
+def test_extract_households_keeps_each_member_mtime(tmp_path):
+    start = 1_600_000_000
+    archive = write_archive(tmp_path / 'a.tar.zst', [('goi/a.csv', b'x'), ('goi/b.csv', b'y'), ('goi/c.csv', b'z')],
+                            mtime=start)
+    index = tmp_path / 'index.csv'
+    # An index written before member mtimes were recorded is rebuilt
+    index.write_text("name,id,offset,size\ngoi/a.csv,a,512,1\n")
+
+    missing = Extractor(str(archive), str(tmp_path / 'out')).extract_households(['a', 'c', 'd'], index_path=index)
+
+    assert missing == ['d']
+    assert [(tmp_path / 'out' / 'goi' / f'{h}.csv').stat().st_mtime for h in 'ac'] == [start, start + 2 * 86400]
+    assert not (tmp_path / 'out' / 'goi' / 'b.csv').exists()
@@ -0,0 +1,43 @@
+"""Summer-time flag and week-lag imputation of simel/4_goi2imp.py."""
+
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+goi2imp = importlib.import_module('4_goi2imp')
+
+
+@pytest.mark.parametrize('day', ['2021-03-28', '2021-10-31', '2022-03-27', '2022-10-30'])
+def test_dst_flags_match_check_dst_on_transition_days(day):
+    # The transition day with the days around it, in the naive UTC hours of the consumption series
+    hours = pd.date_range(pd.Timestamp(day) - pd.Timedelta(days=1), periods=72, freq='h')
+
+    flags = np.asarray(goi2imp.dst_flags(hours))
+
+    assert flags.tolist() == [goi2imp.check_dst(t) for t in hours]
+    assert flags[0] != flags[-1]
+
+
+def test_impute_kwh_takes_the_nearest_values_of_the_same_hour_of_the_week():
+    week = goi2imp.WEEK_HOURS
+    kwh = pd.Series(np.round(np.random.default_rng(0).random(4 * week) * 2, 3))
+    # Hour 2: both neighbours; hour 5: future only, two weeks in a row; hour 64: past only;
+    # hour 20: no value in any week; hour 50: the nearest valid values skip a missing week
+    gaps = [2 + week, 5, 5 + week, 64 + 3 * week, 20, 20 + week, 20 + 2 * week, 20 + 3 * week,
+            50 + week, 50 + 2 * week]
+    series = kwh.copy()
+    series[gaps] = np.nan
+
+    imputed = goi2imp.impute_kwh(series)
+
+    mean = np.round(series.mean(), 3)
+    expected = kwh.copy()
+    expected[2 + week] = np.round((kwh[2] + kwh[2 + 2 * week]) / 2, 3)
+    expected[[5, 5 + week]] = kwh[5 + 2 * week]
+    expected[64 + 3 * week] = kwh[64 + 2 * week]
+    expected[[20, 20 + week, 20 + 2 * week, 20 + 3 * week]] = mean
+    expected[[50 + week, 50 + 2 * week]] = np.round((kwh[50] + kwh[50 + 3 * week]) / 2, 3)
+    pd.testing.assert_series_equal(imputed, expected)
+    assert series[gaps].isna().all()
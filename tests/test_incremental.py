@@ -0,0 +1,109 @@
+"""Incremental runs of simel/run_fused.py give the same imputed files as a full rebuild."""
+
+import filecmp
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+RUN_FUSED = Path(__file__).resolve().parents[1] / 'simel' / 'run_fused.py'
+CUPS = [f'ES{i:016d}XX0F' for i in range(3)]
+# Columns of each SIMEL type: width, date, flag, in, DCM (before the columns added by step 1)
+LAYOUT = {'F5D': (11, 1, 2, 3, 9), 'P1D': (22, 2, 3, 4, 20)}
+
+
+def write_simel_file(simel_dir, file_type, day, seed, cups, missing):
+    """Daily SIMEL file with the local hours of `day` (23 or 25 on DST changes), a `missing` fraction left out."""
+    rng = np.random.default_rng(seed)
+    width, dt_col, fl_col, in_col, dcm_col = LAYOUT[file_type]
+    start = pd.Timestamp(day, tz='Europe/Madrid')
+    local = pd.date_range(start, start + pd.Timedelta(days=1), freq='h', inclusive='left')
+    rows = pd.DataFrame({'cups': np.repeat(cups, len(local)), 'local': np.tile(local, len(cups))})
+    rows = rows[rng.random(len(rows)) >= missing]
+    columns = {j: 0 for j in range(width)}
+    columns[0] = rows['cups'].to_numpy()
+    columns[dt_col] = rows['local'].dt.strftime('%Y/%m/%d %H:%M' + (':00' if file_type == 'P1D' else '')).to_numpy()
+    columns[fl_col] = rows['local'].map(lambda t: int(bool(t.dst()))).to_numpy()
+    # P1D values are kWh and stay integers; F5D values are Wh
+    columns[in_col] = rng.integers(0, 3 if file_type == 'P1D' else 3000, len(rows))
+    columns[dcm_col] = rng.integers(0, 4, len(rows))
+    if file_type == 'P1D':
+        columns[1] = 'R'
+    path = simel_dir / f'{file_type}_0021_{pd.Timestamp(day):%Y%m%d}.0'
+    pd.DataFrame(columns).to_csv(path, sep=';', header=False, index=False)
+
+
+def files(types, days, cups=CUPS, missing=0.1):
+    return [(file_type, day, cups, missing) for day in days for file_type in types]
+
+
+def make_tree(root):
+    config = {name: str(root / name) for name in ('simel_dir', 'id_dir', 'raw_dir', 'goiener_dir', 'imputation_dir')}
+    logs = {'simel2id_log': 'simel2id.log', 'id2raw_log': 'id2raw.log', 'raw2goiener_log': 'raw2goi.log',
+            'goi7_log': 'goi7.csv', 'goi72imp_log': 'goi72imp.csv', 'imputed_log': 'imputed.csv',
+            'telemetry_log': 'telemetry.jsonl'}
+    config.update({key: str(root / 'logs' / name) for key, name in logs.items()})
+    (root / 'logs').mkdir(parents=True)
+    (root / 'simel_dir').mkdir()
+    (root / 'config.json').write_text(json.dumps(config))
+    return root / 'config.json'
+
+
+def run_fused(config_path, *flags):
+    subprocess.run([sys.executable, str(RUN_FUSED), '--config', str(config_path), *flags],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+DAYS = pd.date_range('2022-02-01', '2022-02-20').strftime('%Y-%m-%d')
+SPRING = pd.date_range('2022-03-20', '2022-04-05').strftime('%Y-%m-%d')
+AUTUMN = pd.date_range('2022-10-20', '2022-11-05').strftime('%Y-%m-%d')
+KEEP = ['--keep-intermediates']
+
+# (files of the first run, files delivered before the incremental run, flags of the first run)
+SCENARIOS = {
+    # The third user is not in the new day and is left untouched
+    'new day': (files(LAYOUT, DAYS), files(LAYOUT, ['2022-02-21'], CUPS[:2]), KEEP),
+    'redelivered file': (files(LAYOUT, DAYS), files(['F5D'], ['2022-02-10']), KEEP),
+    'spring DST change': (files(LAYOUT, SPRING), files(['F5D'], ['2022-03-27']) + files(['P1D'], ['2022-03-28']), KEEP),
+    'autumn DST change': (files(LAYOUT, AUTUMN), files(['F5D'], ['2022-10-30']) + files(['P1D'], ['2022-11-06']), KEEP),
+    # Without gaps nothing is imputed with a mean and P1D values keep kWh an integer column
+    'integer kWh': (files(['P1D'], DAYS, missing=0), files(['P1D'], ['2022-02-10', '2022-02-21'], missing=0), KEEP),
+    # The only decimal values of two users are redelivered away: their full rebuild has integer kWh
+    'integer kWh after redelivery': (files(['P1D'], DAYS, missing=0) + files(['F5D'], ['2022-02-10'], missing=0),
+                                     files(['F5D'], ['2022-02-10'], CUPS[:1], missing=0), KEEP),
+    'no goiener series': (files(LAYOUT, DAYS), files(['F5D'], ['2022-02-10', '2022-02-21']), []),
+}
+
+
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_incremental_run_matches_full_rebuild(tmp_path, scenario):
+    initial, delta, flags = SCENARIOS[scenario]
+    delta_config, full_config = make_tree(tmp_path / 'delta'), make_tree(tmp_path / 'full')
+    simel_dir = tmp_path / 'delta' / 'simel_dir'
+
+    for seed, (file_type, day, cups, missing) in enumerate(initial):
+        write_simel_file(simel_dir, file_type, day, seed, cups, missing)
+    run_fused(delta_config, *flags)
+    for seed, (file_type, day, cups, missing) in enumerate(delta, start=len(initial)):
+        write_simel_file(simel_dir, file_type, day, seed, cups, missing)
+    run_fused(delta_config, '--incremental')
+
+    for path in simel_dir.iterdir():
+        (tmp_path / 'full' / 'simel_dir' / path.name).write_bytes(path.read_bytes())
+    run_fused(full_config)
+
+    names = sorted(p.name for p in (tmp_path / 'full' / 'imputation_dir').iterdir())
+    assert len(names) == len(CUPS)
+    assert sorted(p.name for p in (tmp_path / 'delta' / 'imputation_dir').iterdir()) == names
+    _, mismatch, errors = filecmp.cmpfiles(tmp_path / 'full' / 'imputation_dir', tmp_path / 'delta' / 'imputation_dir',
+                                           names, shallow=False)
+    assert mismatch + errors == []
+
+    # Statistics of every user, not only of the ones the incremental run touched
+    stats = [pd.read_csv(root / 'logs' / 'imputed.csv').drop(columns='dt').sort_values('fname', ignore_index=True)
+             for root in (tmp_path / 'full', tmp_path / 'delta')]
+    pd.testing.assert_frame_equal(*stats)
@@ -0,0 +1,47 @@
+"""Cache keys of the stage runner."""
+
+import importlib
+
+import pipeline
+import preprocessing
+
+
+def write_stage_modules(root):
+    """A stage module whose function calls a helper in another module."""
+    (root / 'helper.py').write_text("def scale(x):\n    return 2 * x\n")
+    (root / 'stagemod.py').write_text(
+        "from helper import scale\n\n\n"
+        "def double(source, target):\n"
+        "    with open(target, 'w') as outfile:\n"
+        "        outfile.write(str(scale(int(open(source).read()))))\n")
+
+
+def test_editing_a_helper_module_reruns_the_stage(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(pipeline, 'ROOT', tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    write_stage_modules(tmp_path)
+    stagemod = importlib.import_module('stagemod')
+    (tmp_path / 'in.txt').write_text('21')
+    stages = [pipeline.Stage('double', stagemod.double, inputs={'source': tmp_path / 'in.txt'},
+                             outputs={'target': tmp_path / 'out.txt'})]
+
+    def ran():
+        pipeline.StageRunner(stages, {}, state_dir=tmp_path / 'state').run()
+        return '[double] running' in capsys.readouterr().out
+
+    assert ran()
+    assert (tmp_path / 'out.txt').read_text() == '42'
+    assert not ran()
+
+    (tmp_path / 'helper.py').write_text("def scale(x):\n    return 3 * x\n")
+    assert ran()
+    assert not ran()
+
+
+def test_post_covid_output_follows_the_ingest_mode():
+    for mode, suffix in [('csv', '.csv'), ('parquet', '.parquet')]:
+        stages = {s.name: s for s in pipeline.build_stages({**pipeline.PARAMS, 'ingest_mode': mode})}
+        output = stages['filter_window'].outputs['output_file']
+        assert output == preprocessing.post_covid_file(mode) and output.suffix == suffix
+        for name in ('index_readings', 'summarize_runs', 'join_metadata'):
+            assert stages[name].inputs['readings'] == output
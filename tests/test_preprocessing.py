@@ -0,0 +1,63 @@
+"""Predicate and projection pushdown of the filter_window query."""
+
+import io
+import re
+import tarfile
+from datetime import date
+
+import polars as pl
+import pytest
+import zstandard
+
+import preprocessing
+from csvmerger import CSVMerger
+from ingest import ParquetIngestor
+
+HOUSEHOLDS = ['a' * 64, 'b' * 64, 'c' * 64]
+READINGS = 'index,fl,kWh,imp\n2021-05-31 23:00:00,1,0.5,0\n2021-06-01 00:00:00,1,0.25,1\n2021-06-02 10:00:00,1,1.0,0\n'
+WINDOW = (date(2021, 6, 1), date(3023, 1, 1))
+
+
+@pytest.fixture
+def readings(tmp_path, request):
+    """Readings of three households as a merged CSV, a columnar merged file or an ingested dataset."""
+    if request.param == 'dataset':
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            for household in HOUSEHOLDS:
+                info = tarfile.TarInfo(f'imputed_goiener_v7/{household}.csv')
+                info.size = len(READINGS)
+                tar.addfile(info, io.BytesIO(READINGS.encode()))
+        archive = tmp_path / 'archive.tar.zst'
+        archive.write_bytes(zstandard.ZstdCompressor().compress(buffer.getvalue()))
+        ParquetIngestor(str(archive), str(tmp_path / 'household_kwh')).ingest()
+        return tmp_path / 'household_kwh'
+
+    files = []
+    for household in HOUSEHOLDS:
+        files.append(tmp_path / f'{household}.csv')
+        files[-1].write_text(READINGS)
+    output = tmp_path / f'household_kwh.{request.param}'
+    CSVMerger([str(f) for f in files], None, str(output)).combine_csv_files(schema_overrides={'kWh': pl.Float64})
+    return output
+
+
+def scan_nodes(plan):
+    """Text of each scan node of an `explain()` plan (the SCAN line and the lines under it)."""
+    return re.findall(r'\w+ SCAN \[.*?\]\n(?:\s*(?:PROJECT|SELECTION|ESTIMATED).*\n?)*', plan)
+
+
+@pytest.mark.parametrize('readings', ['csv', 'parquet', 'dataset'], indirect=True)
+def test_window_query_pushes_filters_and_projection_into_the_scan(readings):
+    query = preprocessing.window_query(readings, HOUSEHOLDS[:2], WINDOW)
+
+    readings_scan = scan_nodes(query.explain())[0]
+    assert 'PROJECT 3/' in readings_scan
+    selection = readings_scan[readings_scan.index('SELECTION'):]
+    assert 'is_between' in selection
+    assert re.search(r'col\("id(_code)?"\)\.is_in', selection)
+
+    result = query.collect().sort('id', 'timestamp')
+    assert result.columns == ['id', 'timestamp', 'kWh']
+    assert result['id'].to_list() == [HOUSEHOLDS[0]] * 2 + [HOUSEHOLDS[1]] * 2
+    assert result['kWh'].to_list() == [0.25, 1.0, 0.25, 1.0]
@@ -0,0 +1,85 @@
+"""Processing stages on a small cohort."""
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import polars as pl
+import pytest
+
+import processing
+
+WINDOW = (date(2021, 6, 1), date(2022, 6, 1))
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Post-COVID readings, a cohort listing household 'a' twice and an excluded household 'c'."""
+    start = datetime(2021, 5, 30)
+    hours = [start + timedelta(hours=h) for h in range(24 * 10)]
+    readings = pl.DataFrame({
+        'id': [household for household in 'abc' for _ in hours],
+        'timestamp': hours * 3,
+        'kWh': [float(h % 24) / 10 + i for i, _ in enumerate('abc') for h in range(len(hours))],
+    })
+    readings.write_csv(tmp_path / 'readings.csv')
+    cohort = pl.DataFrame({
+        'id': ['a', 'a', 'b', 'c'],
+        'start_date': [date(2019, 1, 1), date(2021, 1, 1), date(2019, 1, 1), date(2019, 1, 1)],
+        'end_date': [date(2020, 12, 31), date(2023, 1, 1), date(2023, 1, 1), date(2023, 1, 1)],
+        'cnae': '9820', 'postal_code': '20001', 'p1_kw': ['3.3', '4.6', '5.75', '3.3'], 'tarriff': '2.0TD',
+        'count_at_least_this_many_days': 400,
+    })
+    cohort.write_csv(tmp_path / 'cohort.csv')
+    pl.DataFrame({'id': ['c']}).write_csv(tmp_path / 'zero_runs.csv')
+    post_covid = readings.filter(pl.col('timestamp') >= datetime(2021, 6, 1), pl.col('id') != 'c')
+    return tmp_path, post_covid
+
+
+@pytest.fixture(params=['.csv', '.parquet'])
+def cohort_readings(tmp_path, request):
+    """Post-COVID readings of 30 households with zero days, near-zero hours and flat lines."""
+    rng = np.random.default_rng(0)
+    ids = [f'{i:02d}' + 'f' * 62 for i in range(30)]
+    hours = [datetime(2021, 5, 25) + timedelta(hours=h) for h in range(24 * 30)]
+    kwh = rng.gamma(2.0, 0.2, (len(ids), len(hours))).round(3)
+    for row in kwh:
+        day = int(rng.integers(0, 28))
+        row[day * 24:(day + int(rng.integers(1, 4))) * 24] = 0
+        flat = int(rng.integers(0, len(hours) - 12))
+        row[flat:flat + int(rng.integers(2, 12))] = 0.25
+    readings = pl.DataFrame({'id': np.repeat(ids, len(hours)), 'timestamp': hours * len(ids), 'kWh': kwh.ravel()})
+    path = tmp_path / f'readings{request.param}'
+    if request.param == '.csv':
+        readings.write_csv(path)
+    else:
+        readings.write_parquet(path)
+    pl.DataFrame({'id': ids, 'start_date': date(2019, 1, 1), 'end_date': date(2023, 1, 1), 'cnae': '9820',
+                  'postal_code': '20001', 'p1_kw': '3.3', 'tarriff': '2.0TD',
+                  'count_at_least_this_many_days': 400}).write_csv(tmp_path / 'cohort.csv')
+    return path, tmp_path / 'cohort.csv'
+
+
+def test_batched_run_length_summary_is_byte_identical(tmp_path, cohort_readings):
+    readings, cohort = cohort_readings
+    for batch_size in (None, 7):
+        processing.summarize_runs(readings, cohort, tmp_path / f'runs-{batch_size}.parquet', WINDOW,
+                                  (0.01, 0.05), (0.001,), batch_size)
+
+    assert pl.read_parquet(tmp_path / 'runs-None.parquet')['id'].n_unique() == 30
+    assert (tmp_path / 'runs-7.parquet').read_bytes() == (tmp_path / 'runs-None.parquet').read_bytes()
+    # The temporary batch files are removed
+    assert not list(tmp_path.glob('.batches-*'))
+
+
+def test_load_profile_features_counts_each_reading_once(inputs):
+    tmp_path, post_covid = inputs
+    processing.load_profile_features(tmp_path / 'readings.csv', tmp_path / 'cohort.csv', tmp_path / 'zero_runs.csv',
+                                     tmp_path / 'features.parquet', WINDOW)
+    features = pl.read_parquet(tmp_path / 'features.parquet')
+
+    totals = post_covid.group_by('id').agg(pl.len().alias('n_readings'), pl.col('kWh').sum()).sort('id')
+    assert features['id'].to_list() == ['a', 'b']
+    assert features['n_readings'].to_list() == totals['n_readings'].to_list()
+    assert features['kwh_summer'].to_list() == pytest.approx(totals['kWh'].to_list())
+    # Highest contracted power listed for the household
+    assert features['p1_kw'].to_list() == [4.6, 5.75]
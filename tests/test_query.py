@@ -0,0 +1,52 @@
+"""Household and time-range lookups of the query store."""
+
+from datetime import datetime
+
+import polars as pl
+import pytest
+
+from query import ReadingsQuery, build_query_store
+
+HOUSEHOLDS = ['a' * 64, 'b' * 64, 'c' * 64]
+
+
+@pytest.fixture
+def readings():
+    hours = pl.datetime_range(datetime(2022, 1, 1), datetime(2022, 3, 1), '1h', eager=True, closed='left')
+    return pl.concat([
+        pl.DataFrame({'id': household, 'timestamp': hours, 'kWh': pl.Series(range(len(hours)), dtype=pl.Float64) + i})
+        for i, household in enumerate(HOUSEHOLDS)
+    ]).sample(fraction=1.0, shuffle=True, seed=0)
+
+
+@pytest.fixture
+def store(tmp_path, readings):
+    build_query_store(readings.lazy(), tmp_path / 'store', rows_per_file=2000, row_group_size=100)
+    return ReadingsQuery(tmp_path / 'store')
+
+
+@pytest.mark.parametrize('ids', [HOUSEHOLDS[1:2], HOUSEHOLDS[:2], HOUSEHOLDS])
+def test_scan_pushes_id_and_time_predicates_into_the_parquet_scan(store, ids):
+    plan = store.scan(ids, start=datetime(2022, 2, 1), end=datetime(2022, 2, 8)).explain()
+    for scan in plan.split('Parquet SCAN')[1:]:
+        selection = scan[scan.index('SELECTION'):].split('\n')[0]
+        assert 'col("id").is_in' in selection and 'col("timestamp")' in selection
+    assert 'SLICE' not in plan and 'FILTER' not in plan
+
+
+@pytest.mark.parametrize('start, end', [(datetime(2022, 2, 1), datetime(2022, 2, 8)), (None, datetime(2022, 1, 2)),
+                                        (datetime(2022, 2, 28, 20), None), (None, None),
+                                        (datetime(2023, 1, 1), None)])
+def test_query_matches_a_full_filter(store, readings, start, end):
+    ids = HOUSEHOLDS[:2]
+    expected = readings.filter(pl.col('id').is_in(ids))
+    if start is not None:
+        expected = expected.filter(pl.col('timestamp') >= start)
+    if end is not None:
+        expected = expected.filter(pl.col('timestamp') < end)
+    assert store.query(ids, start, end).equals(expected.sort('id', 'timestamp'))
+
+
+def test_unknown_household(store):
+    with pytest.raises(KeyError, match='Unknown household'):
+        store.query(['x'])
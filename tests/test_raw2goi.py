@@ -0,0 +1,86 @@
+"""Source-priority reconciliation of simel/3_raw2goi.py."""
+
+import importlib
+import io
+
+import pandas as pd
+import pytest
+
+raw2goi = importlib.import_module('3_raw2goi')
+
+
+def raw_text(rows):
+    """Raw file in the layout of 2_user2raw.py: dt;fl;n;[type;in;out;dcm]*n padded to 50 fields."""
+    lines = []
+    for hour, entries in enumerate(rows):
+        fields = [f'2022/01/01 {hour:02d}:00', '0', str(len(entries))]
+        for entry_type, value, dcm in entries:
+            fields += [entry_type, str(value), '0', dcm]
+        lines.append(';'.join(fields + [''] * (50 - len(fields))))
+    return '\n'.join(lines) + '\n'
+
+
+# (entries of a row, kWh or None if it is left out, counter it adds to)
+ROWS = [
+    ([('F5D', 1500, '1')], 1.5, 'unique_count'),
+    ([('P5D', 2000, ''), ('F5D', 1000, '0')], 2.0, 'p5d_wins'),
+    ([('P5D', 1000, ''), ('P5D', 3000, '')], 2.0, 'p5d_mean'),
+    ([('F5D', 500, '2'), ('A5D', 700, '0')], 0.5, 'f5d_wins'),
+    ([('F5D', 1000, '2'), ('F5D', 3000, '1')], 3.0, 'f5d_min'),
+    # A missing DCM never wins
+    ([('F5D', 1000, ''), ('F5D', 2000, '2')], 2.0, 'f5d_min'),
+    ([('F5D', 1000, '1'), ('F5D', 1000, '1'), ('F5D', 4000, '3')], 1.0, 'f5d_mean'),
+    # P1D values are kWh already
+    ([('P1D', 2, '3'), ('P1D', 5, '0'), ('A5D', 100, '0')], 5.0, 'p1d_min'),
+    ([('A5D', 1000, '0'), ('A5D', 2000, '0')], 1.5, 'a5d_mean'),
+    ([('B5D', 4000, '0'), ('RF5D', 4000, '1')], 4.0, 'equal_in'),
+    ([('B5D', 1000, '0'), ('RF5D', 2000, '1')], None, 'skipped'),
+]
+
+
+def test_reconcile_applies_the_source_priority():
+    goi, log_row = raw2goi.raw_to_goi(io.StringIO(raw_text([entries for entries, _, _ in ROWS])), 'user.csv')
+
+    kept = [i for i, (_, kwh, _) in enumerate(ROWS) if kwh is not None]
+    expected = pd.DataFrame({'dt': [f'2022/01/01 {i:02d}:00' for i in kept], 'fl': 0,
+                             'kWh': [ROWS[i][1] for i in kept]}, index=kept)
+    pd.testing.assert_frame_equal(goi, expected)
+
+    counts = dict(zip(raw2goi.COUNTERS, log_row[3:]))
+    assert log_row[:3] == ('user.csv', 3, len(ROWS))
+    assert counts == {name: sum(counter == name for _, _, counter in ROWS) for name in raw2goi.COUNTERS}
+
+
+def test_reconcile_keeps_integer_kwh_when_every_value_column_is_an_integer():
+    single = raw_text([[('P1D', 2, '0')], [('P1D', 3, '0')]])
+    # The second entry's value column has blanks, so it is read as decimal
+    competing = raw_text([[('P1D', 2, '0')], [('P1D', 1, '1'), ('P1D', 3, '0')]])
+
+    integers, _ = raw2goi.raw_to_goi(io.StringIO(single), 'user.csv')
+    decimals, _ = raw2goi.raw_to_goi(io.StringIO(competing), 'user.csv')
+
+    assert integers['kWh'].dtype == 'int64' and integers['kWh'].tolist() == [2, 3]
+    assert decimals['kWh'].dtype == 'float64' and decimals['kWh'].tolist() == [2.0, 3.0]
+
+
+def test_rows_the_rules_cannot_resolve_are_logged_and_skipped(caplog):
+    lines = raw_text([[('F5D', 1000, '1')], [('F5D', 1000, ''), ('F5D', 2000, '')], [('F5D', 3000, '1')]]).splitlines()
+    # More entries than the 11 entry slots of a raw row
+    lines[2] = lines[2].replace(';0;1;', ';0;12;', 1)
+
+    goi, log_row = raw2goi.raw_to_goi(io.StringIO('\n'.join(lines) + '\n'), 'user.csv')
+
+    assert goi['kWh'].tolist() == [1.0]
+    assert log_row[:3] == ('user.csv', 12, 3) and sum(log_row[3:]) == 1
+    errors = sorted(r.getMessage().split(':')[0] for r in caplog.records if r.levelname == 'ERROR')
+    assert errors == ['Error processing row 1 in user.csv', 'Error processing row 2 in user.csv']
+
+
+@pytest.mark.parametrize('text', [
+    '2022/01/01 00:00;0;1;F5D;1000\n',
+    raw_text([[('F5D', 1000, '1')]]).replace(';0;1;', ';0;;', 1),
+    raw_text([[('F5D', 1000, '1')], [('F5D', 'abc', '1')]]),
+], ids=['no entry columns', 'blank entry count', 'text value'])
+def test_files_the_rules_cannot_read_are_rejected(text):
+    with pytest.raises(ValueError):
+        raw2goi.raw_to_goi(io.StringIO(text), 'user.csv')
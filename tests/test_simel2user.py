@@ -0,0 +1,47 @@
+"""Two-phase split of SIMEL files into per-id files in simel/1_simel2user.py."""
+
+import importlib
+
+simel2user = importlib.import_module('1_simel2user')
+
+SIMEL_FILES = {
+    'F5D_0021_20210101.0': ['ES1;2021/01/01 01:00;0;100;0',
+                            'ES2;2021/01/01 01:00;0;200;0',
+                            'ES1;2021/01/01 02:00;0;110;0'],
+    # Larger than the first file, so it is spilled first; a blank value makes its column decimal
+    'P5D_0021_20210101.0': ['ES2;2021/01/01 01:00;0;;0',
+                            'ES3;2021/01/01 01:00;0;300;0',
+                            'ES2;2021/01/01 02:00;0;210;0',
+                            'ES3;2021/01/01 02:00;0;310;0'],
+}
+
+EXPECTED = {
+    'ES1.csv': ['F5D_0021_20210101.0;F5D;ES1;2021/01/01 01:00;0;100;0',
+                'F5D_0021_20210101.0;F5D;ES1;2021/01/01 02:00;0;110;0'],
+    # Chunks in the order of the SIMEL files, not of their completion
+    'ES2.csv': ['F5D_0021_20210101.0;F5D;ES2;2021/01/01 01:00;0;200;0',
+                'P5D_0021_20210101.0;P5D;ES2;2021/01/01 01:00;0;;0',
+                'P5D_0021_20210101.0;P5D;ES2;2021/01/01 02:00;0;210.0;0'],
+    'ES3.csv': ['P5D_0021_20210101.0;P5D;ES3;2021/01/01 01:00;0;300.0;0',
+                'P5D_0021_20210101.0;P5D;ES3;2021/01/01 02:00;0;310.0;0'],
+}
+
+
+def test_split_by_id_appends_every_group_in_the_order_of_the_simel_files(tmp_path):
+    simel_dir, id_dir = tmp_path / 'simel', tmp_path / 'id'
+    simel_dir.mkdir()
+    id_dir.mkdir()
+    for name, lines in SIMEL_FILES.items():
+        (simel_dir / name).write_text('\n'.join(lines) + '\n')
+    # An id file from an earlier run is appended to
+    (id_dir / 'ES1.csv').write_text('earlier\n')
+
+    _, touched = simel2user.split_by_id([str(simel_dir / name) for name in SIMEL_FILES], str(id_dir),
+                                        num_workers=1, num_partitions=2)
+
+    # The spill directory is removed
+    assert sorted(p.name for p in id_dir.iterdir()) == sorted(EXPECTED)
+    assert (id_dir / 'ES1.csv').read_text() == 'earlier\n' + ''.join(line + '\n' for line in EXPECTED['ES1.csv'])
+    for name in ['ES2.csv', 'ES3.csv']:
+        assert (id_dir / name).read_text() == ''.join(line + '\n' for line in EXPECTED[name])
+    assert touched == {'F5D_0021_20210101.0': ['ES1', 'ES2'], 'P5D_0021_20210101.0': ['ES2', 'ES3']}
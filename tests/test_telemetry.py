@@ -0,0 +1,23 @@
+"""Peak memory of nested telemetry measurements."""
+
+import os
+
+import numpy as np
+import pytest
+
+from telemetry import measure
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'), reason='VmHWM is only reset on Linux')
+def test_peak_rss_is_the_peak_of_each_measurement():
+    with measure() as batch:
+        with measure() as large:
+            block = np.ones(50_000_000)  # 400 MB
+            del block
+        with measure() as small:
+            block = np.ones(1_000_000)
+            del block
+
+    assert large['peak_rss_mb'] - small['peak_rss_mb'] > 300
+    assert batch['peak_rss_mb'] >= large['peak_rss_mb']
+    assert '_peak_kb' not in batch and 'children_peak_rss_mb' in batch
@@ -0,0 +1,64 @@
+"""Raw rows built by simel/2_user2raw.py from the lines of a user file."""
+
+import importlib
+
+from telemetry import measure
+
+user2raw = importlib.import_module('2_user2raw')
+
+
+def user_line(file_type, dt, fl, value, dcm='1'):
+    """Line of a user file with the columns `FILE_TYPE_MAP` expects for `file_type`."""
+    dt_col, fl_col, in_col, out_col, dcm_col = user2raw.FILE_TYPE_MAP[file_type]
+    fields = [f'{file_type}_0021_20211031.0', file_type] + ['x'] * (max(dcm_col or 0, out_col) - 1)
+    fields[dt_col], fields[fl_col], fields[in_col], fields[out_col] = dt, fl, value, '0'
+    if dcm_col is not None:
+        fields[dcm_col] = dcm
+    return ';'.join(fields)
+
+
+def raw_row(dt, fl, *entries):
+    fields = [dt, fl, str(len(entries))] + [field for entry in entries for field in entry]
+    return ';'.join(fields + [''] * (50 - len(fields)))
+
+
+LINES = [
+    user_line('F5D', '2021/10/31 03:00', '0', '1500', '2'),
+    user_line('P1D', '2021/10/31 03:00:00', '0', '2'),
+    # The repeated hour of the DST change: fl = 1 moves it an hour back
+    user_line('F5D', '2021/10/31 02:00', '1', '1200'),
+    user_line('F5D', '2021/10/31 02:00', '0', '1100'),
+    # A file delivered twice repeats its lines
+    user_line('F5D', '2021/10/31 03:00', '0', '1500', '2'),
+    user_line('P5D', '2021/10/31 01:00', '0', '900'),
+    'X1_0021_20211031.0;X1;a;b',
+    'F5D_0021_20211031.0;F5D;x;2021/10/31 00:00',
+]
+
+EXPECTED = [
+    raw_row('2021/10/31 01:00', '0', ('P5D', '900', '0', '')),
+    raw_row('2021/10/31 01:00', '1', ('F5D', '1200', '0', '1')),
+    raw_row('2021/10/31 02:00', '0', ('F5D', '1100', '0', '1')),
+    raw_row('2021/10/31 03:00', '0', ('F5D', '1500', '0', '2'), ('P1D', '2', '0', '1')),
+]
+
+
+def test_build_rows_vectorized_groups_the_entries_of_each_hour():
+    assert user2raw.build_rows_vectorized(LINES, user2raw.FILE_TYPE_MAP) == EXPECTED
+    assert user2raw.build_rows(LINES, user2raw.FILE_TYPE_MAP) == EXPECTED
+
+
+def test_lines_outside_the_usual_format_go_through_build_rows(caplog):
+    # A date without zero padding is accepted by strptime
+    lines = LINES[:4] + [user_line('F5D', '2021/10/31 4:00', '0', '700')]
+
+    assert user2raw.build_rows_vectorized(lines, user2raw.FILE_TYPE_MAP) is None
+    with measure() as record:
+        output = user2raw.lines_to_raw(lines, 'user.csv')
+    assert output == EXPECTED[1:] + [raw_row('2021/10/31 04:00', '0', ('F5D', '700', '0', '1'))]
+    assert record['rowwise_files'] == 1
+    assert [r.levelname for r in caplog.records if 'user.csv' in r.getMessage()] == ['WARNING']
+
+    with measure() as record:
+        user2raw.lines_to_raw(LINES, 'user.csv')
+    assert 'rowwise_files' not in record